@@ -0,0 +1,304 @@
+"""
+Vectorized evaluation of stored games with NumPy.
+
+Replaying games one at a time with calculate_grid_from_moves and check_win_condition is far too
+slow for auditing the full history. Here the moves of many games are loaded into one array and the
+final grids, winners, draws and move counts of all of them are computed with array operations.
+
+audit_games streams games from SQLite in chunks of consecutive game ids so memory stays bounded,
+and reports games whose stored status or winner_id disagree with their moves, and players whose
+aggregate fields disagree with the games they played.
+
+Run an audit of the application database with:
+    python -m app.batch_eval
+"""
+from dataclasses import dataclass, field
+from typing import Iterator
+
+import numpy as np
+from sqlalchemy import and_, func
+from sqlmodel import Session, select
+
+from .models import Game, GamePlayer, GameStatus, Move, Player
+
+# Winner order for games where both players have a line, which a valid game can never reach
+CONFLICTING_WINNER = -1
+
+
+@dataclass
+class GameBatch:
+    """Moves of a batch of games that share a board size, as flat arrays"""
+    game_ids: np.ndarray  # (games,) sorted ascending
+    board_rows: int
+    board_cols: int
+    win_length: int
+    move_game_ids: np.ndarray  # (moves,)
+    move_positions: np.ndarray  # (moves,)
+    move_player_orders: np.ndarray  # (moves,) 1 or 2
+
+
+@dataclass
+class BatchResult:
+    """Evaluated state of every game in a GameBatch, indexed like GameBatch.game_ids"""
+    game_ids: np.ndarray  # (games,)
+    grids: np.ndarray  # (games, board_rows, board_cols) 0=empty, 1=player1, 2=player2
+    winner_orders: np.ndarray  # (games,) 0=no winner, 1 or 2, CONFLICTING_WINNER
+    is_draw: np.ndarray  # (games,) board full and no winner
+    move_counts: np.ndarray  # (games, 2) moves made by player1 and player2
+
+
+@dataclass
+class GameMismatch:
+    game_id: int
+    stored_status: GameStatus
+    stored_winner_id: int | None
+    expected_status: GameStatus
+    expected_winner_id: int | None
+
+
+@dataclass
+class PlayerMismatch:
+    player_id: int
+    stored: tuple[int, int, int]  # (games_played, games_won, total_moves)
+    expected: tuple[int, int, int]
+
+
+@dataclass
+class AuditReport:
+    games_checked: int = 0
+    players_checked: int = 0
+    game_mismatches: list[GameMismatch] = field(default_factory=list)
+    player_mismatches: list[PlayerMismatch] = field(default_factory=list)
+
+
+def has_line(occupied: np.ndarray, win_length: int) -> np.ndarray:
+    """
+    For a (games, rows, cols) boolean array, return a (games,) array that is True where
+    the game has win_length occupied cells in a row, column or diagonal.
+    Every window start is checked at once by AND-ing win_length shifted views.
+    """
+    games, rows, cols = occupied.shape
+    found = np.zeros(games, dtype=bool)
+
+    if cols >= win_length:
+        run = occupied[:, :, :cols - win_length + 1].copy()
+        for i in range(1, win_length):
+            run &= occupied[:, :, i:cols - win_length + 1 + i]
+        found |= run.any(axis=(1, 2))
+
+    if rows >= win_length:
+        run = occupied[:, :rows - win_length + 1, :].copy()
+        for i in range(1, win_length):
+            run &= occupied[:, i:rows - win_length + 1 + i, :]
+        found |= run.any(axis=(1, 2))
+
+    if rows >= win_length and cols >= win_length:
+        diagonal = occupied[:, :rows - win_length + 1, :cols - win_length + 1].copy()
+        anti_diagonal = occupied[:, :rows - win_length + 1, win_length - 1:].copy()
+        for i in range(1, win_length):
+            diagonal &= occupied[:, i:rows - win_length + 1 + i, i:cols - win_length + 1 + i]
+            anti_diagonal &= occupied[:, i:rows - win_length + 1 + i, win_length - 1 - i:cols - i]
+        found |= diagonal.any(axis=(1, 2)) | anti_diagonal.any(axis=(1, 2))
+
+    return found
+
+
+def evaluate_batch(batch: GameBatch) -> BatchResult:
+    """Compute final grids, winners, draws and move counts for every game in the batch"""
+    game_count = len(batch.game_ids)
+    cells = batch.board_rows * batch.board_cols
+    game_index = np.searchsorted(batch.game_ids, batch.move_game_ids)
+
+    grids = np.zeros((game_count, cells), dtype=np.int8)
+    grids[game_index, batch.move_positions] = batch.move_player_orders
+    grids = grids.reshape(game_count, batch.board_rows, batch.board_cols)
+
+    move_counts = np.zeros((game_count, 3), dtype=np.int64)
+    np.add.at(move_counts, (game_index, batch.move_player_orders), 1)
+
+    player1_wins = has_line(grids == 1, batch.win_length)
+    player2_wins = has_line(grids == 2, batch.win_length)
+    winner_orders = np.select(
+        [player1_wins & player2_wins, player1_wins, player2_wins],
+        [CONFLICTING_WINNER, 1, 2],
+        default=0,
+    )
+    is_draw = (grids != 0).all(axis=(1, 2)) & ~player1_wins & ~player2_wins
+
+    return BatchResult(
+        game_ids=batch.game_ids,
+        grids=grids,
+        winner_orders=winner_orders,
+        is_draw=is_draw,
+        move_counts=move_counts[:, 1:],
+    )
+
+
+def build_batches(game_rows: list, move_rows: list) -> list[GameBatch]:
+    """
+    Group games by board size into GameBatches.
+    game_rows are (game_id, board_rows, board_cols, win_length), move_rows are
+    (game_id, position, player_order).
+    """
+    games = np.array(game_rows, dtype=np.int64).reshape(-1, 4)
+    moves = np.array(move_rows, dtype=np.int64).reshape(-1, 3)
+
+    batches = []
+    for board_size in np.unique(games[:, 1:], axis=0):
+        size_games = games[(games[:, 1:] == board_size).all(axis=1)]
+        game_ids = np.sort(size_games[:, 0])
+        size_moves = moves[np.isin(moves[:, 0], game_ids)]
+        batches.append(GameBatch(
+            game_ids=game_ids,
+            board_rows=int(board_size[0]),
+            board_cols=int(board_size[1]),
+            win_length=int(board_size[2]),
+            move_game_ids=size_moves[:, 0],
+            move_positions=size_moves[:, 1],
+            move_player_orders=size_moves[:, 2],
+        ))
+    return batches
+
+
+def iter_game_chunks(session: Session, chunk_size: int = 10_000) -> Iterator[list]:
+    """
+    Yield (id, status, winner_id, board_rows, board_cols, win_length) rows of games ordered by id,
+    chunk_size at a time, using keyset pagination on the id
+    """
+    last_id = 0
+    while True:
+        games = list(session.exec(
+            select(Game.id, Game.status, Game.winner_id, Game.board_rows, Game.board_cols, Game.win_length)
+            .where(Game.id > last_id)
+            .order_by(Game.id)
+            .limit(chunk_size)
+        ).all())
+        # A sharded session concatenates a chunk of every shard
+        games = sorted(games, key=lambda game: game[0])[:chunk_size]
+        if not games:
+            return
+        yield games
+        last_id = games[-1][0]
+
+
+def load_moves_for_game_range(session: Session, first_game_id: int, last_game_id: int) -> list:
+    """(game_id, position, player_order) of every move in games first_game_id..last_game_id"""
+    return list(session.exec(
+        select(Move.game_id, Move.position, GamePlayer.player_order)
+        .join(GamePlayer, and_(GamePlayer.game_id == Move.game_id, GamePlayer.player_id == Move.player_id))
+        .where(Move.game_id >= first_game_id, Move.game_id <= last_game_id)
+    ).all())
+
+
+def load_players_for_game_range(session: Session, first_game_id: int, last_game_id: int) -> list:
+    """(game_id, player_id, player_order) of every participant in games first_game_id..last_game_id"""
+    return list(session.exec(
+        select(GamePlayer.game_id, GamePlayer.player_id, GamePlayer.player_order)
+        .where(GamePlayer.game_id >= first_game_id, GamePlayer.game_id <= last_game_id)
+    ).all())
+
+
+def audit_games(session: Session, chunk_size: int = 10_000) -> AuditReport:
+    """
+    Recompute every game's outcome from its moves and every player's aggregates from those
+    outcomes, and report where the stored values disagree.
+    """
+    report = AuditReport()
+    max_player_id = session.exec(select(func.max(Player.id))).one() or 0
+    # Expected (games_played, games_won, total_moves) indexed by player id
+    expected_stats = np.zeros((max_player_id + 1, 3), dtype=np.int64)
+
+    for games in iter_game_chunks(session, chunk_size):
+        first_game_id, last_game_id = games[0][0], games[-1][0]
+        move_rows = load_moves_for_game_range(session, first_game_id, last_game_id)
+        player_rows = load_players_for_game_range(session, first_game_id, last_game_id)
+
+        # players[game_id] = [0, player1_id, player2_id]
+        players: dict[int, list[int]] = {game[0]: [0, 0, 0] for game in games}
+        for game_id, player_id, player_order in player_rows:
+            players[game_id][player_order] = player_id
+
+        # stored[game_id] = (status, winner_id)
+        stored = {game[0]: (game[1], game[2]) for game in games}
+        game_rows = [(game[0], game[3], game[4], game[5]) for game in games]
+        for batch in build_batches(game_rows, move_rows):
+            result = evaluate_batch(batch)
+            finished = (result.winner_orders != 0) | result.is_draw
+
+            for index, game_id in enumerate(result.game_ids.tolist()):
+                stored_status, stored_winner_id = stored[game_id]
+                player_ids = players[game_id]
+                winner_order = int(result.winner_orders[index])
+
+                if finished[index]:
+                    expected_status = GameStatus.FINISHED
+                elif player_ids[2]:
+                    expected_status = GameStatus.IN_PROGRESS
+                else:
+                    expected_status = GameStatus.WAITING
+                expected_winner_id = player_ids[winner_order] if winner_order > 0 else None
+
+                if (
+                    winner_order == CONFLICTING_WINNER
+                    or stored_status != expected_status
+                    or stored_winner_id != expected_winner_id
+                ):
+                    report.game_mismatches.append(GameMismatch(
+                        game_id=game_id,
+                        stored_status=stored_status,
+                        stored_winner_id=stored_winner_id,
+                        expected_status=expected_status,
+                        expected_winner_id=expected_winner_id,
+                    ))
+
+            # Aggregate stats of both participants of every finished game in one pass
+            finished_players = np.array(
+                [players[game_id][1:] for game_id in result.game_ids.tolist()], dtype=np.int64
+            ).reshape(-1, 2)[finished]
+            finished_moves = result.move_counts[finished]
+            finished_winners = result.winner_orders[finished]
+            for order in (1, 2):
+                player_ids = finished_players[:, order - 1]
+                present = (player_ids > 0) & (player_ids <= max_player_id)
+                np.add.at(expected_stats[:, 0], player_ids[present], 1)
+                np.add.at(expected_stats[:, 1], player_ids[present], (finished_winners[present] == order).astype(np.int64))
+                np.add.at(expected_stats[:, 2], player_ids[present], finished_moves[present, order - 1])
+
+        report.games_checked += len(games)
+
+    last_player_id = 0
+    while True:
+        player_rows = list(session.exec(
+            select(Player.id, Player.games_played, Player.games_won, Player.total_moves)
+            .where(Player.id > last_player_id).order_by(Player.id).limit(chunk_size)
+        ).all())
+        if not player_rows:
+            break
+        for player_id, games_played, games_won, total_moves in player_rows:
+            stored_stats = (games_played, games_won, total_moves)
+            expected = tuple(int(value) for value in expected_stats[player_id])
+            if stored_stats != expected:
+                report.player_mismatches.append(PlayerMismatch(player_id=player_id, stored=stored_stats, expected=expected))
+        report.players_checked += len(player_rows)
+        last_player_id = player_rows[-1][0]
+
+    return report
+
+
+if __name__ == "__main__":
+    from .database import new_session
+
+    with new_session() as audit_session:
+        audit_report = audit_games(audit_session)
+
+    print(f"Checked {audit_report.games_checked} games and {audit_report.players_checked} players")
+    for mismatch in audit_report.game_mismatches:
+        print(
+            f"Game {mismatch.game_id}: stored {mismatch.stored_status.value} winner {mismatch.stored_winner_id}, "
+            f"moves say {mismatch.expected_status.value} winner {mismatch.expected_winner_id}"
+        )
+    for mismatch in audit_report.player_mismatches:
+        print(
+            f"Player {mismatch.player_id}: stored (played, won, moves) {mismatch.stored}, "
+            f"games say {mismatch.expected}"
+        )
@@ -0,0 +1,70 @@
+"""
+Application settings, read from environment variables with defaults for a single local server.
+"""
+import os
+import socket
+
+# Get the project root directory (one level up from app/)
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+
+def env_float(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+
+class Settings:
+    """
+    database_async: use the aiosqlite AsyncSession for requests, false selects the sync Session in the threadpool.
+    database_pool_*: connections kept per engine, extra connections allowed under load and seconds to wait for one.
+    database_shards: number of databases the games are hash sharded across, see app/sharding.py. 1 keeps them in database.db.
+    sqlite_*: pragmas applied to every connection, see app/database.py.
+    leaderboard_capacity: players at the top of each leaderboard kept in memory, see app/leaderboards.py.
+    leaderboard_cache_size: serialized leaderboard responses kept for the current leaderboard version.
+    event_feed_size: latest events kept for GET /events clients resuming with Last-Event-ID, see app/event_feed.py.
+    game_store_*: see app/game_store.py.
+    gateway_*: virtual nodes per worker on the hash ring and seconds between worker health checks, see app/gateway.py.
+    gateway_url: set on the workers behind a gateway, matchmaking joins games through it, see app/matchmaking.py.
+    With write behind disabled every move is persisted before the response is sent.
+    """
+    def __init__(self):
+        self.database_async = env_bool("DATABASE_ASYNC", True)
+        self.database_shards = env_int("DATABASE_SHARDS", 1)
+        self.database_pool_size = env_int("DATABASE_POOL_SIZE", 5)
+        self.database_pool_max_overflow = env_int("DATABASE_POOL_MAX_OVERFLOW", 10)
+        self.database_pool_timeout = env_float("DATABASE_POOL_TIMEOUT", 30.0)
+        self.sqlite_journal_mode = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+        self.sqlite_synchronous = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+        self.sqlite_mmap_size = env_int("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)
+        # Negative values are in KiB: 64 MiB of page cache per connection
+        self.sqlite_cache_size = env_int("SQLITE_CACHE_SIZE", -64 * 1024)
+        self.sqlite_busy_timeout = env_int("SQLITE_BUSY_TIMEOUT", 5000)
+        self.leaderboard_capacity = env_int("LEADERBOARD_CAPACITY", 100)
+        self.leaderboard_cache_size = env_int("LEADERBOARD_CACHE_SIZE", 256)
+        self.event_feed_size = env_int("EVENT_FEED_SIZE", 1000)
+        self.game_store_write_behind = env_bool("GAME_STORE_WRITE_BEHIND", True)
+        self.game_store_flush_interval = env_float("GAME_STORE_FLUSH_INTERVAL", 0.05)
+        self.game_store_batch_size = env_int("GAME_STORE_BATCH_SIZE", 500)
+        self.game_store_journal_path = os.environ.get(
+            "GAME_STORE_JOURNAL_PATH", os.path.join(PROJECT_ROOT, "game_store.journal")
+        )
+        self.game_store_journal_fsync = env_bool("GAME_STORE_JOURNAL_FSYNC", True)
+        self.game_store_leases = env_bool("GAME_STORE_LEASES", False)
+        self.game_store_lease_ttl = env_float("GAME_STORE_LEASE_TTL", 10.0)
+        self.game_store_node_id = os.environ.get("GAME_STORE_NODE_ID", f"{socket.gethostname()}:{os.getpid()}")
+        self.gateway_virtual_nodes = env_int("GATEWAY_VIRTUAL_NODES", 100)
+        self.gateway_health_interval = env_float("GATEWAY_HEALTH_INTERVAL", 2.0)
+        self.gateway_url = os.environ.get("GATEWAY_URL")
+
+
+settings = Settings()
@@ -1,5 +1,29 @@
-from sqlmodel import Session, select
-from .models import Player, Game, GamePlayer, Move, GameStatus
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Iterable, Sequence
+
+from sqlalchemy import case, delete, func, insert, literal, literal_column, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import selectinload
+from sqlmodel import Session, col, select
+from .models import Player, Game, GameLease, GamePlayer, LeaderboardMetric, LeaderboardVersion, Move, GameStatus
+from .sharding import choose_new_game_shard, game_shard_count, next_game_id
+
+if TYPE_CHECKING:
+    from .game_store import MoveEvent
+    from .schemas import GameImport
+
+
+# Players updated by update_player_stats_on_game_finish in the session's transaction, in session.info:
+# player id -> (id, games_played, games_won, total_moves, stats_version). Applied to the leaderboards on commit.
+UPDATED_PLAYERS_KEY = "updated_players"
+PLAYER_STATS_CHUNK_SIZE = 500
+
+
+class GameVersionConflict(Exception):
+    """A game changed since the version a join or move was validated against"""
+    def __init__(self, game_id: int):
+        super().__init__(f"Game {game_id} was changed by another request")
+        self.game_id = game_id
 
 
 def create_player(session: Session) -> Player:
@@ -10,10 +34,37 @@ def create_player(session: Session) -> Player:
     return player
 
 
+def create_players(session: Session, count: int) -> list[int]:
+    """
+    Create count players with one INSERT ... SELECT from a recursive counter, and return their ids in order.
+    Much faster than an INSERT per player or a multi-row VALUES list for large counts.
+    """
+    counter = select(literal(1).label("n")).cte("counter", recursive=True)
+    counter = counter.union_all(select(counter.c.n + 1).where(counter.c.n < count))
+    columns = select(literal(0), literal(0), literal(0), literal(0), literal(datetime.now(timezone.utc))).select_from(counter)
+    player_ids = session.scalars(
+        insert(Player)
+        .from_select(["games_played", "games_won", "total_moves", "stats_version", "created_at"], columns)
+        .returning(col(Player.id))
+    ).all()
+    session.commit()
+    # SQLite returns the rows in no particular order
+    return sorted(player_ids)  # type: ignore[type-var]
+
+
 def get_player(session: Session, player_id: int) -> Player | None:
     return session.get(Player, player_id)
 
 
+def get_players(session: Session, player_ids: Iterable[int]) -> dict[int, Player]:
+    """Players by id, fetched in one query"""
+    player_ids = set(player_ids)
+    if not player_ids:
+        return {}
+    players = session.exec(select(Player).where(col(Player.id).in_(player_ids))).all()
+    return {player.id: player for player in players if player.id is not None}
+
+
 def get_player_unfinished_game(session: Session, player_id: int) -> Game | None:
     return session.exec(
         select(Game)
@@ -23,8 +74,12 @@ def get_player_unfinished_game(session: Session, player_id: int) -> Game | None:
     ).first()
 
 
-def create_game(session: Session, player_id: int) -> Game:
-    new_game = Game(status=GameStatus.WAITING)
+def create_game(
+    session: Session, player_id: int, board_rows: int = 3, board_cols: int = 3, win_length: int = 3
+) -> Game:
+    new_game = Game(
+        status=GameStatus.WAITING, board_rows=board_rows, board_cols=board_cols, win_length=win_length
+    )
     session.add(new_game)
     session.flush()  # Get game ID
 
@@ -37,28 +92,64 @@ def create_game(session: Session, player_id: int) -> Game:
 
 
 def get_game(session: Session, game_id: int) -> Game | None:
-    return session.get(Game, game_id)
+    """Get a game with its game_players loaded"""
+    return session.get(Game, game_id, options=[selectinload(Game.game_players)])
 
 
-def join_game(session: Session, game_id: int, player_id: int) -> Game:
+def join_game(session: Session, game_id: int, player_id: int, expected_version: int | None = None) -> Game:
+    """
+    Add the second player and start the game, if it is still waiting and, when expected_version
+    is given, still at that version. Raises GameVersionConflict otherwise, before writing anything.
+    """
+    statement = update(Game).where(col(Game.id) == game_id, col(Game.status) == GameStatus.WAITING)
+    if expected_version is not None:
+        statement = statement.where(col(Game.version) == expected_version)
+    result = session.execute(statement.values(status=GameStatus.IN_PROGRESS, version=col(Game.version) + 1))
+    if result.rowcount == 0:  # type: ignore[attr-defined]
+        raise GameVersionConflict(game_id)
+
     game_player = GamePlayer(game_id=game_id, player_id=player_id, player_order=2)
     session.add(game_player)
+    session.commit()
 
-    # Start the game after joining
     game = session.get(Game, game_id)
-    if game:
-        game.status = GameStatus.IN_PROGRESS
-
-    session.commit()
-    if game:
-        session.refresh(game)
     assert game is not None
+    session.refresh(game)
     return game
 
-def get_available_games(session: Session) -> list[Game]:
-    return list(session.exec(
-        select(Game).where(Game.status == GameStatus.WAITING)
-    ).all())
+def get_available_games(
+    session: Session,
+    after_id: int | None = None,
+    limit: int | None = None,
+    created_after: datetime | None = None,
+    exclude_player_id: int | None = None,
+) -> list[Game]:
+    """
+    Waiting games in id order with their game_players loaded in one more query, not one per game.
+    Keyset pagination: pass the last id of the previous page as after_id.
+    On sharded databases every shard returns a page and the pages are merged.
+    created_after without a timezone is taken as UTC, like the stored created_at.
+    """
+    statement = select(Game).where(Game.status == GameStatus.WAITING)
+    if after_id is not None:
+        statement = statement.where(col(Game.id) > after_id)
+    if created_after is not None:
+        if created_after.tzinfo is not None:
+            created_after = created_after.astimezone(timezone.utc).replace(tzinfo=None)
+        statement = statement.where(col(Game.created_at) > created_after)
+    if exclude_player_id is not None:
+        statement = statement.where(~select(GamePlayer).where(
+            GamePlayer.game_id == Game.id, GamePlayer.player_id == exclude_player_id
+        ).exists())
+
+    statement = statement.order_by(col(Game.id)).options(selectinload(Game.game_players))
+    if limit is not None:
+        statement = statement.limit(limit)
+    games = list(session.exec(statement).all())
+    if game_shard_count(session) > 1:
+        games.sort(key=lambda game: game.id)  # type: ignore[arg-type, return-value]
+        games = games[:limit]
+    return games
 
 
 def get_moves_for_game(session: Session, game_id: int) -> list[Move]:
@@ -69,19 +160,302 @@ def get_moves_for_game(session: Session, game_id: int) -> list[Move]:
     ).all())
 
 
-def create_move(
-    session: Session, game_id: int, player_id: int, position: int, move_number: int
-) -> Move:
-    move = Move(
-        game_id=game_id, player_id=player_id, position=position, move_number=move_number
+def get_players_with_wins(session: Session) -> list[Player]:
+    return list(session.exec(
+        select(Player).where(Player.games_won > 0)
+    ).all())
+
+
+LEADERBOARD_COLUMN = {
+    LeaderboardMetric.WINS: col(Player.games_won),
+    LeaderboardMetric.WIN_RATE: col(Player.win_rate),
+    LeaderboardMetric.EFFICIENCY: col(Player.efficiency),
+}
+# Fewer moves per win rank first, the other metrics rank higher values first
+LEADERBOARD_ASCENDING = {LeaderboardMetric.EFFICIENCY}
+
+
+def get_leaderboard(
+    session: Session, metric: LeaderboardMetric, limit: int, offset: int = 0
+) -> list[tuple[Player, int]]:
+    """
+    A page of a leaderboard of the players with wins, as (player, rank) in leaderboard order.
+    Tied players share a rank and are ordered by id, so pages neither overlap nor skip players.
+    Both queries are served by the metric's rank index, ordered by the metric then id: the page
+    visits offset + limit rows, and the rank of a page after the first counts the players ahead of it.
+    """
+    column = LEADERBOARD_COLUMN[metric]
+    ascending = metric in LEADERBOARD_ASCENDING
+    players = session.exec(
+        select(Player)
+        .where(Player.games_won > 0)
+        .order_by(column.asc() if ascending else column.desc(), col(Player.id))
+        .limit(limit)
+        .offset(offset)
+    ).all()
+    if not players:
+        return []
+
+    rank = 1
+    if offset:
+        first_value = getattr(players[0], column.key)
+        ahead = column < first_value if ascending else column > first_value
+        rank += session.exec(
+            select(func.count())
+            .select_from(Player)
+            # Without the likelihood SQLite counts on the wins index whatever the metric
+            .where(Player.games_won > 0, func.likelihood(ahead, literal_column("0.01")))
+        ).one()
+    page = []
+    for index, player in enumerate(players):
+        if index and getattr(player, column.key) != getattr(players[index - 1], column.key):
+            rank = offset + index + 1
+        page.append((player, rank))
+    return page
+
+
+def get_players_with_wins_changed_after(session: Session, stats_version: int) -> list[Player]:
+    return list(session.exec(
+        select(Player).where(Player.stats_version > stats_version, Player.games_won > 0)
+    ).all())
+
+
+def get_leaderboard_version(session: Session) -> int:
+    version = session.exec(select(LeaderboardVersion.version).where(LeaderboardVersion.id == 1)).first()
+    return version or 0
+
+
+def increment_leaderboard_version(session: Session) -> int:
+    """
+    Increment the leaderboard version in the current transaction and return the new version.
+    The UPDATE takes SQLite's write lock, so versions are handed out in commit order across processes.
+    """
+    version = session.exec(
+        update(LeaderboardVersion)
+        .where(col(LeaderboardVersion.id) == 1)
+        .values(version=LeaderboardVersion.version + 1)
+        .returning(LeaderboardVersion.version)
+    ).scalar()
+    if version is None:
+        # Databases that were not migrated, like the tests' in memory database
+        session.add(LeaderboardVersion(id=1, version=1))
+        session.flush()
+        version = 1
+    return version
+
+
+def update_player_stats_on_game_finish(session: Session, player_results: Sequence[tuple[int, int, bool]]) -> None:
+    """
+    Update player statistics when a game finishes (win or draw)
+    player_results holds (player_id, moves made, won) for each player of the game, or of several games.
+    The updated players get a new stats_version, see app/leaderboards.py.
+    Players are not read, the increments of up to PLAYER_STATS_CHUNK_SIZE players are applied by one
+    UPDATE ... RETURNING, and the returned rows are recorded under UPDATED_PLAYERS_KEY.
+    """
+    if not player_results:
+        return
+
+    stats_version = increment_leaderboard_version(session)
+    # games played, moves made and games won of each player
+    increments: dict[int, list[int]] = {}
+    for player_id, moves_made, won in player_results:
+        increment = increments.setdefault(player_id, [0, 0, 0])
+        increment[0] += 1
+        increment[1] += moves_made
+        increment[2] += int(won)
+
+    updated_players = session.info.setdefault(UPDATED_PLAYERS_KEY, {})
+    player_ids = list(increments)
+    for start in range(0, len(player_ids), PLAYER_STATS_CHUNK_SIZE):
+        chunk = player_ids[start:start + PLAYER_STATS_CHUNK_SIZE]
+
+        def increment_of(field: int):
+            return case({player_id: increments[player_id][field] for player_id in chunk}, value=col(Player.id), else_=0)
+
+        rows = session.execute(
+            update(Player)
+            .where(col(Player.id).in_(chunk))
+            .values(
+                games_played=col(Player.games_played) + increment_of(0),
+                total_moves=col(Player.total_moves) + increment_of(1),
+                games_won=col(Player.games_won) + increment_of(2),
+                stats_version=stats_version,
+            )
+            .returning(Player.id, Player.games_played, Player.games_won, Player.total_moves, Player.stats_version),
+            execution_options={"synchronize_session": "fetch"},
+        ).all()
+        for row in rows:
+            updated_players[row[0]] = tuple(row)
+
+
+def apply_move_events(session: Session, events: Sequence["MoveEvent"], skip_existing: bool = False) -> None:
+    """
+    Persist moves recorded by the game store in a single transaction:
+    the Move rows, the new turn, status, winner and board of their games,
+    and the statistics of the players of games that finished.
+    Each game is updated with a conditional UPDATE on the version before the move, a game changed
+    by another request meanwhile raises GameVersionConflict and nothing is committed.
+    With skip_existing, events whose move is already stored are ignored so a journal can be replayed safely.
+    Players and existing moves are fetched in bulk, not per event.
+    """
+    existing_moves = set()
+    if skip_existing and events:
+        existing_moves = set(session.exec(
+            select(Move.game_id, Move.move_number).where(col(Move.game_id).in_({event.game_id for event in events}))
+        ).all())
+
+    player_results = []
+    for event in events:
+        if (event.game_id, event.move_number) in existing_moves:
+            continue
+        existing_moves.add((event.game_id, event.move_number))
+
+        # Update the game first, a conflicting move adds no Move row
+        statement = update(Game).where(col(Game.id) == event.game_id)
+        if event.version is not None:
+            statement = statement.where(col(Game.version) == event.version - 1)
+        result = session.execute(statement.values(
+            current_turn_number=event.move_number + 1,
+            status=event.status,
+            winner_id=event.winner_id,
+            board=event.board,
+            version=col(Game.version) + 1,
+        ))
+        if result.rowcount == 0:  # type: ignore[attr-defined]
+            raise GameVersionConflict(event.game_id)
+
+        session.add(Move(
+            game_id=event.game_id,
+            player_id=event.player_id,
+            position=event.position,
+            move_number=event.move_number,
+        ))
+        player_results.extend(event.player_results)
+
+    update_player_stats_on_game_finish(session, player_results)
+    session.commit()
+
+
+def import_games(session: Session, games: Sequence[tuple["GameImport", int, bytes]]) -> list[int]:
+    """
+    Store complete games played elsewhere as finished, in a single transaction.
+    games holds (game, winner player order or 0 for a draw, final board) of games validated with
+    game_logic.validate_complete_game. Games, game players and moves are inserted with executemany,
+    and the aggregates of their players are updated like when games finish here.
+    On sharded databases the games of an import are stored on one shard.
+    Returns the ids of the new games, in order.
+    """
+    if not games:
+        return []
+
+    now = datetime.now(timezone.utc)
+    game_rows = [
+        {
+            "status": GameStatus.FINISHED,
+            "current_turn_number": len(game.positions) + 1,
+            "winner_id": (game.player1_id, game.player2_id)[winner_order - 1] if winner_order else None,
+            "board": board,
+            "board_rows": game.board_rows,
+            "board_cols": game.board_cols,
+            "win_length": game.win_length,
+            # A join and one version per move, like a game played here
+            "version": len(game.positions) + 1,
+            "created_at": now,
+        }
+        for game, winner_order, board in games
+    ]
+    shard_count = game_shard_count(session)
+    bind_arguments = {}
+    if shard_count > 1:
+        # Sharded, the rows are inserted on the chosen shard with Core statements
+        shard = choose_new_game_shard(shard_count)
+        bind_arguments = {"shard_id": shard}
+        game_table = Game.__table__  # type: ignore[attr-defined]
+        # The first INSERT allocates the first id and takes the shard's write lock until commit, the others follow it
+        first_id = session.scalars(
+            insert(game_table).values(id=next_game_id(shard, shard_count), **game_rows[0]).returning(game_table.c.id),
+            bind_arguments=bind_arguments,
+        ).one()
+        game_ids = [first_id + index * shard_count for index in range(len(game_rows))]
+        if len(game_rows) > 1:
+            session.execute(
+                insert(game_table), [{"id": game_id, **row} for game_id, row in zip(game_ids[1:], game_rows[1:])],
+                bind_arguments=bind_arguments,
+            )
+    else:
+        game_ids = session.scalars(
+            insert(Game).returning(col(Game.id), sort_by_parameter_order=True), game_rows
+        ).all()
+
+    game_players = []
+    moves = []
+    player_results = []
+    for game_id, (game, winner_order, _) in zip(game_ids, games):
+        player_ids = (game.player1_id, game.player2_id)
+        for player_order, player_id in enumerate(player_ids, start=1):
+            game_players.append({"game_id": game_id, "player_id": player_id, "player_order": player_order, "joined_at": now})
+            # Player 1 makes the odd numbered moves
+            moves_made = (len(game.positions) + 2 - player_order) // 2
+            player_results.append((player_id, moves_made, winner_order == player_order))
+        for index, position in enumerate(game.positions):
+            moves.append({
+                "game_id": game_id,
+                "player_id": player_ids[index % 2],
+                "position": position,
+                "move_number": index + 1,
+                "created_at": now,
+            })
+
+    session.execute(insert(GamePlayer.__table__), game_players, bind_arguments=bind_arguments)  # type: ignore[attr-defined]
+    session.execute(insert(Move.__table__), moves, bind_arguments=bind_arguments)  # type: ignore[attr-defined]
+    update_player_stats_on_game_finish(session, player_results)
+    session.commit()
+    return list(game_ids)
+
+
+def acquire_game_lease(session: Session, game_id: int, owner: str, ttl: float, now: float) -> GameLease | None:
+    """
+    Claim or renew the lease of a game until now + ttl, with one upsert.
+    It is granted when the game has no lease, its lease expired or owner already holds it.
+    Returns the lease, or None if another owner holds it.
+    """
+    lease_table = GameLease.__table__  # type: ignore[attr-defined]
+    statement = sqlite_insert(lease_table).values(game_id=game_id, owner=owner, expires_at=now + ttl, epoch=1)
+    statement = statement.on_conflict_do_update(
+        index_elements=[lease_table.c.game_id],
+        set_={
+            "owner": owner,
+            "expires_at": now + ttl,
+            # Taken over from another owner
+            "epoch": case((lease_table.c.owner == owner, lease_table.c.epoch), else_=lease_table.c.epoch + 1),
+        },
+        where=(lease_table.c.owner == owner) | (lease_table.c.expires_at <= now),
+    ).returning(lease_table.c.epoch)
+    epoch = session.scalars(statement).first()
+    session.commit()
+    if epoch is None:
+        return None
+    return GameLease(game_id=game_id, owner=owner, expires_at=now + ttl, epoch=epoch)
+
+
+def release_game_leases(session: Session, game_ids: Iterable[int], owner: str) -> int:
+    """
+    Expire the leases owner holds on games, so other processes can take them right away.
+    The rows are kept so the next owner's epoch still changes. Returns the number of leases released.
+    """
+    game_ids = set(game_ids)
+    if not game_ids:
+        return 0
+    result = session.execute(
+        update(GameLease)
+        .where(col(GameLease.game_id).in_(game_ids), col(GameLease.owner) == owner)
+        .values(expires_at=0.0)
     )
-    session.add(move)
     session.commit()
-    session.refresh(move)
-    return move
+    return result.rowcount  # type: ignore[attr-defined]
 
 
-def get_players_with_wins(session: Session) -> list[Player]:
-    return list(session.exec(
-        select(Player).where(Player.games_won > 0)
-    ).all())
\ No newline at end of file
+def delete_game_lease(session: Session, game_id: int) -> None:
+    """Delete the lease of a finished game, whoever holds it: no process caches it anymore"""
+    session.execute(delete(GameLease).where(col(GameLease.game_id) == game_id))
+    session.commit()
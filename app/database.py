@@ -1,27 +1,178 @@
 # Simple SQLite setup
-import os
-from typing import Annotated
+from contextlib import AbstractAsyncContextManager, asynccontextmanager
+from typing import Annotated, AsyncGenerator, Callable, TypeVar
 from fastapi import Depends
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Engine, event
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 from sqlmodel import create_engine, Session, SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.config import PROJECT_ROOT, Settings, settings
 from app.models import Player, Game, GamePlayer, Move
+from app.migrations import run_migrations
+from app.sharding import GLOBAL_SHARD, ShardedSession
 
-# Get the project root directory (one level up from app/)
-PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+T = TypeVar("T")
 
 # Create database in project root directory
 sqlite_file_name = "database.db"
-sqlite_file_path = os.path.join(PROJECT_ROOT, sqlite_file_name)
+sqlite_file_path = f"{PROJECT_ROOT}/{sqlite_file_name}"
 sqlite_url = f"sqlite:///{sqlite_file_path}"
+async_sqlite_url = f"sqlite+aiosqlite:///{sqlite_file_path}"
+
+
+def shard_file_path(shard: int) -> str:
+    """Database of the games of a shard, next to the global database.db, see app/sharding.py"""
+    return f"{PROJECT_ROOT}/database.shard{shard}.db"
+
+JOURNAL_MODES = {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}
+SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+
+def sqlite_pragmas(config: Settings = settings) -> list[str]:
+    """
+    Pragmas applied to every new connection.
+    WAL lets readers run alongside the single writer, and with synchronous=NORMAL a commit no
+    longer waits for an fsync (the WAL is synced at checkpoints). busy_timeout makes a writer
+    wait for the lock instead of failing with "database is locked".
+    """
+    journal_mode = config.sqlite_journal_mode.upper()
+    synchronous = config.sqlite_synchronous.upper()
+    if journal_mode not in JOURNAL_MODES:
+        raise ValueError(f"Unsupported SQLite journal mode: {config.sqlite_journal_mode}")
+    if synchronous not in SYNCHRONOUS_MODES:
+        raise ValueError(f"Unsupported SQLite synchronous mode: {config.sqlite_synchronous}")
+
+    return [
+        f"PRAGMA journal_mode={journal_mode}",
+        f"PRAGMA synchronous={synchronous}",
+        f"PRAGMA mmap_size={int(config.sqlite_mmap_size)}",
+        f"PRAGMA cache_size={int(config.sqlite_cache_size)}",
+        f"PRAGMA busy_timeout={int(config.sqlite_busy_timeout)}",
+    ]
+
+
+def apply_sqlite_pragmas(engine: Engine, config: Settings = settings) -> None:
+    pragmas = sqlite_pragmas(config)
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def pool_options(config: Settings = settings) -> dict:
+    return {
+        "pool_size": config.database_pool_size,
+        "max_overflow": config.database_pool_max_overflow,
+        "pool_timeout": config.database_pool_timeout,
+    }
+
+
+def create_sqlite_engine(url: str, config: Settings = settings) -> Engine:
+    """Engine for a SQLite file with the settings' pragmas and pool sizing"""
+    sqlite_engine = create_engine(url, connect_args={"check_same_thread": False}, **pool_options(config))
+    apply_sqlite_pragmas(sqlite_engine, config)
+    return sqlite_engine
+
+
+def create_async_sqlite_engine(url: str, config: Settings = settings) -> AsyncEngine:
+    """aiosqlite engine for a SQLite file with the settings' pragmas and pool sizing"""
+    sqlite_engine = create_async_engine(url, **pool_options(config))
+    apply_sqlite_pragmas(sqlite_engine.sync_engine, config)
+    return sqlite_engine
+
+
+engine = create_sqlite_engine(sqlite_url)
+async_engine = create_async_sqlite_engine(async_sqlite_url)
+
+# With a single database the games are stored in database.db
+shard_engines: dict[int, Engine] = {}
+async_shard_engines: dict[int, AsyncEngine] = {}
+if settings.database_shards > 1:
+    for shard in range(settings.database_shards):
+        shard_engines[shard] = create_sqlite_engine(f"sqlite:///{shard_file_path(shard)}")
+        async_shard_engines[shard] = create_async_sqlite_engine(f"sqlite+aiosqlite:///{shard_file_path(shard)}")
 
-connect_args = {"check_same_thread": False}
-engine = create_engine(sqlite_url, connect_args=connect_args)
 
 def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+    # Every database gets the whole schema, the shards only use the game tables
+    for db_engine in [engine, *shard_engines.values()]:
+        SQLModel.metadata.create_all(db_engine)
+        run_migrations(db_engine)
+
+
+def new_session() -> Session:
+    """Session of the global database, routing the games to the shards when sharded"""
+    if shard_engines:
+        return ShardedSession(shards={GLOBAL_SHARD: engine, **shard_engines})
+    return Session(engine)
+
+
+def new_async_session() -> AsyncSession:
+    # Objects are used after commit outside of the session's greenlet, so they must not expire
+    if async_shard_engines:
+        shards = {GLOBAL_SHARD: async_engine.sync_engine}
+        shards.update((shard, shard_engine.sync_engine) for shard, shard_engine in async_shard_engines.items())
+        return AsyncSession(sync_session_class=ShardedSession, shards=shards, expire_on_commit=False)
+    return AsyncSession(async_engine, expire_on_commit=False)
 
 
 def get_session():
-    with Session(engine) as session:
+    with new_session() as session:
         yield session
 
 SessionDep = Annotated[Session, Depends(get_session)]
+
+
+class AsyncDatabase:
+    """
+    Runs the sync crud functions on an AsyncSession without blocking the event loop.
+    The function gets the session's sync Session and its SQL is executed through aiosqlite.
+    """
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        return await self.session.run_sync(fn, *args, **kwargs)
+
+
+class SyncDatabase:
+    """Runs the sync crud functions on a Session in the threadpool, the selectable sync path"""
+    def __init__(self, session: Session):
+        self.session = session
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        return await run_in_threadpool(fn, self.session, *args, **kwargs)
+
+
+Database = AsyncDatabase | SyncDatabase
+
+
+async def get_database() -> AsyncGenerator[Database, None]:
+    """
+    Database for async endpoints: `await db.run(crud.get_game, game_id)`.
+    Everything that touches lazy loaded relationships must run inside db.run.
+    """
+    if settings.database_async:
+        async with new_async_session() as session:
+            yield AsyncDatabase(session)
+    else:
+        with new_session() as session:
+            yield SyncDatabase(session)
+
+DatabaseDep = Annotated[Database, Depends(get_database)]
+
+DatabaseFactory = Callable[[], AbstractAsyncContextManager[Database]]
+
+
+def get_database_factory() -> DatabaseFactory:
+    """
+    Opens a Database on demand: `async with open_database() as db: ...`
+    For endpoints that outlive a request, like WebSockets, so they don't hold a pooled connection while idle.
+    """
+    return asynccontextmanager(get_database)
+
+DatabaseFactoryDep = Annotated[DatabaseFactory, Depends(get_database_factory)]
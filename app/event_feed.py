@@ -0,0 +1,81 @@
+"""
+Process local feed of the game and leaderboard events, streamed by GET /events.
+
+The handlers publish an event for every game created, joined and finished, and a
+leaderboard-changed event with the players whose statistics changed. Events get increasing ids
+and the latest ones are kept in a ring buffer, so a client reconnecting with Last-Event-ID gets
+the events it missed. A client further behind than the buffer, or with an id from a previous
+process, has lost events and must reload its snapshots.
+"""
+import asyncio
+from collections import deque
+from itertools import islice
+from typing import Annotated, Any, NamedTuple
+
+from fastapi import Depends
+
+from .config import settings
+
+
+class EventType:
+    GAME_CREATED = "game-created"
+    GAME_JOINED = "game-joined"
+    GAME_FINISHED = "game-finished"
+    LEADERBOARD_CHANGED = "leaderboard-changed"
+
+
+class FeedEvent(NamedTuple):
+    id: int
+    type: str
+    data: Any
+
+
+class EventFeed:
+    def __init__(self, size: int = settings.event_feed_size):
+        self._events: deque[FeedEvent] = deque(maxlen=size)
+        self.last_id = 0
+        # Set and replaced by every publish, waking the waiting streams
+        self._published = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def publish(self, type: str, data: Any) -> FeedEvent:
+        """Add an event. Must be called from the event loop."""
+        self.last_id += 1
+        event = FeedEvent(self.last_id, type, data)
+        self._events.append(event)
+        self._published.set()
+        self._published = asyncio.Event()
+        return event
+
+    def events_after(self, last_id: int) -> tuple[list[FeedEvent], bool]:
+        """
+        The events after last_id, and whether events after it were lost:
+        dropped from the buffer or published by a previous process
+        """
+        if last_id > self.last_id:
+            return list(self._events), True
+        oldest_id = self._events[0].id if self._events else self.last_id + 1
+        # Ids are consecutive, the events after last_id start at its offset from the oldest one
+        start = max(last_id + 1 - oldest_id, 0)
+        return list(islice(self._events, start, None)), last_id + 1 < oldest_id
+
+    async def wait(self, last_id: int, timeout: float) -> bool:
+        """Wait up to timeout seconds for an event after last_id, returns whether there is one"""
+        if self.last_id > last_id:
+            return True
+        try:
+            await asyncio.wait_for(self._published.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+event_feed = EventFeed()
+
+
+def get_event_feed() -> EventFeed:
+    return event_feed
+
+EventFeedDep = Annotated[EventFeed, Depends(get_event_feed)]
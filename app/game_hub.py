@@ -0,0 +1,60 @@
+"""
+Process local publish/subscribe hub of game updates.
+
+The join and move handlers publish the GamePublic they respond with, while holding the game's
+lock, so every subscriber of a game gets its updates in order. Subscribers are the
+/games/{id}/ws WebSockets.
+
+Each subscriber has a bounded queue. Updates are full game states, so a subscriber that falls
+behind loses its oldest updates, never the latest one. Only subscribers of the process that
+handled the change are notified, like the game store assumes a single process serves the games.
+"""
+import asyncio
+from contextlib import contextmanager
+from typing import Annotated, Iterator
+
+from fastapi import Depends
+
+from .schemas import GamePublic
+
+SUBSCRIBER_QUEUE_SIZE = 16
+
+
+class GameHub:
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: dict[int, set[asyncio.Queue[GamePublic]]] = {}
+
+    def subscriber_count(self, game_id: int) -> int:
+        return len(self._subscribers.get(game_id, ()))
+
+    @contextmanager
+    def subscribe(self, game_id: int) -> Iterator[asyncio.Queue[GamePublic]]:
+        """Queue of the updates of a game published while the context is open"""
+        queue: asyncio.Queue[GamePublic] = asyncio.Queue(self.queue_size)
+        self._subscribers.setdefault(game_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            subscribers = self._subscribers.get(game_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[game_id]
+
+    def publish(self, update: GamePublic) -> None:
+        """Send an update of a game to its subscribers. Must be called from the event loop."""
+        for queue in self._subscribers.get(update.id, ()):
+            if queue.full():
+                # Drop the oldest state, the update supersedes it
+                queue.get_nowait()
+            queue.put_nowait(update)
+
+
+game_hub = GameHub()
+
+
+def get_game_hub() -> GameHub:
+    return game_hub
+
+GameHubDep = Annotated[GameHub, Depends(get_game_hub)]
@@ -14,6 +14,14 @@ WIN_PATTERNS = [
     [2, 4, 6],
 ]
 
+# Bitboard representation: each player owns an int where bit N is set if that
+# player occupies grid position N. A board is the (player1, player2) pair.
+# Position N is row N // board_cols, column N % board_cols.
+EMPTY_BITBOARDS = (0, 0)
+
+# Directions (row step, column step) of the four lines through a position
+LINE_DIRECTIONS = [(0, 1), (1, 0), (1, 1), (1, -1)]
+
 def calculate_grid_from_moves(
     moves: list[Move], game_players: list[GamePlayer]
 ) -> list[int]:
@@ -30,6 +38,41 @@ def calculate_grid_from_moves(
 
     return grid
     
+def apply_move_to_bitboards(bitboards: tuple[int, int], position: int, player_number: int) -> tuple[int, int]:
+    """Return new bitboards with the position marked for the given player"""
+    player1_board, player2_board = bitboards
+    if player_number == 1:
+        return player1_board | (1 << position), player2_board
+    return player1_board, player2_board | (1 << position)
+
+def get_turn_number_from_bitboards(bitboards: tuple[int, int]) -> int:
+    """Turn number of the next move, derived from the number of occupied positions"""
+    return (bitboards[0] | bitboards[1]).bit_count() + 1
+
+def grid_from_bitboards(bitboards: tuple[int, int], board_rows: int = 3, board_cols: int = 3) -> list[list[int]]:
+    """Build the GamePublic grid (0=empty, 1=player1, 2=player2) from bitboards"""
+    player1_board, player2_board = bitboards
+    cells = [
+        1 if player1_board >> pos & 1 else 2 if player2_board >> pos & 1 else 0
+        for pos in range(board_rows * board_cols)
+    ]
+    return [cells[row * board_cols:(row + 1) * board_cols] for row in range(board_rows)]
+
+def encode_bitboards(bitboards: tuple[int, int]) -> bytes:
+    """
+    Encode bitboards into the compact form stored on Game.board.
+    Both bitboards are stored as little endian bytes of the same width, player1 first.
+    """
+    width = (max(bitboards[0].bit_length(), bitboards[1].bit_length()) + 7) // 8
+    return bitboards[0].to_bytes(width, "little") + bitboards[1].to_bytes(width, "little")
+
+def decode_bitboards(board: bytes | None) -> tuple[int, int]:
+    """Decode Game.board back into bitboards, an empty value is an empty board"""
+    if not board:
+        return EMPTY_BITBOARDS
+    width = len(board) // 2
+    return int.from_bytes(board[:width], "little"), int.from_bytes(board[width:], "little")
+
 def validate_player_can_join_new_game(unfinished_game : Game | None) -> tuple[bool, int, str]:
     """
     Check if player has unfinished games before joining/creating a new game
@@ -104,4 +147,72 @@ def validate_move(grid: list[int], position: int) -> tuple[bool, int, str]:
     if grid[position] != 0:
         return False, 409, "Position already occupied"
 
-    return True, 200, "Valid move"
\ No newline at end of file
+    return True, 200, "Valid move"
+
+
+def check_win_from_last_move(board: int, position: int, board_rows: int, board_cols: int, win_length: int) -> bool:
+    """
+    Check if the move at position completed win_length in a row on the player's bitboard.
+    Only the four lines through the last move can have changed, so only those are scanned,
+    at most win_length - 1 cells in each direction.
+    """
+    row, col = divmod(position, board_cols)
+    for row_step, col_step in LINE_DIRECTIONS:
+        count = 1
+        for sign in (1, -1):
+            r, c = row + row_step * sign, col + col_step * sign
+            while count < win_length and 0 <= r < board_rows and 0 <= c < board_cols and board >> (r * board_cols + c) & 1:
+                count += 1
+                r += row_step * sign
+                c += col_step * sign
+        if count >= win_length:
+            return True
+
+    return False
+
+
+def check_board_full(bitboards: tuple[int, int], board_rows: int, board_cols: int) -> bool:
+    """Check if every position on the board is occupied"""
+    return bitboards[0] | bitboards[1] == (1 << board_rows * board_cols) - 1
+
+
+def validate_move_bitboards(
+    bitboards: tuple[int, int], position: int, board_rows: int = 3, board_cols: int = 3
+) -> tuple[bool, int, str]:
+    """Validate if a move is legal against the bitboards"""
+    if position >= board_rows * board_cols:
+        return False, 422, f"Position must be between 0 and {board_rows * board_cols - 1} on a {board_rows}x{board_cols} board"
+
+    if (bitboards[0] | bitboards[1]) >> position & 1:
+        return False, 409, "Position already occupied"
+
+    return True, 200, "Valid move"
+
+
+def validate_complete_game(
+    positions: list[int], board_rows: int = 3, board_cols: int = 3, win_length: int = 3
+) -> tuple[bool, int, str, tuple[int, int], int]:
+    """
+    Replay a game played elsewhere, player 1 first, and check it is complete: every move is legal,
+    the last move wins or fills the board, and no earlier move won.
+    Returns (is valid, status code, message, final bitboards, winner player order or 0 for a draw)
+    """
+    bitboards = EMPTY_BITBOARDS
+    winner_order = 0
+    for index, position in enumerate(positions):
+        if winner_order:
+            return False, 422, f"Move {index + 1} is played after the game was won", bitboards, 0
+
+        is_move_valid, status_code, error_msg = validate_move_bitboards(bitboards, position, board_rows, board_cols)
+        if not is_move_valid:
+            return False, status_code, f"Move {index + 1}: {error_msg}", bitboards, 0
+
+        player_number = index % 2 + 1
+        bitboards = apply_move_to_bitboards(bitboards, position, player_number)
+        if check_win_from_last_move(bitboards[player_number - 1], position, board_rows, board_cols, win_length):
+            winner_order = player_number
+
+    if not winner_order and not check_board_full(bitboards, board_rows, board_cols):
+        return False, 422, "Game is not finished", bitboards, 0
+
+    return True, 200, "Valid complete game", bitboards, winner_order
@@ -0,0 +1,556 @@
+"""
+Process local store of active games with write behind persistence.
+
+WAITING and IN_PROGRESS games are kept in memory as compact GameState objects, and the /games
+routes read and validate against them instead of loading the Game, its game_players and its
+board from SQLite on every request. A game missing from the store is loaded from the database
+once and cached until it finishes.
+
+Creating and joining a game are written through to the database right away: they need a
+database id, and the unfinished game checks read the database. Moves are applied to the in
+memory state and recorded as MoveEvents:
+- With write behind enabled, each event is appended to a journal file before the response is
+  sent, and a background thread persists the pending events to SQLite in batches, one
+  transaction per batch. On startup, events left in the journal by a crash are replayed.
+  A move finishing a game is persisted before responding, after the pending events, so the
+  players' unfinished game checks are right in every process as soon as the game is over.
+- With write behind disabled, each event is persisted in the request's session before the
+  response is sent.
+Requests use the async methods, which write the journal and wait for the flush thread in a
+worker thread, so the event loop never waits on an fsync or on a batch being committed.
+
+The store is only the authority for its games while a single process serves them. With leases
+enabled, several processes can share the database: a process caches a game only while it holds
+the game's GameLease, claimed when the game is loaded and renewed when half of its ttl is left.
+The lobby routes, POST /games and /matchmaking, don't claim the games they create or join: behind
+the gateway they run on the lobby worker, and the game is claimed by the worker serving its routes.
+A game leased by another process is read from the database on every request and its moves are
+persisted before responding. A process whose lease expired and was taken over drops its copy,
+and the version check of joins and moves rejects anything it still writes from a stale copy.
+release() hands the leases over when the games move to other processes, and the lease of a game
+is deleted once it finishes.
+With leases, moves are always written through: the process taking over the game of a dead one
+loads it from the database, and can't see the moves left in the dead process's journal.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import TYPE_CHECKING, Annotated, Callable, NamedTuple
+
+import anyio
+from fastapi import Depends
+from sqlmodel import Session
+
+from . import crud
+from .config import settings
+from .models import Game, GameLease, GameStatus
+
+if TYPE_CHECKING:
+    from .database import Database
+
+logger = logging.getLogger(__name__)
+
+
+class PlayerSlot(NamedTuple):
+    """Participant of a game, with the fields the game_logic validators read from GamePlayer"""
+    player_id: int
+    player_order: int
+
+
+class GameState:
+    """
+    In memory state of an active game.
+    It has the attributes the game_logic validators and build_game_response read from Game.
+    lock serializes validating and applying joins and moves to this game across the requests
+    of the event loop, including while they await the database.
+    version is the Game.version the state corresponds to, joins and moves are written on it.
+    """
+    __slots__ = (
+        "id", "status", "current_turn_number", "winner_id", "board",
+        "board_rows", "board_cols", "win_length", "game_players", "version", "lock",
+    )
+
+    def __init__(
+        self,
+        id: int,
+        status: GameStatus,
+        current_turn_number: int,
+        winner_id: int | None,
+        board: bytes,
+        board_rows: int,
+        board_cols: int,
+        win_length: int,
+        game_players: list[PlayerSlot],
+        version: int = 0,
+    ):
+        self.id = id
+        self.status = status
+        self.current_turn_number = current_turn_number
+        self.winner_id = winner_id
+        self.board = board
+        self.board_rows = board_rows
+        self.board_cols = board_cols
+        self.win_length = win_length
+        self.game_players = game_players
+        self.version = version
+        self.lock = asyncio.Lock()
+
+    @classmethod
+    def from_game(cls, game: Game) -> "GameState":
+        assert game.id is not None
+        return cls(
+            id=game.id,
+            status=game.status,
+            current_turn_number=game.current_turn_number,
+            winner_id=game.winner_id,
+            board=game.board,
+            board_rows=game.board_rows,
+            board_cols=game.board_cols,
+            win_length=game.win_length,
+            game_players=[PlayerSlot(gp.player_id, gp.player_order) for gp in game.game_players],
+            version=game.version,
+        )
+
+    @property
+    def current_turn_player_id(self) -> int | None:
+        if self.status != GameStatus.IN_PROGRESS or len(self.game_players) < 2:
+            return None
+
+        player1 = next(gp for gp in self.game_players if gp.player_order == 1)
+        player2 = next(gp for gp in self.game_players if gp.player_order == 2)
+
+        return player1.player_id if self.current_turn_number % 2 == 1 else player2.player_id
+
+
+@dataclass
+class MoveEvent:
+    """
+    A validated move and the game state it produced.
+    player_results holds (player_id, moves made, won) for both players when the move finished the game.
+    version is the Game.version after the move, None for events journaled before games had one.
+    """
+    game_id: int
+    player_id: int
+    position: int
+    move_number: int
+    status: GameStatus
+    winner_id: int | None
+    board: bytes
+    player_results: list[tuple[int, int, bool]] = field(default_factory=list)
+    version: int | None = None
+
+    def to_json(self) -> str:
+        data = asdict(self)
+        data["status"] = self.status.value
+        data["board"] = self.board.hex()
+        return json.dumps(data, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, line: str) -> "MoveEvent":
+        data = json.loads(line)
+        data["status"] = GameStatus(data["status"])
+        data["board"] = bytes.fromhex(data["board"])
+        data["player_results"] = [tuple(result) for result in data["player_results"]]
+        return cls(**data)
+
+
+def apply_move_event(state: GameState, event: MoveEvent) -> None:
+    """Advance the game state to the one produced by the move, once the move is persisted or journaled"""
+    state.current_turn_number = event.move_number + 1
+    state.status = event.status
+    state.winner_id = event.winner_id
+    state.board = event.board
+    state.version = event.version
+
+
+class GameStore:
+    def __init__(
+        self,
+        write_behind: bool = False,
+        flush_interval: float = 0.05,
+        batch_size: int = 500,
+        journal_path: str | None = None,
+        journal_fsync: bool = True,
+        lease_owner: str | None = None,
+        lease_ttl: float = 10.0,
+        clock: Callable[[], float] = time.time,
+    ):
+        # The journal is only replayed by the process that wrote it, see the module docstring
+        self.write_behind = write_behind and lease_owner is None
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.journal_path = journal_path
+        self.journal_fsync = journal_fsync
+        # Leases are disabled without an owner, the store then assumes it is the only process
+        self.lease_owner = lease_owner
+        self.lease_ttl = lease_ttl
+        self.clock = clock
+
+        self._games: dict[int, GameState] = {}
+        self._pending: list[MoveEvent] = []
+        # Events taken from _pending by the flush in progress, until they are committed
+        self._flushing: list[MoveEvent] = []
+        # Leases held on the games in _games, by game id
+        self._leases: dict[int, GameLease] = {}
+        # Guards _games, _pending, _flushing and _leases, never held during I/O
+        self._lock = threading.Lock()
+        # Guards the journal file, appending an event to _pending and to the journal is atomic under it
+        self._journal_lock = threading.Lock()
+        # One flush at a time so batches reach the database in order
+        self._flush_lock = threading.Lock()
+        self._session_factory: Callable[[], Session] | None = None
+        self._journal = None
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def __len__(self) -> int:
+        return len(self._games)
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def get(self, session: Session, game_id: int, claim: bool = True) -> GameState | None:
+        """
+        Get the state of a game, loading it from the database if it is not in the store.
+        Finished games, and games leased by another process, are returned but not kept.
+        With claim=False a game whose lease this process doesn't hold is not kept either.
+        """
+        with self._lock:
+            state = self._games.get(game_id)
+        # Renewing the lease drops the game if another process owned it meanwhile
+        if state is not None and self._renew_lease(session, game_id) and self.owns(state):
+            return state
+
+        game = crud.get_game(session, game_id)
+        if not game:
+            return None
+        state = GameState.from_game(game)
+        if state.status == GameStatus.FINISHED or not self._renew_lease(session, game_id, claim):
+            return state
+
+        with self._lock:
+            # Another request may have loaded the game meanwhile, keep the first one
+            return self._games.setdefault(game_id, state)
+
+    def add(self, session: Session, game: Game) -> GameState:
+        """Keep a newly created game in the store, without claiming its lease"""
+        state = GameState.from_game(game)
+        if self._renew_lease(session, state.id, claim=False):
+            with self._lock:
+                self._games[state.id] = state
+        return state
+
+    def create_game(
+        self, session: Session, player_id: int, board_rows: int = 3, board_cols: int = 3, win_length: int = 3
+    ) -> GameState:
+        """Create a game in the database and keep it in the store"""
+        return self.add(session, crud.create_game(session, player_id, board_rows, board_cols, win_length))
+
+    def owns(self, state: GameState) -> bool:
+        """Whether the state is the one kept in the store, which serves the game"""
+        with self._lock:
+            return self._games.get(state.id) is state
+
+    def evict(self, game_id: int) -> None:
+        with self._lock:
+            self._games.pop(game_id, None)
+            self._leases.pop(game_id, None)
+
+    def invalidate(self, game_id: int) -> None:
+        """
+        Drop a game that may be behind the database, so the next access reloads it.
+        A game with moves not yet persisted is ahead of the database instead, and kept.
+        """
+        with self._lock:
+            if game_id not in self._unsaved_game_ids():
+                self._games.pop(game_id, None)
+                self._leases.pop(game_id, None)
+
+    def record_join(self, state: GameState, player_id: int) -> None:
+        """Apply a join that has been written to the database"""
+        state.game_players.append(PlayerSlot(player_id, 2))
+        state.status = GameStatus.IN_PROGRESS
+        state.version += 1
+
+    def record_move(self, session: Session, state: GameState, event: MoveEvent) -> None:
+        """
+        Apply a validated move to the game state, then persist it now or queue it for the
+        background flush. Must be called while holding state.lock.
+        Persisting it now raises crud.GameVersionConflict if the game changed in the database
+        since the state was loaded, the state is then evicted.
+        """
+        if self._queues(state):
+            if event.status != GameStatus.FINISHED:
+                self._queue_move(state, event)
+                return
+            self.flush(session)
+        self._persist_move(session, state, event)
+
+    async def record_move_async(self, db: "Database", state: GameState, event: MoveEvent) -> None:
+        """record_move for requests, a queued move is journaled in a worker thread"""
+        if self._queues(state):
+            if event.status != GameStatus.FINISHED:
+                await anyio.to_thread.run_sync(self._queue_move, state, event)
+                return
+            await self.flush_async(db)
+        await db.run(self._persist_move, state, event)
+
+    def _queues(self, state: GameState) -> bool:
+        # Games leased by another process are written through, it reads them from the database
+        return self.write_behind and self.owns(state)
+
+    def _persist_move(self, session: Session, state: GameState, event: MoveEvent) -> None:
+        # Readers don't take state.lock, the state only shows the move once it is persisted
+        event.version = state.version + 1
+        try:
+            crud.apply_move_events(session, [event])
+        except Exception:
+            # The game may have changed in the database, reload it on next access
+            self.evict(state.id)
+            raise
+        apply_move_event(state, event)
+        if event.status == GameStatus.FINISHED:
+            self.evict(state.id)
+            if self.lease_owner is not None:
+                crud.delete_game_lease(session, state.id)
+
+    def _queue_move(self, state: GameState, event: MoveEvent) -> None:
+        # Like _persist_move, the state only shows the move once it is journaled
+        event.version = state.version + 1
+        with self._journal_lock:
+            self._append_to_journal(event)
+            with self._lock:
+                self._pending.append(event)
+                batch_is_full = len(self._pending) >= self.batch_size
+        apply_move_event(state, event)
+        if batch_is_full:
+            self._wakeup.set()
+
+    def flush(self, session: Session) -> int:
+        """
+        Persist every pending move event in one transaction.
+        Returns the number of events persisted.
+        """
+        with self._flush_lock:
+            with self._lock:
+                events, self._pending = self._pending, []
+                self._flushing = events
+            if not events:
+                return 0
+
+            try:
+                events = self._apply_dropping_conflicts(session, events)
+            except Exception:
+                with self._lock:
+                    self._pending[:0] = self._flushing
+                    self._flushing = []
+                raise
+
+            with self._journal_lock:
+                with self._lock:
+                    self._flushing = []
+                    for event in events:
+                        if event.status == GameStatus.FINISHED:
+                            self._games.pop(event.game_id, None)
+                    pending = list(self._pending)
+                self._rewrite_journal(pending)
+            return len(events)
+
+    async def flush_async(self, db: "Database") -> int:
+        """
+        flush for requests. While the flush thread runs, the flush is made in a worker thread with
+        its own session, which may wait for the batch the flush thread is committing.
+        """
+        if self._session_factory is None:
+            return await db.run(self.flush)
+        return await anyio.to_thread.run_sync(self._run_with_own_session, self.flush)
+
+    def release(self, session: Session) -> int:
+        """
+        Persist the pending moves and drop every cached game, when the games move to other processes.
+        Their leases are released so the new owners don't wait for them to expire.
+        Games with moves accepted meanwhile are kept. Returns the number of games dropped.
+        """
+        self.flush(session)
+        with self._lock:
+            unsaved_game_ids = self._unsaved_game_ids()
+            released = [game_id for game_id in self._games if game_id not in unsaved_game_ids]
+            for game_id in released:
+                del self._games[game_id]
+                self._leases.pop(game_id, None)
+        if self.lease_owner is not None:
+            crud.release_game_leases(session, released, self.lease_owner)
+        return len(released)
+
+    async def release_async(self, db: "Database") -> int:
+        """release for requests, in a worker thread like flush_async"""
+        if self._session_factory is None:
+            return await db.run(self.release)
+        return await anyio.to_thread.run_sync(self._run_with_own_session, self.release)
+
+    def _run_with_own_session(self, fn: Callable[[Session], int]) -> int:
+        assert self._session_factory is not None
+        with self._session_factory() as session:
+            return fn(session)
+
+    def _unsaved_game_ids(self) -> set[int]:
+        """Games with moves not committed yet, pending or being flushed. Must be called while holding _lock"""
+        return {event.game_id for event in (*self._flushing, *self._pending)}
+
+    def _renew_lease(self, session: Session, game_id: int, claim: bool = True) -> bool:
+        """
+        Whether this process holds the lease of a game, claiming or renewing it when less than half of
+        its ttl is left. A cached game is dropped when the lease was lost or taken over meanwhile.
+        With claim=False a lease this process doesn't hold is not claimed.
+        """
+        if self.lease_owner is None:
+            return True
+
+        now = self.clock()
+        with self._lock:
+            lease = self._leases.get(game_id)
+        if lease is not None and lease.expires_at - now > self.lease_ttl / 2:
+            return True
+        if lease is None and not claim:
+            return False
+
+        renewed = crud.acquire_game_lease(session, game_id, self.lease_owner, self.lease_ttl, now)
+        if renewed is None or lease is None or renewed.epoch != lease.epoch:
+            # Another process owns or owned the game since it was cached
+            self.invalidate(game_id)
+        if renewed is None:
+            return False
+        with self._lock:
+            self._leases[game_id] = renewed
+        return True
+
+    def recover(self, session: Session) -> int:
+        """
+        Replay the events left in the journal by a process that stopped before flushing them.
+        Events already in the database are skipped. Returns the number of events read.
+        """
+        if not self.journal_path or not os.path.exists(self.journal_path):
+            return 0
+
+        events = []
+        with open(self.journal_path) as journal:
+            for line in journal:
+                try:
+                    events.append(MoveEvent.from_json(line))
+                except ValueError:
+                    # A torn last line is a move whose response was never sent
+                    logger.warning("Skipping unreadable game store journal entry: %r", line)
+
+        if events:
+            self._apply_dropping_conflicts(session, events, skip_existing=True)
+        with self._journal_lock:
+            self._rewrite_journal([])
+        return len(events)
+
+    def _apply_dropping_conflicts(
+        self, session: Session, events: list[MoveEvent], skip_existing: bool = False
+    ) -> list[MoveEvent]:
+        """
+        Persist events with crud.apply_move_events. The events of a game changed in the database
+        by another process can never be applied: they are dropped and the game is evicted.
+        Returns the events persisted.
+        """
+        while True:
+            try:
+                crud.apply_move_events(session, events, skip_existing)
+                return events
+            except crud.GameVersionConflict as conflict:
+                session.rollback()
+                dropped = [event for event in events if event.game_id == conflict.game_id]
+                logger.error(
+                    "Dropping %d moves of game %d, it was changed by another process", len(dropped), conflict.game_id
+                )
+                self.evict(conflict.game_id)
+                events = [event for event in events if event.game_id != conflict.game_id]
+
+    def start(self, session_factory: Callable[[], Session]) -> None:
+        """Start the background flush thread"""
+        if not self.write_behind or self._thread is not None:
+            return
+
+        self._stop.clear()
+        self._session_factory = session_factory
+        self._thread = threading.Thread(
+            target=self._run, args=(session_factory,), name="game-store-flush", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background flush thread after a final flush"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+        self._session_factory = None
+        with self._journal_lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    def _run(self, session_factory: Callable[[], Session]) -> None:
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                with session_factory() as session:
+                    self.flush(session)
+            except Exception:
+                logger.exception("Game store flush failed, retrying")
+
+        with session_factory() as session:
+            self.flush(session)
+
+    def _open_journal(self):
+        if self._journal is None and self.journal_path:
+            self._journal = open(self.journal_path, "a")
+        return self._journal
+
+    def _append_to_journal(self, event: MoveEvent) -> None:
+        if self._open_journal() is None:
+            return
+        self._journal.write(event.to_json() + "\n")
+        self._journal.flush()
+        if self.journal_fsync:
+            os.fsync(self._journal.fileno())
+
+    def _rewrite_journal(self, pending: list[MoveEvent]) -> None:
+        """Replace the journal contents with the events that are still pending"""
+        journal = self._open_journal()
+        if journal is None:
+            return
+        journal.truncate(0)
+        for event in pending:
+            journal.write(event.to_json() + "\n")
+        journal.flush()
+        if self.journal_fsync:
+            os.fsync(journal.fileno())
+
+
+game_store = GameStore(
+    write_behind=settings.game_store_write_behind,
+    flush_interval=settings.game_store_flush_interval,
+    batch_size=settings.game_store_batch_size,
+    journal_path=settings.game_store_journal_path,
+    journal_fsync=settings.game_store_journal_fsync,
+    lease_owner=settings.game_store_node_id if settings.game_store_leases else None,
+    lease_ttl=settings.game_store_lease_ttl,
+)
+
+
+def get_game_store() -> GameStore:
+    return game_store
+
+GameStoreDep = Annotated[GameStore, Depends(get_game_store)]
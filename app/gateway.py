@@ -0,0 +1,366 @@
+"""
+Local gateway routing requests to several app worker processes on one machine.
+
+Each game is owned by one worker, chosen by consistent hashing of its id, and every
+/games/{game_id} request goes to it. The game store, the hub of game updates and the long polls
+are then only ever used by the game's owner. POST /games and /matchmaking go to one lobby worker,
+which keeps the single matchmaking queue. The other routes are spread across the workers in turn.
+
+The gateway checks the workers' /internal/health every GATEWAY_HEALTH_INTERVAL seconds, and
+workers can be added or removed through /gateway/workers. When the workers change, about 1/N of
+the games move to another worker, and every worker is asked to persist its pending moves and drop
+its cached games through /internal/release, so the new owners load them from the database.
+Spawned workers hold leases on the games they cache (GAME_STORE_LEASES), so a worker that is
+still running after being taken off the ring, or that stopped without releasing its games, can't
+keep serving a stale copy: its games are taken over once their leases expire. Leasing workers
+write their moves through, so the new owner of a game loads every move its dead owner accepted.
+
+Spawned workers get the gateway's url (GATEWAY_URL), and the lobby joins the games it matches
+through it, so the join is made by the game's owner. Updates are still published per process:
+/events streams the events of one worker.
+
+Run 4 workers behind a gateway on port 8000:
+    python -m app.gateway --spawn 4
+"""
+import argparse
+import asyncio
+import bisect
+import hashlib
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+from contextlib import asynccontextmanager
+from itertools import count
+from typing import AsyncIterator, Iterable
+
+import anyio
+import httpx
+from fastapi import Body, FastAPI, HTTPException, Query, Request, Response, WebSocket
+from fastapi.responses import StreamingResponse
+from websockets.asyncio.client import connect
+from websockets.exceptions import ConnectionClosed, InvalidStatus
+
+from .config import PROJECT_ROOT, settings
+
+logger = logging.getLogger(__name__)
+
+GAME_PATH = re.compile(r"^/games/(\d+)(/|$)")
+LOBBY_KEY = "lobby"
+
+# Headers of one connection, not forwarded
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer",
+    "transfer-encoding", "upgrade", "host",
+}
+
+# Long polls and event streams are held open, only connecting is timed out
+PROXY_TIMEOUT = httpx.Timeout(5.0, read=None)
+HEALTH_TIMEOUT = 1.0
+
+
+class HashRing:
+    """
+    Consistent hash ring of worker urls. Each worker has virtual_nodes points on the ring and a
+    key belongs to the worker of the first point after its hash, so adding or removing a worker
+    only moves the keys of the points it gains or loses.
+    """
+    def __init__(self, nodes: Iterable[str] = (), virtual_nodes: int = settings.gateway_virtual_nodes):
+        self.virtual_nodes = virtual_nodes
+        self._points: list[int] = []
+        self._owners: dict[int, str] = {}
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __contains__(self, node: str) -> bool:
+        return node in self._owners.values()
+
+    @property
+    def nodes(self) -> list[str]:
+        return sorted(set(self._owners.values()))
+
+    def add(self, node: str) -> None:
+        for replica in range(self.virtual_nodes):
+            point = self._hash(f"{node}#{replica}")
+            if point not in self._owners:
+                bisect.insort(self._points, point)
+                self._owners[point] = node
+
+    def remove(self, node: str) -> None:
+        points = [point for point, owner in self._owners.items() if owner == node]
+        for point in points:
+            del self._owners[point]
+        self._points = sorted(self._owners)
+
+    def node_for(self, key: str) -> str:
+        if not self._points:
+            raise LookupError("No node on the ring")
+        index = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[self._points[index]]
+
+
+class Gateway:
+    def __init__(
+            self, worker_urls: Iterable[str], client: httpx.AsyncClient | None = None,
+            virtual_nodes: int = settings.gateway_virtual_nodes,
+        ):
+        # Registered workers, the healthy ones are on the ring
+        self.workers = {url.rstrip("/") for url in worker_urls}
+        self.ring = HashRing(self.workers, virtual_nodes)
+        self.client = client or httpx.AsyncClient(timeout=PROXY_TIMEOUT)
+        self._next_worker = count()
+        # Serializes worker changes and the releases they trigger
+        self._lock = asyncio.Lock()
+
+    def worker_for(self, method: str, path: str) -> str:
+        """The worker serving a request, raises LookupError when there is none"""
+        match = GAME_PATH.match(path)
+        if match:
+            return self.ring.node_for(f"game:{match.group(1)}")
+        if path == "/matchmaking" or (path == "/games" and method == "POST"):
+            return self.ring.node_for(LOBBY_KEY)
+        nodes = self.ring.nodes
+        if not nodes:
+            raise LookupError("No worker available")
+        return nodes[next(self._next_worker) % len(nodes)]
+
+    async def add_worker(self, url: str) -> None:
+        async with self._lock:
+            url = url.rstrip("/")
+            self.workers.add(url)
+            if url not in self.ring:
+                self.ring.add(url)
+                await self._release_games()
+
+    async def remove_worker(self, url: str) -> None:
+        async with self._lock:
+            url = url.rstrip("/")
+            self.workers.discard(url)
+            if url in self.ring:
+                self.ring.remove(url)
+                await self._release_games(also=[url])
+
+    async def check_workers(self) -> None:
+        """Take unhealthy workers off the ring and put recovered ones back"""
+        async with self._lock:
+            workers = sorted(self.workers)
+            healthy = await asyncio.gather(*(self._is_healthy(url) for url in workers))
+            changed = False
+            for url, is_healthy in zip(workers, healthy):
+                if is_healthy and url not in self.ring:
+                    logger.info("Worker %s is up", url)
+                    self.ring.add(url)
+                    changed = True
+                elif not is_healthy and url in self.ring:
+                    logger.warning("Worker %s is down", url)
+                    self.ring.remove(url)
+                    changed = True
+            if changed:
+                await self._release_games()
+
+    async def _is_healthy(self, url: str) -> bool:
+        try:
+            response = await self.client.get(f"{url}/internal/health", timeout=HEALTH_TIMEOUT)
+        except httpx.HTTPError:
+            return False
+        return response.status_code == 200
+
+    async def _release_games(self, also: Iterable[str] = ()) -> None:
+        """Ask the workers to persist and drop their games after the ring changed"""
+        urls = sorted({*self.ring.nodes, *also})
+        results = await asyncio.gather(
+            *(self.client.post(f"{url}/internal/release") for url in urls), return_exceptions=True
+        )
+        for url, result in zip(urls, results):
+            if isinstance(result, BaseException) or result.status_code != 200:
+                logger.warning("Worker %s did not release its games: %r", url, result)
+
+    async def proxy(self, request: Request) -> Response:
+        try:
+            worker = self.worker_for(request.method, request.url.path)
+        except LookupError:
+            raise HTTPException(status_code=503, detail="No worker available")
+
+        url = f"{worker}{request.url.path}"
+        if request.url.query:
+            # Forwarded as is, query_params would keep one value of a repeated parameter
+            url += f"?{request.url.query}"
+        headers = [(name, value) for name, value in request.headers.raw if name.decode().lower() not in HOP_BY_HOP_HEADERS]
+        upstream_request = self.client.build_request(
+            request.method, url, headers=headers, content=await request.body(),
+        )
+        try:
+            upstream = await self.client.send(upstream_request, stream=True)
+        except httpx.HTTPError:
+            raise HTTPException(status_code=502, detail="Worker unavailable")
+
+        async def body() -> AsyncIterator[bytes]:
+            try:
+                async for chunk in upstream.aiter_raw():
+                    yield chunk
+            finally:
+                await upstream.aclose()
+
+        response_headers = {
+            name: value for name, value in upstream.headers.items() if name.lower() not in HOP_BY_HOP_HEADERS
+        }
+        return StreamingResponse(body(), status_code=upstream.status_code, headers=response_headers)
+
+    async def proxy_websocket(self, websocket: WebSocket) -> None:
+        path = websocket.url.path
+        try:
+            worker = self.worker_for("GET", path)
+        except LookupError:
+            await websocket.close(code=1013, reason="No worker available")
+            return
+
+        url = re.sub(r"^http", "ws", worker) + path
+        if websocket.url.query:
+            url += f"?{websocket.url.query}"
+        try:
+            upstream = await connect(url)
+        except InvalidStatus:
+            # Rejected by the worker, like an unknown game
+            await websocket.close(code=1008)
+            return
+        except OSError:
+            await websocket.close(code=1011, reason="Worker unavailable")
+            return
+
+        await websocket.accept()
+        async with upstream:
+            async def to_worker(cancel_scope: anyio.CancelScope) -> None:
+                while True:
+                    message = await websocket.receive()
+                    if message["type"] == "websocket.disconnect":
+                        cancel_scope.cancel()
+                        return
+                    await upstream.send(message.get("text") or message.get("bytes") or "")
+
+            async def to_client(cancel_scope: anyio.CancelScope) -> None:
+                try:
+                    async for message in upstream:
+                        if isinstance(message, str):
+                            await websocket.send_text(message)
+                        else:
+                            await websocket.send_bytes(message)
+                except ConnectionClosed:
+                    pass
+                await websocket.close(code=upstream.close_code or 1000)
+                cancel_scope.cancel()
+
+            async with anyio.create_task_group() as task_group:
+                task_group.start_soon(to_worker, task_group.cancel_scope)
+                task_group.start_soon(to_client, task_group.cancel_scope)
+
+
+def create_gateway_app(gateway: Gateway, health_interval: float = settings.gateway_health_interval) -> FastAPI:
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        async def check_workers_forever() -> None:
+            while True:
+                await asyncio.sleep(health_interval)
+                await gateway.check_workers()
+
+        task = asyncio.create_task(check_workers_forever()) if health_interval > 0 else None
+        yield
+        if task is not None:
+            task.cancel()
+        await gateway.client.aclose()
+
+    app = FastAPI(title="Game worker gateway", lifespan=lifespan)
+
+    @app.get("/gateway/workers")
+    async def get_workers():
+        """The registered workers and the healthy ones, which own games"""
+        return {"workers": sorted(gateway.workers), "healthy": gateway.ring.nodes}
+
+    @app.post("/gateway/workers", status_code=204)
+    async def add_worker(url: str = Body(embed=True)):
+        """Add a worker, it takes over its share of the games"""
+        await gateway.add_worker(url)
+
+    @app.delete("/gateway/workers", status_code=204)
+    async def remove_worker(url: str = Query()):
+        """Remove a worker, its games move to the other workers"""
+        await gateway.remove_worker(url)
+
+    @app.websocket("/games/{game_id}/ws")
+    async def game_websocket(websocket: WebSocket):
+        await gateway.proxy_websocket(websocket)
+
+    @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"])
+    async def proxy(request: Request):
+        return await gateway.proxy(request)
+
+    return app
+
+
+def spawn_workers(count_: int, host: str, first_port: int, gateway_url: str) -> list[subprocess.Popen]:
+    """
+    Start worker processes on consecutive ports, one at a time so they don't migrate the
+    database together. Each worker gets its own game store journal and leases its games.
+    """
+    processes = []
+    for port in range(first_port, first_port + count_):
+        env = {
+            "GAME_STORE_LEASES": "true",
+            **os.environ,
+            "GAME_STORE_JOURNAL_PATH": os.path.join(PROJECT_ROOT, f"game_store.{port}.journal"),
+            "GAME_STORE_NODE_ID": f"{host}:{port}",
+            "GATEWAY_URL": gateway_url,
+        }
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", host, "--port", str(port)], env=env,
+        ))
+        wait_until_healthy(f"http://{host}:{port}")
+    return processes
+
+
+def wait_until_healthy(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{url}/internal/health", timeout=HEALTH_TIMEOUT).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Worker {url} did not start")
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Route requests to app workers by game")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--worker", action="append", default=[], help="Url of a running worker, repeatable")
+    parser.add_argument("--spawn", type=int, default=0, help="Start this many workers on the next ports")
+    args = parser.parse_args()
+
+    gateway_url = f"http://{args.host}:{args.port}"
+    processes = spawn_workers(args.spawn, args.host, args.port + 1, gateway_url) if args.spawn else []
+    worker_urls = args.worker + [f"http://{args.host}:{args.port + 1 + index}" for index in range(args.spawn)]
+    if not worker_urls:
+        parser.error("give --worker urls or --spawn a number of workers")
+    try:
+        uvicorn.run(create_gateway_app(Gateway(worker_urls)), host=args.host, port=args.port)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
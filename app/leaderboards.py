@@ -0,0 +1,351 @@
+"""
+Leaderboards: the top of each one kept in memory and updated incrementally, the rest ranked in SQL.
+
+Each metric keeps the first `capacity` players of its leaderboard, the players who have won a
+game, as a list of sort keys in leaderboard order. Pages within them are served from memory.
+Deeper pages, and refilling a board, use crud.get_leaderboard, which ranks with RANK() OVER and
+reads only the rows of the page from the metric's rank index.
+
+A board is always an exact prefix of its leaderboard: a player enters it only ahead of its
+last entry, and a player who falls behind its last entry leaves it. When it gets short, it is
+refilled from SQL on the next read.
+
+Keeping them current:
+- When a transaction that changed the Player aggregates commits, the changed players are
+  applied to the leaderboards of this process (see the session events at the bottom).
+- Such a transaction also increments the LeaderboardVersion row and stamps the changed players
+  with the new version as their stats_version. Before every read, the version the leaderboards
+  are synced to is compared with the row, and the players changed meanwhile by other worker
+  processes sharing the database are read by their stats_version.
+- On startup they are rebuilt from the database.
+
+Serialized responses are cached per LeaderboardVersion (see LeaderboardCache), a version that
+changed means a game finished since and the cached responses are stale.
+"""
+import bisect
+import threading
+from collections import OrderedDict
+from typing import Annotated, NamedTuple
+
+from fastapi import Depends
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session as OrmSession
+from sqlmodel import Session
+
+from . import crud
+from .config import settings
+from .models import LeaderboardMetric, Player
+from .schemas import PlayerStats
+
+LEADERBOARD_SIZE = 3
+
+
+class PlayerEntry(NamedTuple):
+    """Aggregates of a player as of a stats_version"""
+    player_id: int
+    games_played: int
+    games_won: int
+    total_moves: int
+    stats_version: int
+
+    @classmethod
+    def from_player(cls, player: Player) -> "PlayerEntry":
+        assert player.id is not None
+        return cls(player.id, player.games_played, player.games_won, player.total_moves, player.stats_version)
+
+
+def build_player_stats(entry: PlayerEntry, rank: int | None = None) -> PlayerStats:
+    win_rate = round(entry.games_won / entry.games_played, 3) if entry.games_played > 0 else 0.0
+    efficiency = round(entry.total_moves / entry.games_won, 2) if entry.games_won > 0 else 999999.0
+    return PlayerStats(
+        player_id=entry.player_id,
+        games_played=entry.games_played,
+        games_won=entry.games_won,
+        total_moves=entry.total_moves,
+        win_rate=win_rate,
+        efficiency=efficiency,
+        rank=rank,
+    )
+
+
+def sort_key(metric: LeaderboardMetric, entry: PlayerEntry) -> tuple:
+    """
+    Ascending key of a player with a win on a leaderboard: most wins, highest win rate, fewest
+    moves per win, then player id. The metric is exact, like the generated columns the SQL
+    leaderboard is ordered by, so players tie in memory exactly when they tie in SQL.
+    """
+    if metric == LeaderboardMetric.WINS:
+        return (-entry.games_won, entry.player_id)
+    if metric == LeaderboardMetric.WIN_RATE:
+        return (-(entry.games_won / entry.games_played), entry.player_id)
+    return (entry.total_moves / entry.games_won, entry.player_id)
+
+
+class LeaderboardCache:
+    """
+    Serialized leaderboard responses keyed by leaderboard and page, valid for the
+    LeaderboardVersion they were built at. The least recently used are evicted first.
+    """
+    def __init__(self, max_entries: int = settings.leaderboard_cache_size):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple, tuple[int, bytes]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: tuple, version: int) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: tuple, version: int, body: bytes) -> None:
+        with self._lock:
+            current = self._entries.get(key)
+            if current is not None and current[0] > version:
+                # A response built at a newer version was already cached
+                return
+            self._entries[key] = (version, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class Leaderboards:
+    def __init__(self, capacity: int = settings.leaderboard_capacity):
+        self.capacity = capacity
+        self.cache = LeaderboardCache()
+        # Guards every attribute, updates come from request threads and the game store flush thread
+        self._lock = threading.Lock()
+        # Players on at least one board
+        self._players: dict[int, PlayerEntry] = {}
+        self._keys: dict[LeaderboardMetric, list[tuple]] = {metric: [] for metric in LeaderboardMetric}
+        # Whether a board holds every player with a win, its players are then never read from SQL
+        self._complete: dict[LeaderboardMetric, bool] = {metric: False for metric in LeaderboardMetric}
+        # Every change up to this LeaderboardVersion has been applied
+        self.synced_version = 0
+
+    def __len__(self) -> int:
+        return len(self._players)
+
+    def attach(self) -> None:
+        """Apply the player changes committed by this process's sessions"""
+        if self not in attached_leaderboards:
+            attached_leaderboards.append(self)
+
+    def detach(self) -> None:
+        if self in attached_leaderboards:
+            attached_leaderboards.remove(self)
+
+    def rebuild(self, session: Session) -> None:
+        """Fill every board from the database"""
+        self.refresh(session)
+        for metric in LeaderboardMetric:
+            self.refill(session, metric)
+
+    def refill(self, session: Session, metric: LeaderboardMetric) -> None:
+        """Replace a board with the first capacity players of its leaderboard"""
+        rows = crud.get_leaderboard(session, metric, self.capacity)
+        with self._lock:
+            keys = self._keys[metric]
+            dropped_player_ids = [key[-1] for key in keys]
+            keys.clear()
+            # Take every row, _apply also moves players whose row is newer on the other boards
+            self._complete[metric] = True
+            for player, _ in rows:
+                entry = PlayerEntry.from_player(player)
+                current = self._players.get(entry.player_id)
+                if current is None or entry.stats_version > current.stats_version:
+                    self._apply(entry)
+                else:
+                    # A commit after the query read the row was already applied
+                    self._remove_key(keys, sort_key(metric, current))
+                    bisect.insort(keys, sort_key(metric, current))
+
+            if len(rows) >= self.capacity:
+                # Players who fell behind the last row since the query may be behind players the board doesn't hold
+                last_key = sort_key(metric, PlayerEntry.from_player(rows[-1][0]))
+                cut = bisect.bisect_right(keys, last_key)
+                dropped_player_ids.extend(key[-1] for key in keys[cut:])
+                del keys[cut:]
+                self._complete[metric] = False
+            for player_id in dropped_player_ids:
+                self._forget_if_on_no_board(player_id)
+
+    def refresh(self, session: Session) -> int:
+        """
+        Apply the changes committed since synced_version, including those of other processes.
+        Returns the LeaderboardVersion the leaderboards are now synced to.
+        """
+        version = crud.get_leaderboard_version(session)
+        if version <= self.synced_version:
+            return self.synced_version
+
+        players = crud.get_players_with_wins_changed_after(session, self.synced_version)
+        with self._lock:
+            for player in players:
+                self._apply(PlayerEntry.from_player(player))
+            self.synced_version = max(self.synced_version, version)
+            return self.synced_version
+
+    def apply_committed(self, entries: list[PlayerEntry]) -> None:
+        """Apply the players changed by a committed transaction"""
+        if not entries:
+            return
+        versions = [entry.stats_version for entry in entries]
+        with self._lock:
+            for entry in entries:
+                self._apply(entry)
+            # Versions are consecutive within a transaction. After a gap, the next refresh reads the missing changes.
+            if min(versions) == self.synced_version + 1:
+                self.synced_version = max(versions)
+
+    def top(
+        self, session: Session, metric: LeaderboardMetric, limit: int = LEADERBOARD_SIZE, offset: int = 0
+    ) -> list[PlayerStats]:
+        """
+        A page of a leaderboard with each player's rank, tied players share a rank.
+        Served from memory when the board holds the page, from SQL otherwise.
+        """
+        return self.top_many(session, [metric], limit, offset)[metric]
+
+    def top_many(
+        self, session: Session, metrics: list[LeaderboardMetric], limit: int = LEADERBOARD_SIZE, offset: int = 0
+    ) -> dict[LeaderboardMetric, list[PlayerStats]]:
+        """
+        The same page of several leaderboards, synced once for all of them.
+        Within the boards this is one version query and one pass over the boards.
+        """
+        self.refresh(session)
+        with self._lock:
+            pages = {metric: self._page_from_board_locked(metric, limit, offset) for metric in metrics}
+
+        for metric, page in pages.items():
+            if page is not None:
+                continue
+            if offset + limit <= self.capacity:
+                # The board got short as players fell behind it
+                self.refill(session, metric)
+                page = self._page_from_board(metric, limit, offset)
+            if page is None:
+                page = [
+                    build_player_stats(PlayerEntry.from_player(player), rank)
+                    for player, rank in crud.get_leaderboard(session, metric, limit, offset)
+                ]
+            pages[metric] = page
+        return pages  # type: ignore[return-value]
+
+    def _page_from_board(self, metric: LeaderboardMetric, limit: int, offset: int) -> list[PlayerStats] | None:
+        with self._lock:
+            return self._page_from_board_locked(metric, limit, offset)
+
+    def _page_from_board_locked(self, metric: LeaderboardMetric, limit: int, offset: int) -> list[PlayerStats] | None:
+        """Must be called while holding _lock"""
+        keys = self._keys[metric]
+        end = offset + limit
+        if end > len(keys) and not self._complete[metric]:
+            return None
+
+        page = []
+        rank = 0
+        for index, key in enumerate(keys[:end]):
+            # RANK(): a player tied with the previous one shares its rank
+            if index == 0 or key[:-1] != keys[index - 1][:-1]:
+                rank = index + 1
+            if index >= offset:
+                page.append(build_player_stats(self._players[key[-1]], rank))
+        return page
+
+    def _apply(self, entry: PlayerEntry) -> None:
+        """Move a player to their new position on every board. Must be called while holding _lock."""
+        current = self._players.get(entry.player_id)
+        if current is not None:
+            if entry.stats_version < current.stats_version:
+                # A newer version was already applied
+                return
+            for metric, keys in self._keys.items():
+                self._remove_key(keys, sort_key(metric, current))
+
+        if entry.games_won == 0:
+            # Only players with a win are ranked
+            self._players.pop(entry.player_id, None)
+            return
+
+        self._players[entry.player_id] = entry
+        for metric, keys in self._keys.items():
+            key = sort_key(metric, entry)
+            # Players behind the last entry of a partial board may be behind players it doesn't hold
+            if not self._complete[metric] and (not keys or key > keys[-1]):
+                continue
+            bisect.insort(keys, key)
+            if len(keys) > self.capacity:
+                self._complete[metric] = False
+                self._forget_if_on_no_board(keys.pop()[-1])
+        self._forget_if_on_no_board(entry.player_id)
+
+    def _remove_key(self, keys: list[tuple], key: tuple) -> None:
+        index = bisect.bisect_left(keys, key)
+        if index < len(keys) and keys[index] == key:
+            del keys[index]
+
+    def _forget_if_on_no_board(self, player_id: int) -> None:
+        entry = self._players.get(player_id)
+        if entry is None:
+            return
+        for metric, keys in self._keys.items():
+            key = sort_key(metric, entry)
+            index = bisect.bisect_left(keys, key)
+            if index < len(keys) and keys[index] == key:
+                return
+        del self._players[player_id]
+
+
+attached_leaderboards: list[Leaderboards] = []
+
+leaderboards = Leaderboards()
+
+
+def get_leaderboards() -> Leaderboards:
+    return leaderboards
+
+LeaderboardsDep = Annotated[Leaderboards, Depends(get_leaderboards)]
+
+
+# Session events: collect the players whose aggregates were flushed or updated by crud, apply them once committed
+CHANGED_PLAYERS_KEY = "leaderboard_changed_players"
+AGGREGATE_FIELDS = ("games_played", "games_won", "total_moves", "stats_version")
+
+
+@event.listens_for(OrmSession, "after_flush")
+def collect_changed_players(session: OrmSession, flush_context) -> None:
+    # Attribute history still holds the changes that were just flushed
+    for instance in session.dirty:
+        if not isinstance(instance, Player):
+            continue
+        attributes = inspect(instance).attrs
+        if any(attributes[field].history.has_changes() for field in AGGREGATE_FIELDS):
+            session.info.setdefault(CHANGED_PLAYERS_KEY, {})[instance.id] = PlayerEntry.from_player(instance)
+
+
+@event.listens_for(OrmSession, "after_commit")
+def apply_changed_players(session: OrmSession) -> None:
+    changed_players: dict[int, PlayerEntry] = session.info.pop(CHANGED_PLAYERS_KEY, None) or {}
+    for row in (session.info.pop(crud.UPDATED_PLAYERS_KEY, None) or {}).values():
+        entry = PlayerEntry(*row)
+        current = changed_players.get(entry.player_id)
+        if current is None or entry.stats_version >= current.stats_version:
+            changed_players[entry.player_id] = entry
+    if not changed_players:
+        return
+    entries = list(changed_players.values())
+    for attached in attached_leaderboards:
+        attached.apply_committed(entries)
+
+
+@event.listens_for(OrmSession, "after_rollback")
+def discard_changed_players(session: OrmSession) -> None:
+    session.info.pop(CHANGED_PLAYERS_KEY, None)
+    session.info.pop(crud.UPDATED_PLAYERS_KEY, None)
@@ -1,7 +1,10 @@
 # FastAPI app with API endpoints
 from fastapi import FastAPI
-from .database import create_db_and_tables
-from .router import players, games, leaderboard
+from .database import async_engine, async_shard_engines, create_db_and_tables, new_session
+from .game_store import game_store
+from .leaderboards import leaderboards
+from .matchmaking import gateway_client, matchmaking_queue
+from .router import players, games, leaderboard, matchmaking, events, internal
 
 app = FastAPI()
 
@@ -9,7 +12,31 @@ app = FastAPI()
 app.include_router(players.router)
 app.include_router(games.router)
 app.include_router(leaderboard.router)
+app.include_router(matchmaking.router)
+app.include_router(events.router)
+app.include_router(internal.router)
 
 @app.on_event("startup")
 def on_startup():
     create_db_and_tables()
+    with new_session() as session:
+        # Replay moves a previous process accepted but did not persist
+        game_store.recover(session)
+        leaderboards.rebuild(session)
+        matchmaking_queue.load(session)
+    leaderboards.attach()
+    game_store.start(new_session)
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    game_store.stop()
+    if game_store.lease_owner is not None:
+        # Hand the games over to the other processes without waiting for the leases to expire
+        with new_session() as session:
+            game_store.release(session)
+    leaderboards.detach()
+    if gateway_client is not None:
+        await gateway_client.aclose()
+    await async_engine.dispose()
+    for shard_engine in async_shard_engines.values():
+        await shard_engine.dispose()
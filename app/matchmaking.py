@@ -0,0 +1,86 @@
+"""
+Process local matchmaking queue of waiting games.
+
+POST /matchmaking pairs a player with the oldest waiting game with the same board settings,
+or creates a game and queues it. Games created with POST /games are queued too, and the
+queue is loaded from the waiting games in the database on startup.
+
+Pairing holds the queue lock, so two players never take the same waiting game. Games that
+stopped waiting meanwhile, joined through POST /games/{id}/join, are dropped when reached.
+The queue is only complete while a single process serves the games, like the game store.
+
+Behind the gateway the queue lives on the lobby worker, and the games on their owners. With
+GATEWAY_URL set, a waiting game is joined through POST /games/{id}/join on the gateway, so its
+owner applies the join to its cached game and pushes it to the game's subscribers.
+"""
+import asyncio
+from collections import deque
+from typing import Annotated
+
+import httpx
+from fastapi import Depends
+from sqlmodel import Session
+
+from . import crud
+from .config import settings
+from .game_store import GameState
+from .models import Game
+
+# board_rows, board_cols, win_length
+BoardSettings = tuple[int, int, int]
+
+
+def board_settings_of(game: Game | GameState) -> BoardSettings:
+    return (game.board_rows, game.board_cols, game.win_length)
+
+
+class MatchmakingQueue:
+    def __init__(self):
+        # Held while pairing, including while awaiting the database
+        self.lock = asyncio.Lock()
+        # Ids of waiting games in creation order, per board settings
+        self._waiting: dict[BoardSettings, deque[int]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(game_ids) for game_ids in self._waiting.values())
+
+    def add(self, game: Game | GameState) -> None:
+        """Queue a waiting game"""
+        assert game.id is not None
+        self._waiting.setdefault(board_settings_of(game), deque()).append(game.id)
+
+    def pop(self, board_settings: BoardSettings) -> int | None:
+        """Take the oldest queued game with these board settings"""
+        game_ids = self._waiting.get(board_settings)
+        if not game_ids:
+            return None
+        game_id = game_ids.popleft()
+        if not game_ids:
+            del self._waiting[board_settings]
+        return game_id
+
+    def load(self, session: Session) -> int:
+        """Queue the waiting games of the database, returns how many"""
+        self._waiting.clear()
+        games = crud.get_available_games(session)
+        for game in games:
+            self.add(game)
+        return len(games)
+
+
+matchmaking_queue = MatchmakingQueue()
+
+
+def get_matchmaking_queue() -> MatchmakingQueue:
+    return matchmaking_queue
+
+MatchmakingQueueDep = Annotated[MatchmakingQueue, Depends(get_matchmaking_queue)]
+
+
+gateway_client = httpx.AsyncClient(base_url=settings.gateway_url) if settings.gateway_url else None
+
+
+def get_gateway_client() -> httpx.AsyncClient | None:
+    return gateway_client
+
+GatewayClientDep = Annotated[httpx.AsyncClient | None, Depends(get_gateway_client)]
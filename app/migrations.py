@@ -0,0 +1,136 @@
+"""
+Versioned schema migrations for existing SQLite databases.
+
+SQLModel.metadata.create_all only creates missing tables, it never changes tables that
+already exist. Every schema change to an existing table is added here as a numbered
+migration. The applied version is tracked with SQLite's PRAGMA user_version.
+Migrations must be safe to run against a database freshly created by create_all.
+"""
+from collections import defaultdict
+
+from sqlalchemy import Connection, Engine
+
+from . import game_logic
+from .models import EFFICIENCY_SQL, WIN_RATE_SQL
+
+
+def get_schema_version(connection: Connection) -> int:
+    return connection.exec_driver_sql("PRAGMA user_version").scalar() or 0
+
+
+def column_exists(connection: Connection, table: str, column: str) -> bool:
+    # table_xinfo also lists generated columns
+    rows = connection.exec_driver_sql(f"PRAGMA table_xinfo({table})").all()
+    return any(row[1] == column for row in rows)
+
+
+def add_game_board(connection: Connection) -> None:
+    """
+    Add Game.board and backfill it by replaying the moves of existing games.
+    """
+    if not column_exists(connection, "game", "board"):
+        connection.exec_driver_sql("ALTER TABLE game ADD COLUMN board BLOB NOT NULL DEFAULT x''")
+
+    rows = connection.exec_driver_sql(
+        """
+        SELECT move.game_id, move.position, gameplayer.player_order
+        FROM move
+        JOIN gameplayer ON gameplayer.game_id = move.game_id AND gameplayer.player_id = move.player_id
+        """
+    ).all()
+
+    boards: dict[int, list[int]] = defaultdict(lambda: [0, 0, 0])
+    for game_id, position, player_order in rows:
+        boards[game_id][player_order] |= 1 << position
+
+    if boards:
+        connection.exec_driver_sql(
+            "UPDATE game SET board = ? WHERE id = ?",
+            [(game_logic.encode_bitboards((board[1], board[2])), game_id) for game_id, board in boards.items()],
+        )
+
+
+def add_game_board_size(connection: Connection) -> None:
+    """
+    Add the per game board dimensions, existing games are all 3x3 three in a row.
+    """
+    for column in ("board_rows", "board_cols", "win_length"):
+        if not column_exists(connection, "game", column):
+            connection.exec_driver_sql(f"ALTER TABLE game ADD COLUMN {column} INTEGER NOT NULL DEFAULT 3")
+
+
+def add_hot_path_indexes(connection: Connection) -> None:
+    """
+    Add the indexes declared on the models for reading a game's moves, a player's games,
+    the waiting games and the players with wins.
+    """
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_move_game_id_move_number ON move (game_id, move_number)")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_gameplayer_player_id ON gameplayer (player_id, game_id)")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_game_waiting ON game (id) WHERE status = 'WAITING'")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_player_games_won ON player (games_won) WHERE games_won > 0")
+
+
+def add_leaderboard_version(connection: Connection) -> None:
+    """
+    Add Player.stats_version and the LeaderboardVersion row.
+    Existing players keep version 0, the leaderboards read them when they are rebuilt.
+    """
+    if not column_exists(connection, "player", "stats_version"):
+        connection.exec_driver_sql("ALTER TABLE player ADD COLUMN stats_version INTEGER NOT NULL DEFAULT 0")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_player_stats_version ON player (stats_version)")
+    connection.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS leaderboardversion (id INTEGER NOT NULL PRIMARY KEY, version INTEGER NOT NULL)"
+    )
+    connection.exec_driver_sql("INSERT OR IGNORE INTO leaderboardversion (id, version) VALUES (1, 0)")
+
+
+def add_leaderboard_rank_columns(connection: Connection) -> None:
+    """
+    Add the generated win_rate and efficiency columns and the leaderboard rank indexes,
+    which replace the games_won index. SQLite can only add VIRTUAL generated columns.
+    """
+    if not column_exists(connection, "player", "win_rate"):
+        connection.exec_driver_sql(f"ALTER TABLE player ADD COLUMN win_rate FLOAT GENERATED ALWAYS AS ({WIN_RATE_SQL}) VIRTUAL")
+    if not column_exists(connection, "player", "efficiency"):
+        connection.exec_driver_sql(f"ALTER TABLE player ADD COLUMN efficiency FLOAT GENERATED ALWAYS AS ({EFFICIENCY_SQL}) VIRTUAL")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_player_rank_wins ON player (games_won DESC, id) WHERE games_won > 0")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_player_rank_win_rate ON player (win_rate DESC, id) WHERE games_won > 0")
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_player_rank_efficiency ON player (efficiency, id) WHERE games_won > 0")
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_player_games_won")
+
+
+def add_game_version(connection: Connection) -> None:
+    """Add the optimistic concurrency version of games"""
+    if not column_exists(connection, "game", "version"):
+        connection.exec_driver_sql("ALTER TABLE game ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+
+# (version, migration) pairs, applied in order. Never renumber or remove an entry.
+MIGRATIONS = [
+    (1, add_game_board),
+    (2, add_game_board_size),
+    (3, add_hot_path_indexes),
+    (4, add_leaderboard_version),
+    (5, add_leaderboard_rank_columns),
+    (6, add_game_version),
+]
+
+
+def run_migrations(engine: Engine) -> int:
+    """
+    Apply every migration newer than the database's schema version.
+    Each migration runs in its own transaction together with its version bump.
+    Returns the resulting schema version.
+    """
+    with engine.connect() as connection:
+        version = get_schema_version(connection)
+
+    for migration_version, migration in MIGRATIONS:
+        if migration_version <= version:
+            continue
+        with engine.begin() as connection:
+            migration(connection)
+            connection.exec_driver_sql(f"PRAGMA user_version = {migration_version}")
+        version = migration_version
+
+    return version
@@ -1,8 +1,10 @@
 """
 This file contains the SQLModel for the database models.
 Table definitions for Player, Game, GamePlayer, and Move. 4 tables. And their relationships.
+LeaderboardVersion and GameLease coordinate the processes sharing the database.
 The models are used to create the database tables and to validate the data that is passed to the database.
 """
+from sqlalchemy import Column, Computed, Float, Index, text
 from sqlmodel import Field, SQLModel, Relationship, UniqueConstraint
 from datetime import datetime, timezone
 from enum import Enum
@@ -12,32 +14,63 @@ class GameStatus(str, Enum):
     IN_PROGRESS = "in_progress" 
     FINISHED = "finished"
 
+class LeaderboardMetric(str, Enum):
+    WINS = "wins"
+    EFFICIENCY = "efficiency"
+    WIN_RATE = "win_rate"
+
+# Exact metrics, computed by SQLite so leaderboards can be ordered and ranked in SQL
+WIN_RATE_SQL = "CASE WHEN games_played > 0 THEN CAST(games_won AS REAL) / games_played ELSE 0.0 END"
+EFFICIENCY_SQL = "CASE WHEN games_won > 0 THEN CAST(total_moves AS REAL) / games_won ELSE 999999.0 END"
+
 class Player(SQLModel, table=True):
     """
     Each player has a unique id.
     Also added the aggregate fields for each player to be used for the leaderboard.
     Relationships attributes easy access to a list of the game_player and moves objects for each player.
+    stats_version is the LeaderboardVersion of the last change to the aggregate fields.
+    win_rate and efficiency are virtual generated columns. The rank indexes only hold players who have won,
+    the ones on the leaderboards, in leaderboard order with ties by id.
     """
     id: int | None = Field(default=None, primary_key=True)
     
     games_played: int = Field(default=0)
     games_won: int = Field(default=0)
     total_moves: int = Field(default=0)
+    stats_version: int = Field(default=0, index=True)
+    win_rate: float | None = Field(default=None, sa_column=Column(Float, Computed(WIN_RATE_SQL, persisted=False)))
+    efficiency: float | None = Field(default=None, sa_column=Column(Float, Computed(EFFICIENCY_SQL, persisted=False)))
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     
     game_players: list["GamePlayer"] = Relationship(back_populates="player")
     moves: list["Move"] = Relationship(back_populates="player")
 
+    __table_args__ = (
+        Index("ix_player_rank_wins", text("games_won DESC"), "id", sqlite_where=text("games_won > 0")),
+        Index("ix_player_rank_win_rate", text("win_rate DESC"), "id", sqlite_where=text("games_won > 0")),
+        Index("ix_player_rank_efficiency", "efficiency", "id", sqlite_where=text("games_won > 0")),
+    )
+
 class Game(SQLModel, table=True):
     """
     Game table has a unique id.
     current_turn_player_id field for the current turn player.
+    board is the encoded bitboards of the current grid, updated with every move so reads never replay the moves.
+    board_rows x board_cols is the grid size and win_length the number in a row needed to win.
     Relationships attributes easy access to a list of the game_player and moves objects for each game.
+    The partial waiting index only holds the games that can be joined, in id order.
+    version is incremented by every join and move, which are written with a conditional UPDATE
+    on the version they were validated against (optimistic concurrency control, see crud.py).
     """
     id: int | None = Field(default=None, primary_key=True)
     current_turn_number: int = Field(default=1)
     status: GameStatus = Field(default=GameStatus.WAITING)
     winner_id: int | None = Field(default=None, foreign_key="player.id")
+    board: bytes = Field(default=b"", description="Encoded bitboards, see game_logic.encode_bitboards")
+    board_rows: int = Field(default=3)
+    board_cols: int = Field(default=3)
+    win_length: int = Field(default=3)
+    version: int = Field(default=0)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     
     game_players: list["GamePlayer"] = Relationship(back_populates="game")
@@ -53,6 +86,11 @@ class Game(SQLModel, table=True):
         
         return player1.player_id if self.current_turn_number % 2 == 1 else player2.player_id
 
+    # Enums are stored by name
+    __table_args__ = (
+        Index("ix_game_waiting", "id", sqlite_where=text("status = 'WAITING'")),
+    )
+
 class GamePlayer(SQLModel, table=True):
     """
     Association table linking players to games with metadata.
@@ -68,21 +106,24 @@ class GamePlayer(SQLModel, table=True):
     player: Player = Relationship(back_populates="game_players")
     
     # Constraint to ensure each player only joins one game once.
+    # The primary key starts with game_id, finding a player's games needs its own index.
     __table_args__ = (
         UniqueConstraint('game_id', 'player_order', name='unique_game_player_order'),
+        Index("ix_gameplayer_player_id", "player_id", "game_id"),
     )
 
 class Move(SQLModel, table=True):
     """
     Move table for each move made in a game.
-    position is from 0-8 for the 3x3 grid. 0 is the top left, 8 is the bottom right.
+    It is an audit log of the game, the current grid is read from Game.board instead.
+    position is from 0 to board_rows * board_cols - 1, row by row. 0 is the top left, 8 is the bottom right of a 3x3 grid.
     move_number is the turn number when the move was made.
     Relationships for easy accessto the Game and Player obecjt.
     """
     id: int | None = Field(default=None, primary_key=True)
     game_id: int = Field(foreign_key="game.id")
     player_id: int = Field(foreign_key="player.id")
-    position: int = Field(ge=0, le=8)
+    position: int = Field(ge=0)
     move_number: int = Field(description="Turn number when move was made")
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     
@@ -90,6 +131,29 @@ class Move(SQLModel, table=True):
     player: Player = Relationship(back_populates="moves")
 
     # Constraint to ensure each position is only used once per game.
+    # The index serves reading a game's moves in order.
     __table_args__ = (
         UniqueConstraint('game_id', 'position', name='unique_game_position'),
-    )
\ No newline at end of file
+        Index("ix_move_game_id_move_number", "game_id", "move_number"),
+    )
+
+class LeaderboardVersion(SQLModel, table=True):
+    """
+    Single row counter, incremented in the transaction of every change to the Player aggregates.
+    Processes sharing the database compare it with the version their leaderboards are at.
+    """
+    id: int = Field(default=1, primary_key=True)
+    version: int = Field(default=0)
+
+class GameLease(SQLModel, table=True):
+    """
+    Exclusive ownership of a game by one app process until expires_at, in seconds since the epoch.
+    Only the owner serves the game from its game store, see app/game_store.py.
+    epoch is incremented whenever another owner takes the lease, so a process renewing its lease
+    knows whether it held it all along. The lease is deleted when the game finishes.
+    Leases stay in the global database when games are sharded, so game_id has no foreign key.
+    """
+    game_id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    owner: str
+    expires_at: float
+    epoch: int = Field(default=1)
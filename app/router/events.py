@@ -0,0 +1,54 @@
+import json
+from typing import Annotated, AsyncIterator
+from fastapi import APIRouter, Header
+from fastapi.responses import StreamingResponse
+from ..event_feed import EventFeed, EventFeedDep, FeedEvent
+
+router = APIRouter(prefix="/events", tags=["events"])
+
+# Seconds without events before a comment is sent, so proxies don't close an idle stream
+KEEPALIVE_INTERVAL = 15.0
+
+RESET_EVENT = "event: reset\ndata: {}\n\n"
+KEEPALIVE_COMMENT = ": keep-alive\n\n"
+
+
+@router.get("", response_class=StreamingResponse, responses={200: {"content": {"text/event-stream": {}}}})
+async def get_events(
+        feed: EventFeedDep,
+        last_event_id: Annotated[int | None, Header(ge=0, description="Id of the last event received, to resume after it.")] = None
+    ):
+    """
+    Server-Sent Events stream of game-created, game-joined, game-finished and leaderboard-changed events
+
+    Game events hold the game as returned by GET /games/{id}, leaderboard-changed events the
+    game_id and the player_ids whose statistics changed. A client reconnecting with Last-Event-ID
+    resumes after that event. If events it missed are no longer kept, a reset event is sent first
+    and the client should reload what it tracks. Events are published per server process.
+    """
+    return StreamingResponse(
+        stream_events(feed, last_event_id or 0),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def stream_events(feed: EventFeed, last_id: int, keepalive_interval: float = KEEPALIVE_INTERVAL) -> AsyncIterator[str]:
+    """The SSE messages of the events after last_id, then of every new event"""
+    while True:
+        events, lost = feed.events_after(last_id)
+        if lost:
+            # Also when the client fell behind the buffer while reading
+            yield RESET_EVENT
+        for event in events:
+            yield format_event(event)
+        if events:
+            last_id = events[-1].id
+        elif lost:
+            last_id = feed.last_id
+        if not await feed.wait(last_id, keepalive_interval):
+            yield KEEPALIVE_COMMENT
+
+
+def format_event(event: FeedEvent) -> str:
+    return f"id: {event.id}\nevent: {event.type}\ndata: {json.dumps(event.data, separators=(',', ':'))}\n\n"
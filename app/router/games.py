@@ -1,170 +1,413 @@
-from fastapi import APIRouter, HTTPException, Path
-from ..database import SessionDep
+import anyio
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, Path, Query, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from sqlmodel import Session
+from ..database import Database, DatabaseDep, DatabaseFactoryDep
+from ..event_feed import EventFeed, EventFeedDep, EventType
+from ..game_hub import GameHub, GameHubDep
+from ..game_store import GameStore, GameStoreDep, MoveEvent
+from ..matchmaking import MatchmakingQueueDep
 from ..models import GameStatus
-from ..schemas import GameCreate, GameJoin, GamePublic, MoveCreate
+from ..schemas import GameCreate, GameImport, GameJoin, GamePublic, GamesImport, GamesImportResult, MoveCreate
 from .. import crud, game_logic
 from typing import Annotated
 
 router = APIRouter(prefix="/games", tags=["games"])
 
+DEFAULT_AVAILABLE_GAMES_LIMIT = 50
+MAX_AVAILABLE_GAMES_LIMIT = 200
+
+GAME_CHANGED_DETAIL = "Game was changed by another request, retry"
+
+DEFAULT_WAIT_TIMEOUT = 30.0
+MAX_WAIT_TIMEOUT = 60.0
+
 @router.post("", response_model=GamePublic, status_code=201)
-def create_game(game_data: GameCreate, session: SessionDep):
+async def create_game(
+        game_data: GameCreate, db: DatabaseDep, store: GameStoreDep, queue: MatchmakingQueueDep, feed: EventFeedDep
+    ):
     """
     Create a new game and return the game id of this game
 
+    The game is also queued for POST /matchmaking.
     If the player already has an unfinished game, it will return an error.
     """
-    player = crud.get_player(session, game_data.player_id)
+    player = await db.run(crud.get_player, game_data.player_id)
     if not player:
         raise HTTPException(status_code=404, detail="Player not found")
     
-    unfinished_game = crud.get_player_unfinished_game(session, game_data.player_id)
+    unfinished_game = await db.run(crud.get_player_unfinished_game, game_data.player_id)
     can_player_create, status_code, error_msg = game_logic.validate_player_can_join_new_game(unfinished_game)
     if not can_player_create:
         raise HTTPException(status_code=status_code, detail=error_msg)
     
-    game = crud.create_game(session, game_data.player_id)
+    game = await db.run(
+        store.create_game, game_data.player_id, game_data.board_rows, game_data.board_cols, game_data.win_length
+    )
+    queue.add(game)
     message = f"Game created with ID: {game.id} by player {game_data.player_id}, waiting for another player to join"
 
-    return build_game_response(game, message=message)
+    response = build_game_response(game, message=message)
+    publish_game_event(feed, EventType.GAME_CREATED, response)
+    return response
+
+@router.post("/import", response_model=GamesImportResult, status_code=201)
+async def import_games(import_data: GamesImport, db: DatabaseDep):
+    """
+    Import complete games played elsewhere, stored as finished games with their moves
+
+    Every game is replayed and must end with its last move, by a win or a full board.
+    The players' statistics and the leaderboards are updated as if the games were played here.
+    If any game is invalid nothing is imported, and the 422 detail lists the invalid games by index.
+    """
+    # Replaying is CPU bound, it runs in the threadpool instead of the event loop
+    replays = await run_in_threadpool(replay_imported_games, import_data)
+    players = await db.run(
+        crud.get_players, {player_id for game in import_data.games for player_id in (game.player1_id, game.player2_id)}
+    )
+    errors = []
+    valid_games = []
+    for index, (game, replay) in enumerate(zip(import_data.games, replays)):
+        if game.player1_id not in players or game.player2_id not in players:
+            errors.append({"index": index, "detail": "Player not found"})
+        elif isinstance(replay, str):
+            errors.append({"index": index, "detail": replay})
+        else:
+            valid_games.append(replay)
+
+    if errors:
+        raise HTTPException(status_code=422, detail=errors)
+    game_ids = await db.run(crud.import_games, valid_games)
+    return GamesImportResult(game_ids=game_ids)
 
 @router.post("/{game_id}/join", response_model=GamePublic)
-def join_game(
+async def join_game(
         game_id: Annotated[int, Path(gt=0, description="Game ID must be a positive integer.")],
         join_data: GameJoin,
-        session: SessionDep
+        db: DatabaseDep,
+        store: GameStoreDep,
+        hub: GameHubDep,
+        feed: EventFeedDep
     ):
     """
     Allows a player to join an existing, waiting game session.
 
     This endpoint validates that the game exists and is in a 'waiting'
     state before adding the second player and starting the game.
+    The join is written only if the game is still at the version it was validated against,
+    a 409 means it changed meanwhile and a retry validates against the current game.
     """
 
-    game = crud.get_game(session, game_id)
-    is_game_status_valid, status_code, error_msg = game_logic.validate_game_status_for_join(game, join_data.player_id)
-    if not is_game_status_valid:
-        raise HTTPException(status_code=status_code, detail=error_msg)
+    game = await db.run(store.get, game_id)
+    if not game:
+        raise HTTPException(status_code=404, detail="Game not found")
 
-    player = crud.get_player(session, join_data.player_id)
-    if not player:
-        raise HTTPException(status_code=404, detail="Player not found")
-    
-    unfinished_game = crud.get_player_unfinished_game(session, join_data.player_id)
-    can_player_join, status_code, error_msg = game_logic.validate_player_can_join_new_game(unfinished_game)
-    if not can_player_join:
-        raise HTTPException(status_code=status_code, detail=error_msg)
-    
-    game = crud.join_game(session, game_id, join_data.player_id)
-    message = f"Player {join_data.player_id} joined game with ID: {game.id}, game is now in progress, waiting for player {game.current_turn_player_id} to make a move"
-    return build_game_response(game, message=message)
+    async with game.lock:
+        is_game_status_valid, status_code, error_msg = game_logic.validate_game_status_for_join(game, join_data.player_id)
+        if not is_game_status_valid:
+            # The cached game may be behind a change made by another process
+            store.invalidate(game_id)
+            raise HTTPException(status_code=status_code, detail=error_msg)
+
+        player = await db.run(crud.get_player, join_data.player_id)
+        if not player:
+            raise HTTPException(status_code=404, detail="Player not found")
+        
+        unfinished_game = await db.run(crud.get_player_unfinished_game, join_data.player_id)
+        can_player_join, status_code, error_msg = game_logic.validate_player_can_join_new_game(unfinished_game)
+        if not can_player_join:
+            raise HTTPException(status_code=status_code, detail=error_msg)
+        
+        try:
+            await db.run(crud.join_game, game_id, join_data.player_id, game.version)
+        except crud.GameVersionConflict:
+            store.invalidate(game_id)
+            raise HTTPException(status_code=409, detail=GAME_CHANGED_DETAIL)
+        store.record_join(game, join_data.player_id)
+
+        message = f"Player {join_data.player_id} joined game with ID: {game.id}, game is now in progress, waiting for player {game.current_turn_player_id} to make a move"
+        response = build_game_response(game, message=message)
+        hub.publish(response)
+        publish_game_event(feed, EventType.GAME_JOINED, response)
+    return response
 
 @router.get("/available", response_model=list[GamePublic])
-def get_available_games(session: SessionDep):
+async def get_available_games(
+        response: Response,
+        db: DatabaseDep,
+        after_id: Annotated[int | None, Query(ge=0, description="Return games after this id, the X-Next-Cursor of the previous page.")] = None,
+        limit: Annotated[int, Query(ge=1, le=MAX_AVAILABLE_GAMES_LIMIT, description="Maximum number of games to return.")] = DEFAULT_AVAILABLE_GAMES_LIMIT,
+        created_after: Annotated[datetime | None, Query(description="Only games created after this time (UTC if no timezone).")] = None,
+        exclude_player_id: Annotated[int | None, Query(gt=0, description="Leave out the games this player is in.")] = None
+    ):
     """
-    Get all games available to join (waiting for players)
+    Get the games available to join (waiting for players), oldest first, one page at a time
+
+    When more games follow, the X-Next-Cursor header holds the after_id of the next page.
     """
-    games = crud.get_available_games(session)
-    return [build_game_response(game) for game in games]
+    # One extra game tells whether there is a next page
+    games = await db.run(
+        get_available_game_responses, after_id, limit + 1, created_after, exclude_player_id
+    )
+    if len(games) > limit:
+        games = games[:limit]
+        response.headers["X-Next-Cursor"] = str(games[-1].id)
+    return games
 
 @router.get("/{game_id}", response_model=GamePublic)
-def get_game(
+async def get_game(
         game_id: Annotated[int, Path(gt=0, description="Game ID must be a positive integer.")],
-        session: SessionDep
+        open_database: DatabaseFactoryDep,
+        store: GameStoreDep,
+        hub: GameHubDep,
+        wait_for_turn: Annotated[int | None, Query(gt=0, description="Wait until it is this player's turn.")] = None,
+        since_turn: Annotated[int | None, Query(ge=0, description="Wait until current_turn_number is past this turn.")] = None,
+        timeout: Annotated[float, Query(gt=0, le=MAX_WAIT_TIMEOUT, description="Seconds to wait at most.")] = DEFAULT_WAIT_TIMEOUT
     ):
     """
     Get a game status and grid by its id
+
+    With wait_for_turn and/or since_turn the request is held until the game reaches that turn,
+    or finishes, and returns the game then (long polling). After the timeout the current game
+    is returned, whatever its turn. Only changes made through this server process end the wait.
     """
-    game = crud.get_game(session, game_id)
-    if not game:
-        raise HTTPException(status_code=404, detail="Game not found")
-    moves = crud.get_moves_for_game(session, game_id)
-    grid = game_logic.calculate_grid_from_moves(moves, game.game_players)
-    return build_game_response(game, grid)
+    if wait_for_turn is None and since_turn is None:
+        async with open_database() as db:
+            game = await db.run(store.get, game_id)
+        if not game:
+            raise HTTPException(status_code=404, detail="Game not found")
+        return build_game_response(game)
+
+    with hub.subscribe(game_id) as updates:
+        # Subscribed before the game is read, so no later change is missed, even when the game
+        # is a snapshot read from the database rather than the state cached in the store.
+        # The database is released before waiting
+        async with open_database() as db:
+            game = await db.run(store.get, game_id)
+        if not game:
+            raise HTTPException(status_code=404, detail="Game not found")
+        if len(game.game_players) >= 2 and wait_for_turn is not None and wait_for_turn not in [gp.player_id for gp in game.game_players]:
+            raise HTTPException(status_code=403, detail="Player not in game")
+
+        response = build_game_response(game)
+        with anyio.move_on_after(timeout):
+            while not turn_reached(response, wait_for_turn, since_turn):
+                response = await updates.get()
+    return response
 
 @router.post("/{game_id}/move", response_model=GamePublic)
-def make_move(
+async def make_move(
         game_id: Annotated[int, Path(gt=0, description="Game ID must be a positive integer.")],
         move_data: MoveCreate,
-        session: SessionDep
+        db: DatabaseDep,
+        store: GameStoreDep,
+        hub: GameHubDep,
+        feed: EventFeedDep
     ):
     """
     Make a move in a game
     
     Only make a move if the game is in progress and it is the player's turn.
+    The move is validated and applied against the game store, see app/game_store.py.
+    It is written only if the game is still at the version it was validated against,
+    a 409 means it changed meanwhile and a retry validates against the current game.
     """
-    game = crud.get_game(session, game_id)
+    return await apply_move(game_id, move_data, db, store, hub, feed)
 
-    # Validate game status
-    is_game_status_valid, status_code, error_msg = game_logic.validate_game_status_for_move(game, move_data.player_id)
-    if not is_game_status_valid:
-        raise HTTPException(status_code=status_code, detail=error_msg)
+@router.websocket("/{game_id}/ws")
+async def game_websocket(
+        websocket: WebSocket,
+        game_id: Annotated[int, Path(gt=0, description="Game ID must be a positive integer.")],
+        open_database: DatabaseFactoryDep,
+        store: GameStoreDep,
+        hub: GameHubDep,
+        feed: EventFeedDep
+    ):
+    """
+    Live game state: the current game is sent on connect, then every join and move as it happens
 
-    # Validate move using game logic
-    assert game is not None
-    move_number = game.current_turn_number    
-    moves = crud.get_moves_for_game(session, game_id)
-    grid = game_logic.calculate_grid_from_moves(moves, game.game_players)
-    is_move_valid, status_code, error_msg = game_logic.validate_move(grid, move_data.position)   
-    if not is_move_valid:
-        raise HTTPException(status_code=status_code, detail=error_msg)
-    
-    move = crud.create_move(session, game_id, move_data.player_id, move_data.position, move_number)
-    
-    all_moves = moves + [move]
-    
-    # Advance the turn and check for win/draw
-    game.current_turn_number += 1
-    
-    new_grid = game_logic.calculate_grid_from_moves(all_moves, game.game_players)
-    player_number = next((gp.player_order for gp in game.game_players if gp.player_id == move_data.player_id), 0)
-    
-    if game_logic.check_win_condition(new_grid, player_number):
-        game.status = GameStatus.FINISHED
-        game.winner_id = move_data.player_id
-        message = f"Player {move_data.player_id} made a move at position {move_data.position} and won! Game is now finished"
-        
-        update_player_stats_on_game_finish(session, game, all_moves, winner_id=move_data.player_id)
+    Moves can be sent on the socket as MoveCreate JSON. An invalid move is answered with
+    {"error": {"status_code", "detail"}}, a valid one is pushed like any other update.
+    The socket is closed once the game is finished.
+    Updates are published in process, a socket only sees the changes made through its own worker.
+    """
+    async with open_database() as db:
+        game = await db.run(store.get, game_id)
+    if not game:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Game not found")
+        return
+
+    await websocket.accept()
+    with hub.subscribe(game_id) as updates:
+        # Subscribed before the current state is built, so no later change is missed
+        await websocket.send_json(build_game_response(game).model_dump(mode="json"))
+        if game.status == GameStatus.FINISHED:
+            await websocket.close()
+            return
+
+        async def send_updates(cancel_scope: anyio.CancelScope) -> None:
+            while True:
+                update = await updates.get()
+                await websocket.send_json(update.model_dump(mode="json"))
+                if update.status == GameStatus.FINISHED:
+                    await websocket.close()
+                    cancel_scope.cancel()
+                    return
+
+        async def receive_moves(cancel_scope: anyio.CancelScope) -> None:
+            try:
+                while True:
+                    data = await websocket.receive_text()
+                    try:
+                        move_data = MoveCreate.model_validate_json(data)
+                        # A database per move, an idle socket holds no connection
+                        async with open_database() as db:
+                            await apply_move(game_id, move_data, db, store, hub, feed)
+                    except ValidationError as e:
+                        await send_error(websocket, status.HTTP_422_UNPROCESSABLE_ENTITY, e.errors(include_url=False, include_context=False))
+                    except HTTPException as e:
+                        await send_error(websocket, e.status_code, e.detail)
+            except WebSocketDisconnect:
+                cancel_scope.cancel()
+
+        # Whichever side ends the socket cancels the other
+        async with anyio.create_task_group() as task_group:
+            task_group.start_soon(send_updates, task_group.cancel_scope)
+            task_group.start_soon(receive_moves, task_group.cancel_scope)
+
+async def send_error(websocket: WebSocket, status_code: int, detail) -> None:
+    await websocket.send_json({"error": {"status_code": status_code, "detail": detail}})
+
+async def apply_move(
+        game_id: int, move_data: MoveCreate, db: Database, store: GameStore, hub: GameHub, feed: EventFeed
+    ) -> GamePublic:
+    """
+    Validate and apply a move, publish the new game state and return it
+    Raises HTTPException if the move is rejected.
+    """
+    game = await db.run(store.get, game_id)
+    if not game:
+        raise HTTPException(status_code=404, detail="Game not found")
+
+    async with game.lock:
+        # Validate game status
+        is_game_status_valid, status_code, error_msg = game_logic.validate_game_status_for_move(game, move_data.player_id)
+        if not is_game_status_valid:
+            # The cached game may be behind a change made by another process
+            store.invalidate(game_id)
+            raise HTTPException(status_code=status_code, detail=error_msg)
+
+        # Validate move using game logic
+        bitboards = game_logic.decode_bitboards(game.board)
+        is_move_valid, status_code, error_msg = game_logic.validate_move_bitboards(
+            bitboards, move_data.position, game.board_rows, game.board_cols
+        )
+        if not is_move_valid:
+            raise HTTPException(status_code=status_code, detail=error_msg)
         
-    elif game_logic.check_draw_condition(new_grid):
-        game.status = GameStatus.FINISHED
-        # winner_id remains None for draw
-        message = f"Player {move_data.player_id} made a move at position {move_data.position} and it's a draw! Game is now finished"
+        move_number = game_logic.get_turn_number_from_bitboards(bitboards)
+        player_number = next((gp.player_order for gp in game.game_players if gp.player_id == move_data.player_id), 0)
+        new_bitboards = game_logic.apply_move_to_bitboards(bitboards, move_data.position, player_number)
+        event = MoveEvent(
+            game_id=game_id,
+            player_id=move_data.player_id,
+            position=move_data.position,
+            move_number=move_number,
+            status=GameStatus.IN_PROGRESS,
+            winner_id=None,
+            board=game_logic.encode_bitboards(new_bitboards),
+        )
         
-        update_player_stats_on_game_finish(session, game, all_moves, winner_id=None)
-    else:
-        message = f"Player {move_data.player_id} made a move at position {move_data.position}, game is still in progress, waiting for player {game.current_turn_player_id} to make a move"
+        # Check for win/draw
+        if game_logic.check_win_from_last_move(
+            new_bitboards[player_number - 1], move_data.position, game.board_rows, game.board_cols, game.win_length
+        ):
+            event.status = GameStatus.FINISHED
+            event.winner_id = move_data.player_id
+            event.player_results = build_player_results(game, new_bitboards, winner_id=move_data.player_id)
+            message = f"Player {move_data.player_id} made a move at position {move_data.position} and won! Game is now finished"
+            
+        elif game_logic.check_board_full(new_bitboards, game.board_rows, game.board_cols):
+            event.status = GameStatus.FINISHED
+            # winner_id remains None for draw
+            event.player_results = build_player_results(game, new_bitboards, winner_id=None)
+            message = f"Player {move_data.player_id} made a move at position {move_data.position} and it's a draw! Game is now finished"
+
+        # Advance the turn and store the new board
+        try:
+            await store.record_move_async(db, game, event)
+        except crud.GameVersionConflict:
+            raise HTTPException(status_code=409, detail=GAME_CHANGED_DETAIL)
 
-    session.add(game)
-    session.commit()
-    session.refresh(game)
+        if event.status == GameStatus.IN_PROGRESS:
+            message = f"Player {move_data.player_id} made a move at position {move_data.position}, game is still in progress, waiting for player {game.current_turn_player_id} to make a move"
     
-    return build_game_response(game, new_grid, message)
+        response = build_game_response(game, message)
+        # Published under the lock so subscribers get the game's updates in order
+        hub.publish(response)
+        if event.status == GameStatus.FINISHED:
+            publish_game_event(feed, EventType.GAME_FINISHED, response)
+            feed.publish(EventType.LEADERBOARD_CHANGED, {
+                "game_id": game_id, "player_ids": [player_id for player_id, _, _ in event.player_results],
+            })
+        return response
 
-def update_player_stats_on_game_finish(session: SessionDep, game, all_moves: list, winner_id: int | None):
+def get_available_game_responses(
+    session: Session,
+    after_id: int | None,
+    limit: int,
+    created_after: datetime | None,
+    exclude_player_id: int | None,
+) -> list[GamePublic]:
     """
-    Update player statistics when a game finishes (win or draw)
+    Responses for the waiting games, built inside the database call
     """
-    # Update stats for both players
-    for game_player in game.game_players:
-        player = crud.get_player(session, game_player.player_id)
-        if not player:
-            continue
-            
-        player_moves_count = len([move for move in all_moves if move.player_id == game_player.player_id])
-        
-        player.games_played += 1
-        player.total_moves += player_moves_count
-        
-        if winner_id and game_player.player_id == winner_id:
-            player.games_won += 1
-        
-        session.add(player)
+    games = crud.get_available_games(session, after_id, limit, created_after, exclude_player_id)
+    return [build_game_response(game) for game in games]
+
+def replay_imported_games(import_data: GamesImport) -> list[tuple[GameImport, int, bytes] | str]:
+    """
+    Replay every game of an import: (game, winner order, final board) for the valid games,
+    as crud.import_games takes them, and the error message for the others
+    """
+    replays: list[tuple[GameImport, int, bytes] | str] = []
+    for game in import_data.games:
+        is_game_valid, _, error_msg, bitboards, winner_order = game_logic.validate_complete_game(
+            game.positions, game.board_rows, game.board_cols, game.win_length
+        )
+        replays.append((game, winner_order, game_logic.encode_bitboards(bitboards)) if is_game_valid else error_msg)
+    return replays
+
+def turn_reached(game: GamePublic, wait_for_turn: int | None, since_turn: int | None) -> bool:
+    """
+    Whether a long polling GET /games/{id} is over: the game is finished,
+    or it is past since_turn and it is wait_for_turn's turn (each if given)
+    """
+    if game.status == GameStatus.FINISHED:
+        return True
+    if since_turn is not None and game.current_turn_number <= since_turn:
+        return False
+    return wait_for_turn is None or game.current_turn_player_id == wait_for_turn
+
+def publish_game_event(feed: EventFeed, type: str, game: GamePublic) -> None:
+    feed.publish(type, game.model_dump(mode="json", exclude={"message"}))
+
+def build_player_results(game, bitboards: tuple[int, int], winner_id: int | None) -> list[tuple[int, int, bool]]:
+    """
+    (player_id, moves made, won) of each player when a game finishes (win or draw)
+    Each player's move count is the number of positions on their bitboard.
+    """
+    return [
+        (game_player.player_id, bitboards[game_player.player_order - 1].bit_count(), game_player.player_id == winner_id)
+        for game_player in game.game_players
+    ]
 
 
-def build_game_response(game, grid: list[int] = [0,0,0,0,0,0,0,0,0], message: str | None = None) -> GamePublic:
+def build_game_response(game, message: str | None = None) -> GamePublic:
     """
-    Build GamePublic response using cached moves and grid to avoid database queries
+    Build GamePublic response from the board stored on the game to avoid database queries
     """
     # Extract player IDs by order (no database query needed)
     player1_id = next((gp.player_id for gp in game.game_players if gp.player_order == 1), None)
@@ -178,6 +421,9 @@ def build_game_response(game, grid: list[int] = [0,0,0,0,0,0,0,0,0], message: st
         current_turn_number=game.current_turn_number,
         current_turn_player_id=game.current_turn_player_id,
         winner_id=game.winner_id,
-        grid=[[grid[0],grid[1],grid[2]],[grid[3],grid[4],grid[5]],[grid[6],grid[7],grid[8]]],
+        board_rows=game.board_rows,
+        board_cols=game.board_cols,
+        win_length=game.win_length,
+        grid=game_logic.grid_from_bitboards(game_logic.decode_bitboards(game.board), game.board_rows, game.board_cols),
         message=message
     )
@@ -0,0 +1,21 @@
+from fastapi import APIRouter
+from ..database import DatabaseDep
+from ..game_store import GameStoreDep
+
+router = APIRouter(prefix="/internal", tags=["internal"])
+
+@router.get("/health")
+async def health():
+    """Liveness check of the worker, used by the gateway"""
+    return {"status": "ok"}
+
+@router.post("/release")
+async def release_games(db: DatabaseDep, store: GameStoreDep):
+    """
+    Persist the pending moves and drop the cached games
+
+    Called by the gateway when workers join or leave and games move to other workers,
+    so their new owners load them from the database.
+    """
+    released = await store.release_async(db)
+    return {"released_games": released}
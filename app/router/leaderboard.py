@@ -1,80 +1,109 @@
-from fastapi import APIRouter
-from ..database import SessionDep
-from ..schemas import PlayerStats
-from .. import crud
+from fastapi import APIRouter, Header, Query, Response, status
+from pydantic import TypeAdapter
+from sqlmodel import Session
+from ..database import DatabaseDep
+from ..leaderboards import LEADERBOARD_SIZE, Leaderboards, LeaderboardsDep
+from ..models import LeaderboardMetric
+from ..schemas import LeaderboardResponse, PlayerStats
+from typing import Annotated, Callable
 
 router = APIRouter(prefix="/leaderboard", tags=["leaderboard"])
 
+MAX_LEADERBOARD_LIMIT = 100
+
+LimitQuery = Annotated[int, Query(ge=1, le=MAX_LEADERBOARD_LIMIT, description="Number of players to return.")]
+OffsetQuery = Annotated[int, Query(ge=0, description="Number of players to skip.")]
+IfNoneMatchHeader = Annotated[str | None, Header()]
+
+player_stats_list = TypeAdapter(list[PlayerStats])
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def get_cached_response(
+        session: Session, boards: Leaderboards, key: tuple, if_none_match: str | None, build: Callable[[Session], bytes]
+    ) -> Response:
+    """
+    Serve a leaderboard response from the cache of the current leaderboard version, building it on a miss.
+    The version is the ETag, a conditional request for the current version returns 304 without reading players.
+    """
+    version = boards.refresh(session)
+    etag = f'"{version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    body = boards.cache.get(key, version)
+    if body is None:
+        body = build(session)
+        boards.cache.put(key, version, body)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@router.get("", response_model=LeaderboardResponse, response_model_exclude_unset=True)
+async def get_leaderboard(
+        db: DatabaseDep,
+        boards: LeaderboardsDep,
+        include: Annotated[list[LeaderboardMetric] | None, Query(description="Leaderboards to include, all by default.")] = None,
+        limit: LimitQuery = LEADERBOARD_SIZE,
+        if_none_match: IfNoneMatchHeader = None,
+    ):
+    """
+    Get the top players of several leaderboards at once, top 3 of each by default.
+    The leaderboards are synced once and read in a single pass.
+    """
+    metrics = list(dict.fromkeys(include)) if include else list(LeaderboardMetric)
+
+    def build(session: Session) -> bytes:
+        pages = boards.top_many(session, metrics, limit)
+        response = LeaderboardResponse(**{f"top_players_by_{metric.value}": page for metric, page in pages.items()})
+        return response.model_dump_json(exclude_unset=True).encode()
+
+    return await db.run(get_cached_response, boards, ("all", tuple(metrics), limit), if_none_match, build)
+
+
+async def get_metric_leaderboard(
+        db: DatabaseDep, boards: Leaderboards, metric: LeaderboardMetric, limit: int, offset: int, if_none_match: str | None
+    ) -> Response:
+    def build(session: Session) -> bytes:
+        return player_stats_list.dump_json(boards.top(session, metric, limit, offset))
+
+    return await db.run(get_cached_response, boards, (metric, limit, offset), if_none_match, build)
+
 @router.get("/wins", response_model=list[PlayerStats])
-def get_leaderboard_by_wins(session: SessionDep):
+async def get_leaderboard_by_wins(
+        db: DatabaseDep, boards: LeaderboardsDep, limit: LimitQuery = LEADERBOARD_SIZE, offset: OffsetQuery = 0,
+        if_none_match: IfNoneMatchHeader = None,
+    ):
     """
-    Get top 3 players by count of games won.
-    Only includes players who have won at least 1 game.
+    Get players by count of games won, top 3 by default.
+    Only includes players who have won at least 1 game. Tied players share a rank.
     """
-    player_stats_list = get_player_stats_list(session)
-    
-    top_players_by_wins = sorted(player_stats_list, key=lambda p: p.games_won, reverse=True)[:3]
-    
-    # Add rank to each player
-    for rank, player in enumerate(top_players_by_wins, 1):
-        player.rank = rank
-    
-    return top_players_by_wins
+    return await get_metric_leaderboard(db, boards, LeaderboardMetric.WINS, limit, offset, if_none_match)
 
 @router.get("/efficiency", response_model=list[PlayerStats])
-def get_leaderboard_by_efficiency(session: SessionDep):
+async def get_leaderboard_by_efficiency(
+        db: DatabaseDep, boards: LeaderboardsDep, limit: LimitQuery = LEADERBOARD_SIZE, offset: OffsetQuery = 0,
+        if_none_match: IfNoneMatchHeader = None,
+    ):
     """
-    Get top 3 players by efficiency (average moves per win).
-    Only includes players who have won at least 1 game.
+    Get players by efficiency (average moves per win), top 3 by default.
+    Only includes players who have won at least 1 game. Tied players share a rank.
     """
-    player_stats_list = get_player_stats_list(session)
-    
-    top_players_by_efficiency = sorted(player_stats_list, key=lambda p: p.efficiency)[:3]
-    
-    # Add rank to each player
-    for rank, player in enumerate(top_players_by_efficiency, 1):
-        player.rank = rank
-    
-    return top_players_by_efficiency
+    return await get_metric_leaderboard(db, boards, LeaderboardMetric.EFFICIENCY, limit, offset, if_none_match)
 
 @router.get("/win_rate", response_model=list[PlayerStats])
-def get_leaderboard_by_win_rate(session: SessionDep):
-    """
-    Get top 3 players by win rate (percentage of games won).
-    Only includes players who have played at least 1 game.
-    """
-    player_stats_list = get_player_stats_list(session)
-    
-    top_players_by_win_rate = sorted(player_stats_list, key=lambda p: p.win_rate, reverse=True)[:3]
-    
-    # Add rank to each player
-    for rank, player in enumerate(top_players_by_win_rate, 1):
-        player.rank = rank
-    
-    return top_players_by_win_rate
-
-def get_player_stats_list(session: SessionDep) -> list[PlayerStats]:
+async def get_leaderboard_by_win_rate(
+        db: DatabaseDep, boards: LeaderboardsDep, limit: LimitQuery = LEADERBOARD_SIZE, offset: OffsetQuery = 0,
+        if_none_match: IfNoneMatchHeader = None,
+    ):
     """
-    Helper function to get all player statistics as PlayerStats objects.
+    Get players by win rate (percentage of games won), top 3 by default.
+    Only includes players who have won at least 1 game. Tied players share a rank.
     """
-    players_with_wins = crud.get_players_with_wins(session)
-    player_stats_list = []
-    
-    for player in players_with_wins:
-        win_rate = round(player.games_won / player.games_played, 3) if player.games_played > 0 else 0.0
-        efficiency = round(player.total_moves / player.games_won, 2) if player.games_won > 0 else 999999.0
-        
-        if player.id is None:
-            continue
-            
-        player_stats = PlayerStats(
-            player_id=player.id,
-            games_played=player.games_played,
-            games_won=player.games_won,
-            total_moves=player.total_moves,
-            win_rate=win_rate,
-            efficiency=efficiency
-        )
-        player_stats_list.append(player_stats)
-    
-    return player_stats_list
+    return await get_metric_leaderboard(db, boards, LeaderboardMetric.WIN_RATE, limit, offset, if_none_match)
@@ -0,0 +1,91 @@
+import logging
+
+import httpx
+from fastapi import APIRouter, HTTPException, Response
+from ..database import DatabaseDep
+from ..event_feed import EventFeedDep, EventType
+from ..game_hub import GameHubDep
+from ..game_store import GameStoreDep
+from ..matchmaking import GatewayClientDep, MatchmakingQueueDep
+from ..schemas import GameCreate, GamePublic
+from .. import crud, game_logic
+from .games import build_game_response, publish_game_event
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/matchmaking", tags=["matchmaking"])
+
+@router.post("", response_model=GamePublic, responses={201: {"model": GamePublic, "description": "Game created, waiting for another player"}})
+async def find_match(
+        game_data: GameCreate,
+        response: Response,
+        db: DatabaseDep,
+        store: GameStoreDep,
+        queue: MatchmakingQueueDep,
+        hub: GameHubDep,
+        feed: EventFeedDep,
+        gateway: GatewayClientDep
+    ):
+    """
+    Join the oldest waiting game with the same board settings, or create one if there is none
+
+    Returns 200 with the joined game, now in progress, or 201 with the created game.
+    If the player already has an unfinished game, it will return an error.
+    """
+    player = await db.run(crud.get_player, game_data.player_id)
+    if not player:
+        raise HTTPException(status_code=404, detail="Player not found")
+
+    board_settings = (game_data.board_rows, game_data.board_cols, game_data.win_length)
+    async with queue.lock:
+        unfinished_game = await db.run(crud.get_player_unfinished_game, game_data.player_id)
+        can_player_play, status_code, error_msg = game_logic.validate_player_can_join_new_game(unfinished_game)
+        if not can_player_play:
+            raise HTTPException(status_code=status_code, detail=error_msg)
+
+        while (game_id := queue.pop(board_settings)) is not None:
+            if gateway is not None:
+                # The game's owner joins it, its cached game would be behind a join made here
+                try:
+                    joined_response = await gateway.post(f"/games/{game_id}/join", json={"player_id": game_data.player_id})
+                except httpx.HTTPError as error:
+                    logger.warning("Could not join game %d through the gateway: %r", game_id, error)
+                    continue
+                if joined_response.status_code != 200:
+                    # Joined or gone meanwhile, like the games skipped below
+                    continue
+                return joined_response.json()
+
+            # The worker serving the game's routes claims it, not the lobby
+            game = await db.run(store.get, game_id, False)
+            if not game:
+                continue
+            async with game.lock:
+                # The game may have been joined through POST /games/{id}/join meanwhile
+                is_game_status_valid, _, _ = game_logic.validate_game_status_for_join(game, game_data.player_id)
+                if not is_game_status_valid:
+                    continue
+                try:
+                    await db.run(crud.join_game, game_id, game_data.player_id, game.version)
+                except crud.GameVersionConflict:
+                    # Joined by another process, its cached state is behind
+                    store.invalidate(game_id)
+                    continue
+                store.record_join(game, game_data.player_id)
+
+                message = f"Player {game_data.player_id} joined game with ID: {game.id}, game is now in progress, waiting for player {game.current_turn_player_id} to make a move"
+                joined = build_game_response(game, message=message)
+                hub.publish(joined)
+                publish_game_event(feed, EventType.GAME_JOINED, joined)
+            return joined
+
+        game = await db.run(
+            store.create_game, game_data.player_id, game_data.board_rows, game_data.board_cols, game_data.win_length
+        )
+        queue.add(game)
+
+    response.status_code = 201
+    message = f"Game created with ID: {game.id} by player {game_data.player_id}, waiting for another player to join"
+    created = build_game_response(game, message=message)
+    publish_game_event(feed, EventType.GAME_CREATED, created)
+    return created
@@ -1,18 +1,20 @@
-from fastapi import APIRouter, HTTPException, Path
-from ..database import SessionDep
-from ..schemas import PlayerPublic
+from fastapi import APIRouter, HTTPException, Path, Query
+from ..database import DatabaseDep
+from ..schemas import PlayerPublic, PlayersBulkCreated
 from .. import crud
 from typing import Annotated
 
 router = APIRouter(prefix="/players", tags=["players"])
 
+MAX_BULK_PLAYERS = 100_000
+
 
 @router.post("", response_model=PlayerPublic, status_code=201)
-def create_player(session: SessionDep):
+async def create_player(db: DatabaseDep):
     """
     Create a new player and return the player id of this player
     """
-    player = crud.create_player(session)
+    player = await db.run(crud.create_player)
     assert player.id is not None
     return PlayerPublic(
         id=player.id,
@@ -22,15 +24,27 @@ def create_player(session: SessionDep):
     )
 
 
+@router.post("/bulk", response_model=PlayersBulkCreated, status_code=201)
+async def create_players(
+        db: DatabaseDep,
+        count: Annotated[int, Query(ge=1, le=MAX_BULK_PLAYERS, description="Number of players to create.")]
+    ):
+    """
+    Create count players in a single transaction and return their ids
+    """
+    player_ids = await db.run(crud.create_players, count)
+    return PlayersBulkCreated(player_ids=player_ids)
+
+
 @router.get("/{player_id}", response_model=PlayerPublic)
-def get_player(
+async def get_player(
         player_id: Annotated[int, Path(gt=0, description="Player ID must be a positive integer.")],
-        session: SessionDep
+        db: DatabaseDep
     ):
     """
     Get a player info by their id
     """
-    player = crud.get_player(session, player_id)
+    player = await db.run(crud.get_player, player_id)
     if not player:
         raise HTTPException(status_code=404, detail="Player not found")
     assert player.id is not None
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from typing import Annotated
 
 from .models import GameStatus
@@ -10,6 +10,10 @@ class PlayerPublic(BaseModel):
     games_won: int
     message: str | None = None
 
+class PlayersBulkCreated(BaseModel):
+    """Response schema for players created in bulk"""
+    player_ids: list[int] = Field(description="Ids of the created players, ascending")
+
 class PlayerStats(BaseModel):
     """Detailed player statistics for leaderboard"""
     player_id: int
@@ -24,6 +28,42 @@ class PlayerStats(BaseModel):
 class GameCreate(BaseModel):
     """Request schema for creating a game"""
     player_id: Annotated[int, Field(gt=0, description="Player ID must be a positive integer.")]
+    board_rows: int = Field(default=3, ge=3, le=19, description="Number of grid rows")
+    board_cols: int = Field(default=3, ge=3, le=19, description="Number of grid columns")
+    win_length: int = Field(default=3, ge=3, le=19, description="Number in a row needed to win")
+
+    @model_validator(mode="after")
+    def check_win_length_fits_board(self) -> "GameCreate":
+        if self.win_length > max(self.board_rows, self.board_cols):
+            raise ValueError("win_length cannot be longer than the board")
+        return self
+
+class GameImport(BaseModel):
+    """A complete game played elsewhere, to be stored as finished"""
+    player1_id: Annotated[int, Field(gt=0, description="Player ID of the first player to move.")]
+    player2_id: Annotated[int, Field(gt=0, description="Player ID of the second player to move.")]
+    board_rows: int = Field(default=3, ge=3, le=19, description="Number of grid rows")
+    board_cols: int = Field(default=3, ge=3, le=19, description="Number of grid columns")
+    win_length: int = Field(default=3, ge=3, le=19, description="Number in a row needed to win")
+    positions: list[Annotated[int, Field(ge=0)]] = Field(
+        min_length=1, max_length=19 * 19, description="Grid positions in the order they were played, player 1 first"
+    )
+
+    @model_validator(mode="after")
+    def check_game_settings(self) -> "GameImport":
+        if self.win_length > max(self.board_rows, self.board_cols):
+            raise ValueError("win_length cannot be longer than the board")
+        if self.player1_id == self.player2_id:
+            raise ValueError("player1_id and player2_id must be different players")
+        return self
+
+class GamesImport(BaseModel):
+    """Request schema for importing complete games"""
+    games: list[GameImport] = Field(min_length=1, max_length=10_000)
+
+class GamesImportResult(BaseModel):
+    """Response schema for imported games"""
+    game_ids: list[int] = Field(description="Ids of the imported games, in request order")
 
 class GameJoin(BaseModel):
     """Request schema for joining a game"""
@@ -38,18 +78,21 @@ class GamePublic(BaseModel):
     current_turn_number: int
     current_turn_player_id: int | None
     winner_id: int | None
-    grid: list[list[int]] = Field(description="3x3 grid as list of 2D list (0=empty, 1=player1, 2=player2)")
+    board_rows: int
+    board_cols: int
+    win_length: int
+    grid: list[list[int]] = Field(description="board_rows x board_cols grid as list of 2D list (0=empty, 1=player1, 2=player2)")
     message: str | None = None
 
 
 class MoveCreate(BaseModel):
     """Request schema for making a move"""
     player_id: Annotated[int, Field(gt=0, description="Player ID must be a positive integer.")]
-    position: int = Field(ge=0, le=8, description="Grid position 0-8")
+    position: int = Field(ge=0, description="Grid position, 0 to board_rows * board_cols - 1 row by row")
 
 
 class LeaderboardResponse(BaseModel):
-    """Response schema for leaderboard"""
-    top_players_by_efficiency: list[PlayerStats]
-    top_players_by_wins: list[PlayerStats]
-    top_players_by_win_rate: list[PlayerStats]
\ No newline at end of file
+    """Response schema for leaderboard, leaderboards that were not requested are left out"""
+    top_players_by_efficiency: list[PlayerStats] = Field(default_factory=list)
+    top_players_by_wins: list[PlayerStats] = Field(default_factory=list)
+    top_players_by_win_rate: list[PlayerStats] = Field(default_factory=list)
\ No newline at end of file
@@ -0,0 +1,136 @@
+"""
+Hash sharding of the game tables across several SQLite databases.
+
+SQLite has one writer per database file, so a single database caps the moves per second.
+With DATABASE_SHARDS > 1 the games, their game players and moves live in N shard databases,
+routed by game id, and the players and the leaderboard version stay in the global database.
+Moves of games on different shards are written in parallel, only games finishing also write
+the global database.
+
+ShardedSession is SQLAlchemy's horizontal sharding Session, so the crud functions keep taking
+one session: statements are routed by the game ids in their WHERE clause, or run on every shard
+and their results concatenated. Fan-out queries that are ordered or limited must merge the
+shards' results themselves, see crud.get_available_games.
+
+Game ids encode their shard: shard = game_id % N. A new game is placed on the next shard in
+turn and gets the shard's largest id + N, computed by its INSERT, so concurrent inserts can't
+allocate the same id. A transaction touching several databases commits each of them in turn,
+it is not atomic across them.
+"""
+from itertools import count
+from typing import Any, Iterable, Mapping
+
+from sqlalchemy import BinaryExpression, BindParameter, BooleanClauseList, Engine, event, func, inspect
+from sqlalchemy.ext import horizontal_shard
+from sqlalchemy.orm import ORMExecuteState
+from sqlalchemy.sql import operators
+from sqlmodel import Session, select
+
+from .models import Game, GamePlayer, Move
+
+GLOBAL_SHARD = "global"
+
+GAME_TABLES = {Game, GamePlayer, Move}
+# (table, column) holding the game id of the rows of each game table
+GAME_ID_COLUMNS = {("game", "id"), ("gameplayer", "game_id"), ("move", "game_id")}
+
+# Shard of the next new game, shared by the sessions of the process
+_next_shard = count()
+
+
+def shard_of(game_id: int, shard_count: int) -> int:
+    return game_id % shard_count
+
+
+def choose_new_game_shard(shard_count: int) -> int:
+    return next(_next_shard) % shard_count
+
+
+def next_game_id(shard: int, shard_count: int):
+    """SQL expression of the next game id of a shard: its largest id + N, or the shard's first id"""
+    first_id = shard or shard_count
+    return select(func.coalesce(func.max(Game.id), first_id - shard_count) + shard_count).scalar_subquery()
+
+
+class ShardedSession(horizontal_shard.ShardedSession, Session):
+    """SQLModel Session routing the game tables to the shard databases, the other tables to the global database"""
+    def __init__(self, shards: Mapping[Any, Engine], **kwargs):
+        self.shard_count = len(shards) - 1
+        super().__init__(
+            shards=dict(shards),
+            shard_chooser=self._choose_shard,
+            identity_chooser=self._choose_identity_shards,
+            execute_chooser=self._choose_execute_shards,
+            **kwargs,
+        )
+
+    def _choose_shard(self, mapper, instance, clause=None):
+        if mapper is None or mapper.class_ not in GAME_TABLES:
+            return GLOBAL_SHARD
+        if isinstance(instance, Game):
+            if instance.id is None:
+                # A new game, its id is allocated on the shard, see assign_game_id
+                return choose_new_game_shard(self.shard_count)
+            return shard_of(instance.id, self.shard_count)
+        if instance is not None:
+            return shard_of(instance.game_id, self.shard_count)
+        return 0
+
+    def _choose_identity_shards(self, mapper, primary_key, **kwargs) -> list:
+        if mapper.class_ not in GAME_TABLES:
+            return [GLOBAL_SHARD]
+        if mapper.class_ is Move:
+            # Move ids are allocated per shard
+            return list(range(self.shard_count))
+        # The primary keys of Game and GamePlayer start with the game id
+        return [shard_of(primary_key[0], self.shard_count)]
+
+    def _choose_execute_shards(self, orm_context: ORMExecuteState) -> list:
+        mapper = orm_context.bind_mapper
+        if mapper is None or mapper.class_ not in GAME_TABLES:
+            return [GLOBAL_SHARD]
+        game_ids = game_ids_of(orm_context)
+        if game_ids is None:
+            return list(range(self.shard_count))
+        return sorted({shard_of(game_id, self.shard_count) for game_id in game_ids})
+
+
+def game_ids_of(orm_context: ORMExecuteState) -> set[int] | None:
+    """
+    The game ids a statement is restricted to by a top level `game id = x` or `game id IN (...)`
+    condition, or None if it may read or change the rows of any game
+    """
+    where = getattr(orm_context.statement, "whereclause", None)
+    if where is None:
+        return None
+    conditions: Iterable = where.clauses if isinstance(where, BooleanClauseList) and where.operator is operators.and_ else [where]
+    for condition in conditions:
+        if not isinstance(condition, BinaryExpression) or not isinstance(condition.right, BindParameter):
+            continue
+        column = condition.left
+        table = getattr(column, "table", None)
+        if table is None or (getattr(table, "name", None), getattr(column, "key", None)) not in GAME_ID_COLUMNS:
+            continue
+        bind = condition.right
+        parameters = orm_context.parameters
+        value = parameters[bind.key] if isinstance(parameters, dict) and bind.key in parameters else bind.effective_value
+        if condition.operator is operators.eq:
+            return {value}
+        if condition.operator is operators.in_op:
+            return set(value)
+    return None
+
+
+def game_shard_count(session: Session) -> int:
+    """Number of shards holding the games of a session, 1 when the database is not sharded"""
+    return session.shard_count if isinstance(session, ShardedSession) else 1
+
+
+@event.listens_for(Game, "before_insert")
+def assign_game_id(mapper, connection, target: Game) -> None:
+    """Allocate the id of a new game on a sharded session, in the INSERT on its shard"""
+    shard = inspect(target).identity_token
+    if target.id is None and isinstance(shard, int):
+        session = inspect(target).session
+        assert isinstance(session, ShardedSession)
+        target.id = next_game_id(shard, session.shard_count)  # type: ignore[assignment]
@@ -0,0 +1,81 @@
+"""
+Benchmark evaluating stored games one at a time with the list based game logic against the
+NumPy batch evaluator.
+
+Run from the project root:
+    python -m benchmarks.bench_batch_eval
+"""
+import random
+import time
+
+from app import batch_eval, game_logic
+from app.models import GamePlayer, Move
+
+GAME_COUNT = 20_000
+
+GAME_PLAYERS = [
+    GamePlayer(game_id=0, player_id=1, player_order=1),
+    GamePlayer(game_id=0, player_id=2, player_order=2),
+]
+
+
+def generate_games(rng: random.Random) -> list[list[int]]:
+    """Random 3x3 games played until a win or a full board"""
+    games = []
+    for _ in range(GAME_COUNT):
+        positions = list(range(9))
+        rng.shuffle(positions)
+        bitboards = game_logic.EMPTY_BITBOARDS
+        for index, position in enumerate(positions):
+            player_number = index % 2 + 1
+            bitboards = game_logic.apply_move_to_bitboards(bitboards, position, player_number)
+            if game_logic.check_win_from_last_move(bitboards[player_number - 1], position, 3, 3, 3):
+                positions = positions[:index + 1]
+                break
+        games.append(positions)
+    return games
+
+
+def evaluate_one_at_a_time(games: list[list[int]]) -> int:
+    finished = 0
+    for positions in games:
+        moves = [
+            Move(game_id=0, player_id=index % 2 + 1, position=position, move_number=index + 1)
+            for index, position in enumerate(positions)
+        ]
+        grid = game_logic.calculate_grid_from_moves(moves, GAME_PLAYERS)
+        if game_logic.check_win_condition(grid, 1) or game_logic.check_win_condition(grid, 2) or game_logic.check_draw_condition(grid):
+            finished += 1
+    return finished
+
+
+def evaluate_in_batch(games: list[list[int]]) -> int:
+    game_rows = [(game_id, 3, 3, 3) for game_id in range(len(games))]
+    move_rows = [
+        (game_id, position, index % 2 + 1)
+        for game_id, positions in enumerate(games)
+        for index, position in enumerate(positions)
+    ]
+    result = batch_eval.evaluate_batch(batch_eval.build_batches(game_rows, move_rows)[0])
+    return int(((result.winner_orders != 0) | result.is_draw).sum())
+
+
+def main():
+    games = generate_games(random.Random(0))
+
+    start = time.perf_counter()
+    one_at_a_time_finished = evaluate_one_at_a_time(games)
+    one_at_a_time_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch_finished = evaluate_in_batch(games)
+    batch_time = time.perf_counter() - start
+
+    assert one_at_a_time_finished == batch_finished == GAME_COUNT
+    print(f"{GAME_COUNT} games")
+    print(f"one at a time: {one_at_a_time_time:.2f}s ({GAME_COUNT / one_at_a_time_time:,.0f} games/s)")
+    print(f"batch:         {batch_time:.2f}s ({GAME_COUNT / batch_time:,.0f} games/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Microbenchmarks comparing the list based game logic against the bitboard functions.
+
+Run from the project root:
+    python -m benchmarks.bench_game_logic
+"""
+import timeit
+from datetime import datetime, timezone
+
+from app import game_logic
+from app.models import GamePlayer, Move
+
+NUMBER = 100_000
+
+GAME_PLAYERS = [
+    GamePlayer(game_id=1, player_id=1, player_order=1, joined_at=datetime.now(timezone.utc)),
+    GamePlayer(game_id=1, player_id=2, player_order=2, joined_at=datetime.now(timezone.utc)),
+]
+
+# The draw game from the simulation: every cell filled, no winner
+DRAW_POSITIONS = [1, 0, 3, 2, 4, 5, 6, 7, 8]
+MOVES = [
+    Move(game_id=1, player_id=1 if i % 2 == 0 else 2, position=pos, move_number=i + 1)
+    for i, pos in enumerate(DRAW_POSITIONS)
+]
+
+
+def bitboards_from_moves(moves: list[Move], game_players: list[GamePlayer]) -> tuple[int, int]:
+    """The (player1, player2) bitboards of moves, like the grid of calculate_grid_from_moves"""
+    player_order_map = {gp.player_id: gp.player_order for gp in game_players}
+    # Index 0 collects moves by players not in the game and is discarded
+    boards = [0, 0, 0]
+    for move in moves:
+        boards[player_order_map.get(move.player_id, 0)] |= 1 << move.position
+    return boards[1], boards[2]
+
+
+def bitboard_draw_check(bitboards: tuple[int, int]) -> bool:
+    """Draw check of the last move at position 8 on the bitboards"""
+    return not game_logic.check_win_from_last_move(bitboards[0], 8, 3, 3, 3) and game_logic.check_board_full(bitboards, 3, 3)
+
+
+GRID = game_logic.calculate_grid_from_moves(MOVES, GAME_PLAYERS)
+BITBOARDS = bitboards_from_moves(MOVES, GAME_PLAYERS)
+
+
+def list_move_check():
+    """What make_move used to do: rebuild the grid twice and scan all patterns"""
+    grid = game_logic.calculate_grid_from_moves(MOVES[:-1], GAME_PLAYERS)
+    game_logic.validate_move(grid, 8)
+    grid = game_logic.calculate_grid_from_moves(MOVES, GAME_PLAYERS)
+    if not game_logic.check_win_condition(grid, 1):
+        game_logic.check_draw_condition(grid)
+
+
+def bitboard_move_check():
+    """Build bitboards once, apply the move and check the lines through it"""
+    bitboards = bitboards_from_moves(MOVES[:-1], GAME_PLAYERS)
+    game_logic.validate_move_bitboards(bitboards, 8)
+    bitboards = game_logic.apply_move_to_bitboards(bitboards, 8, 1)
+    if not game_logic.check_win_from_last_move(bitboards[0], 8, 3, 3, 3):
+        game_logic.check_board_full(bitboards, 3, 3)
+
+
+BENCHMARKS = [
+    (
+        "build board from moves",
+        lambda: game_logic.calculate_grid_from_moves(MOVES, GAME_PLAYERS),
+        lambda: bitboards_from_moves(MOVES, GAME_PLAYERS),
+    ),
+    (
+        "win check",
+        lambda: game_logic.check_win_condition(GRID, 1),
+        lambda: game_logic.check_win_from_last_move(BITBOARDS[0], 8, 3, 3, 3),
+    ),
+    (
+        "draw check",
+        lambda: game_logic.check_draw_condition(GRID),
+        lambda: bitboard_draw_check(BITBOARDS),
+    ),
+    (
+        "validate move",
+        lambda: game_logic.validate_move(GRID, 4),
+        lambda: game_logic.validate_move_bitboards(BITBOARDS, 4),
+    ),
+    (
+        "full make_move check",
+        list_move_check,
+        bitboard_move_check,
+    ),
+]
+
+
+def main():
+    print(f"{'benchmark':<24} {'list (us)':>10} {'bitboard (us)':>14} {'speedup':>8}")
+    for name, list_fn, bitboard_fn in BENCHMARKS:
+        list_time = min(timeit.repeat(list_fn, number=NUMBER, repeat=3)) / NUMBER * 1e6
+        bitboard_time = min(timeit.repeat(bitboard_fn, number=NUMBER, repeat=3)) / NUMBER * 1e6
+        print(f"{name:<24} {list_time:>10.3f} {bitboard_time:>14.3f} {list_time / bitboard_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark importing complete games with POST /games/import against playing them one request at
+a time through create, join and move, on the tuned SQLite engine.
+
+The import path is the route's: every game is replayed with replay_imported_games, then the
+batch is stored in one transaction by crud.import_games. The one at a time path makes the crud calls of the /games
+routes, one transaction each.
+
+Run from the project root:
+    python -m benchmarks.bench_import
+"""
+import os
+import random
+import tempfile
+import time
+
+from sqlmodel import Session, SQLModel
+
+from app import crud, game_logic
+from app.database import create_sqlite_engine
+from app.game_store import MoveEvent
+from app.models import GameStatus
+from app.router.games import replay_imported_games
+from app.schemas import GameImport, GamesImport
+
+IMPORTED_GAMES = 20_000
+BATCH_SIZE = 2_000
+PLAYED_GAMES = 500
+PLAYER_COUNT = 100
+
+
+def random_complete_game(rng: random.Random) -> list[int]:
+    """Random legal positions of a 3x3 game, up to the win or the full board"""
+    positions = list(range(9))
+    rng.shuffle(positions)
+    bitboards = game_logic.EMPTY_BITBOARDS
+    for index, position in enumerate(positions):
+        player_number = index % 2 + 1
+        bitboards = game_logic.apply_move_to_bitboards(bitboards, position, player_number)
+        if game_logic.check_win_from_last_move(bitboards[player_number - 1], position, 3, 3, 3):
+            return positions[:index + 1]
+    return positions
+
+
+def random_games(rng: random.Random, player_ids: list[int], count: int) -> list[GameImport]:
+    games = []
+    for _ in range(count):
+        player1_id, player2_id = rng.sample(player_ids, 2)
+        games.append(GameImport(player1_id=player1_id, player2_id=player2_id, positions=random_complete_game(rng)))
+    return games
+
+
+def play_one_at_a_time(session: Session, games: list[GameImport]) -> None:
+    for game in games:
+        game_id = crud.create_game(session, game.player1_id).id
+        assert game_id is not None
+        crud.join_game(session, game_id, game.player2_id)
+        is_game_valid, _, _, final_bitboards, winner_order = game_logic.validate_complete_game(game.positions)
+        assert is_game_valid
+
+        bitboards = game_logic.EMPTY_BITBOARDS
+        player_ids = (game.player1_id, game.player2_id)
+        for index, position in enumerate(game.positions):
+            player_number = index % 2 + 1
+            bitboards = game_logic.apply_move_to_bitboards(bitboards, position, player_number)
+            finished = index == len(game.positions) - 1
+            crud.apply_move_events(session, [MoveEvent(
+                game_id=game_id,
+                player_id=player_ids[player_number - 1],
+                position=position,
+                move_number=index + 1,
+                status=GameStatus.FINISHED if finished else GameStatus.IN_PROGRESS,
+                winner_id=player_ids[winner_order - 1] if finished and winner_order else None,
+                board=game_logic.encode_bitboards(bitboards),
+                player_results=[
+                    (player_ids[0], final_bitboards[0].bit_count(), winner_order == 1),
+                    (player_ids[1], final_bitboards[1].bit_count(), winner_order == 2),
+                ] if finished else [],
+            )])
+
+
+def main():
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_sqlite_engine(f"sqlite:///{os.path.join(directory, 'import.db')}")
+        SQLModel.metadata.create_all(engine)
+        with Session(engine) as session:
+            player_ids = [crud.create_player(session).id for _ in range(PLAYER_COUNT)]
+            played_games = random_games(rng, player_ids, PLAYED_GAMES)  # type: ignore[arg-type]
+            imported_games = random_games(rng, player_ids, IMPORTED_GAMES)  # type: ignore[arg-type]
+
+            start = time.perf_counter()
+            play_one_at_a_time(session, played_games)
+            played_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for batch_start in range(0, IMPORTED_GAMES, BATCH_SIZE):
+                replays = replay_imported_games(GamesImport(games=imported_games[batch_start:batch_start + BATCH_SIZE]))
+                crud.import_games(session, replays)  # type: ignore[arg-type]
+            imported_time = time.perf_counter() - start
+        engine.dispose()
+
+    print(f"one at a time: {PLAYED_GAMES} games in {played_time:.2f}s ({PLAYED_GAMES / played_time * 60:,.0f} games/min)")
+    print(f"import:        {IMPORTED_GAMES} games in {imported_time:.2f}s ({IMPORTED_GAMES / imported_time * 60:,.0f} games/min, batches of {BATCH_SIZE})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark concurrent move persistence on the default SQLite engine against the tuned profile
+(WAL, synchronous=NORMAL, mmap, cache_size, busy_timeout and pool sizing from app/config.py).
+
+Each thread plays its own games and persists every move in its own transaction, like the
+game store does with write behind disabled.
+
+Run from the project root:
+    python -m benchmarks.bench_sqlite_profile
+"""
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy import Engine
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, SQLModel, create_engine
+
+from app import crud, game_logic
+from app.database import create_sqlite_engine
+from app.game_store import MoveEvent
+from app.models import GameStatus
+
+THREAD_COUNT = 8
+GAMES_PER_THREAD = 25
+# Draw: every game makes the 9 moves
+POSITIONS = [0, 1, 2, 4, 3, 5, 7, 6, 8]
+
+
+def play_games(engine: Engine, errors: list[Exception]) -> None:
+    with Session(engine) as session:
+        try:
+            player1_id = crud.create_player(session).id
+            player2_id = crud.create_player(session).id
+            assert player1_id is not None and player2_id is not None
+            for _ in range(GAMES_PER_THREAD):
+                game_id = crud.create_game(session, player1_id).id
+                assert game_id is not None
+                crud.join_game(session, game_id, player2_id)
+
+                bitboards = game_logic.EMPTY_BITBOARDS
+                for index, position in enumerate(POSITIONS):
+                    player_number = index % 2 + 1
+                    bitboards = game_logic.apply_move_to_bitboards(bitboards, position, player_number)
+                    finished = index == len(POSITIONS) - 1
+                    crud.apply_move_events(session, [MoveEvent(
+                        game_id=game_id,
+                        player_id=player1_id if player_number == 1 else player2_id,
+                        position=position,
+                        move_number=index + 1,
+                        status=GameStatus.FINISHED if finished else GameStatus.IN_PROGRESS,
+                        winner_id=None,
+                        board=game_logic.encode_bitboards(bitboards),
+                        player_results=[(player1_id, 5, False), (player2_id, 4, False)] if finished else [],
+                    )])
+        except OperationalError as error:
+            errors.append(error)
+
+
+def run(engine: Engine) -> tuple[float, int]:
+    SQLModel.metadata.create_all(engine)
+    errors: list[Exception] = []
+    threads = [threading.Thread(target=play_games, args=(engine, errors)) for _ in range(THREAD_COUNT)]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    engine.dispose()
+    return elapsed, len(errors)
+
+
+def main():
+    move_count = THREAD_COUNT * GAMES_PER_THREAD * len(POSITIONS)
+    with tempfile.TemporaryDirectory() as directory:
+        default_url = f"sqlite:///{os.path.join(directory, 'default.db')}"
+        tuned_url = f"sqlite:///{os.path.join(directory, 'tuned.db')}"
+
+        default_time, default_errors = run(create_engine(default_url, connect_args={"check_same_thread": False}))
+        tuned_time, tuned_errors = run(create_sqlite_engine(tuned_url))
+
+    print(f"{THREAD_COUNT} threads, {move_count} moves, one transaction per move")
+    print(f"default: {default_time:.2f}s ({move_count / default_time:,.0f} moves/s, {default_errors} threads failed)")
+    print(f"tuned:   {tuned_time:.2f}s ({move_count / tuned_time:,.0f} moves/s, {tuned_errors} threads failed)")
+
+
+if __name__ == "__main__":
+    main()
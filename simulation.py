@@ -118,14 +118,13 @@ async def main():
     player_ids = []
     print(f"--- Creating {NUM_PLAYERS} players ---")
     async with httpx.AsyncClient() as client:
-        # Create players sequentially to ensure they exist before games start
-        for _ in range(NUM_PLAYERS):
-            try:
-                response = await client.post(f"{BASE_URL}/players")
-                if response.status_code == 201:
-                    player_ids.append(response.json()["id"])
-            except Exception as e:
-                print(f"Could not create player: {e}")
+        # Create every player in one request so they exist before games start
+        try:
+            response = await client.post(f"{BASE_URL}/players/bulk", params={"count": NUM_PLAYERS})
+            if response.status_code == 201:
+                player_ids = response.json()["player_ids"]
+        except Exception as e:
+            print(f"Could not create players: {e}")
     
     if len(player_ids) < 2:
         print("Not enough players created to start games. Exiting.")
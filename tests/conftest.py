@@ -1,14 +1,23 @@
 """
 This file contains the pytest fixtures for the tests.
 """
+import os
 import pytest
+from contextlib import asynccontextmanager
 from typing import Generator
 from fastapi.testclient import TestClient
 from sqlmodel import Session, SQLModel, create_engine
 
+# Persist every move before responding so tests can read the database right away
+os.environ.setdefault("GAME_STORE_WRITE_BEHIND", "false")
 
 from app.main import app
-from app.database import get_session
+from app.database import SyncDatabase, get_database, get_database_factory, get_session
+from app.event_feed import EventFeed, get_event_feed
+from app.game_hub import GameHub, get_game_hub
+from app.game_store import GameStore, get_game_store
+from app.leaderboards import Leaderboards, get_leaderboards
+from app.matchmaking import MatchmakingQueue, get_matchmaking_queue
 from app.models import Player, Game, GamePlayer, Move
 
 # Use an in-memory SQLite database for testing
@@ -49,9 +58,33 @@ def client(session: Session) -> Generator[TestClient, None, None]:
 
     # Override the app's dependency with the test session
     app.dependency_overrides[get_session] = get_session_override
+    # Routers use the sync database path so they see the test session's transaction
+    app.dependency_overrides[get_database] = lambda: SyncDatabase(session)
+    @asynccontextmanager
+    async def open_database_override():
+        yield SyncDatabase(session)
+
+    app.dependency_overrides[get_database_factory] = lambda: open_database_override
+    # A fresh game store per test, the database is rolled back after each test
+    store = GameStore()
+    app.dependency_overrides[get_game_store] = lambda: store
+    # And fresh leaderboards, applying the changes committed by the test session
+    boards = Leaderboards()
+    boards.attach()
+    app.dependency_overrides[get_leaderboards] = lambda: boards
+    # And a fresh matchmaking queue
+    queue = MatchmakingQueue()
+    app.dependency_overrides[get_matchmaking_queue] = lambda: queue
+    # And a fresh hub of game updates
+    hub = GameHub()
+    app.dependency_overrides[get_game_hub] = lambda: hub
+    # And a fresh event feed
+    feed = EventFeed()
+    app.dependency_overrides[get_event_feed] = lambda: feed
     
     with TestClient(app) as test_client:
         yield test_client
     
+    boards.detach()
     # Clean up the dependency override after the test
     app.dependency_overrides.clear()
\ No newline at end of file
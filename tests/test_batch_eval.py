@@ -0,0 +1,136 @@
+"""
+Tests for the NumPy batch game evaluator
+"""
+import random
+
+import numpy as np
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app import batch_eval, game_logic
+from app.models import Game, GameStatus, Player
+from tests import utils
+
+
+def play_random_game(rng: random.Random, board_rows: int, board_cols: int, win_length: int) -> tuple[list[int], int]:
+    """
+    Play random moves until someone wins or the board is full, using the per move game logic.
+    Returns the positions played and the winner order (0 for a draw).
+    """
+    bitboards = game_logic.EMPTY_BITBOARDS
+    positions = list(range(board_rows * board_cols))
+    rng.shuffle(positions)
+    for index, position in enumerate(positions):
+        player_number = index % 2 + 1
+        bitboards = game_logic.apply_move_to_bitboards(bitboards, position, player_number)
+        if game_logic.check_win_from_last_move(bitboards[player_number - 1], position, board_rows, board_cols, win_length):
+            return positions[:index + 1], player_number
+    return positions, 0
+
+
+class TestEvaluateBatch:
+    def test_matches_per_game_logic(self):
+        rng = random.Random(1234)
+        game_rows = []
+        move_rows = []
+        expected = {}
+        board_sizes = [(3, 3, 3), (4, 5, 4), (7, 7, 5)]
+        for game_id in range(1, 301):
+            board_rows, board_cols, win_length = board_sizes[game_id % len(board_sizes)]
+            # Stop some games early to also cover unfinished games
+            positions, winner = play_random_game(rng, board_rows, board_cols, win_length)
+            if game_id % 7 == 0:
+                positions, winner = positions[:2], 0
+            game_rows.append((game_id, board_rows, board_cols, win_length))
+            move_rows.extend((game_id, position, index % 2 + 1) for index, position in enumerate(positions))
+            is_draw = winner == 0 and len(positions) == board_rows * board_cols
+            expected[game_id] = (positions, winner, is_draw)
+
+        batches = batch_eval.build_batches(game_rows, move_rows)
+        assert len(batches) == len(board_sizes)
+
+        checked = 0
+        for batch in batches:
+            result = batch_eval.evaluate_batch(batch)
+            for index, game_id in enumerate(result.game_ids.tolist()):
+                positions, winner, is_draw = expected[game_id]
+                assert result.winner_orders[index] == winner
+                assert result.is_draw[index] == is_draw
+                assert result.move_counts[index].tolist() == [(len(positions) + 1) // 2, len(positions) // 2]
+
+                grid = result.grids[index].reshape(-1).tolist()
+                for move_index, position in enumerate(positions):
+                    assert grid[position] == move_index % 2 + 1
+                assert sum(1 for cell in grid if cell) == len(positions)
+                checked += 1
+
+        assert checked == 300
+
+    def test_classic_grid_matches_list_functions(self):
+        grid = [2, 1, 2, 1, 1, 2, 1, 2, 1]
+        move_rows = [(1, position, cell) for position, cell in enumerate(grid)]
+        result = batch_eval.evaluate_batch(batch_eval.build_batches([(1, 3, 3, 3)], move_rows)[0])
+
+        assert result.grids[0].reshape(-1).tolist() == grid
+        assert bool(result.is_draw[0]) == game_logic.check_draw_condition(grid)
+        assert result.winner_orders[0] == 0
+
+    def test_conflicting_winner(self):
+        move_rows = [(1, position, 1) for position in (0, 1, 2)] + [(1, position, 2) for position in (6, 7, 8)]
+        result = batch_eval.evaluate_batch(batch_eval.build_batches([(1, 3, 3, 3)], move_rows)[0])
+
+        assert result.winner_orders[0] == batch_eval.CONFLICTING_WINNER
+        assert not result.is_draw[0]
+
+    def test_has_line_directions(self):
+        occupied = np.zeros((4, 5, 5), dtype=bool)
+        occupied[0, 2, 1:5] = True  # row
+        occupied[1, 0:4, 3] = True  # column
+        occupied[2, [1, 2, 3, 4], [0, 1, 2, 3]] = True  # diagonal
+        occupied[3, [0, 1, 2], [4, 3, 2]] = True  # anti diagonal, one short
+
+        assert batch_eval.has_line(occupied, 4).tolist() == [True, True, True, False]
+        assert batch_eval.has_line(occupied, 3).tolist() == [True, True, True, True]
+
+
+class TestAuditGames:
+    def test_audit_finds_corrupted_games_and_players(self, client: TestClient, session: Session):
+        player1_id = utils.create_player(client).json()["id"]
+        player2_id = utils.create_player(client).json()["id"]
+        player3_id = utils.create_player(client).json()["id"]
+
+        win_game_id = utils.create_game(client, player1_id).json()["id"]
+        utils.join_game(client, win_game_id, player2_id)
+        utils.play_first_player_win_game(client, win_game_id, player1_id, player2_id)
+
+        draw_game_id = utils.create_game(client, player2_id).json()["id"]
+        utils.join_game(client, draw_game_id, player1_id)
+        utils.play_draw_game(client, draw_game_id, player2_id, player1_id)
+
+        waiting_game_id = utils.create_game(client, player3_id).json()["id"]
+
+        report = batch_eval.audit_games(session, chunk_size=2)
+        assert report.games_checked >= 3
+        assert report.game_mismatches == []
+        assert report.player_mismatches == []
+
+        # Corrupt a game's winner and a player's aggregates
+        win_game = session.get(Game, win_game_id)
+        assert win_game is not None
+        win_game.winner_id = player2_id
+        waiting_game = session.get(Game, waiting_game_id)
+        assert waiting_game is not None
+        waiting_game.status = GameStatus.FINISHED
+        player1 = session.get(Player, player1_id)
+        assert player1 is not None
+        player1.games_won += 1
+        session.commit()
+
+        report = batch_eval.audit_games(session, chunk_size=2)
+        assert [(m.game_id, m.expected_status, m.expected_winner_id) for m in report.game_mismatches] == [
+            (win_game_id, GameStatus.FINISHED, player1_id),
+            (waiting_game_id, GameStatus.WAITING, None),
+        ]
+        assert [(m.player_id, m.stored, m.expected) for m in report.player_mismatches] == [
+            (player1_id, (2, 2, 7), (2, 1, 7)),
+        ]
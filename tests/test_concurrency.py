@@ -0,0 +1,149 @@
+"""
+Tests for the optimistic concurrency control of joins and moves, see Game.version
+"""
+import asyncio
+import itertools
+from typing import Generator
+
+import httpx
+import pytest
+from sqlalchemy import Engine
+from sqlmodel import Session, SQLModel, select
+
+from app import crud
+from app.database import SyncDatabase, create_sqlite_engine, get_database
+from app.game_store import GameStore, MoveEvent, get_game_store
+from app.main import app
+from app.models import Game, GameStatus, Move
+
+
+def move_event(game: Game, player_id: int, position: int, version: int) -> MoveEvent:
+    assert game.id is not None
+    return MoveEvent(
+        game_id=game.id, player_id=player_id, position=position, move_number=game.current_turn_number,
+        status=GameStatus.IN_PROGRESS, winner_id=None, board=game.board, version=version,
+    )
+
+
+class TestGameVersion:
+    def test_join_on_a_stale_version_conflicts(self, session: Session):
+        player1_id, player2_id, player3_id = (crud.create_player(session).id for _ in range(3))
+        game = crud.create_game(session, player1_id)  # type: ignore[arg-type]
+        assert game.id is not None and game.version == 0
+
+        assert crud.join_game(session, game.id, player2_id, expected_version=0).version == 1  # type: ignore[arg-type]
+        with pytest.raises(crud.GameVersionConflict):
+            crud.join_game(session, game.id, player3_id, expected_version=0)  # type: ignore[arg-type]
+        assert [gp.player_id for gp in crud.get_game(session, game.id).game_players] == [player1_id, player2_id]  # type: ignore[union-attr]
+
+    def test_move_on_a_stale_version_conflicts(self, session: Session):
+        player1_id, player2_id = (crud.create_player(session).id for _ in range(2))
+        game = crud.join_game(session, crud.create_game(session, player1_id).id, player2_id)  # type: ignore[arg-type]
+
+        crud.apply_move_events(session, [move_event(game, player1_id, 0, version=2)])  # type: ignore[arg-type]
+        # A second move written on the version before the first one
+        with pytest.raises(crud.GameVersionConflict):
+            crud.apply_move_events(session, [move_event(game, player1_id, 1, version=2)])  # type: ignore[arg-type]
+        assert [move.position for move in crud.get_moves_for_game(session, game.id)] == [0]  # type: ignore[arg-type]
+
+    def test_store_behind_another_process_conflicts_and_reloads(self, session: Session):
+        player1_id, player2_id = (crud.create_player(session).id for _ in range(2))
+        game = crud.join_game(session, crud.create_game(session, player1_id).id, player2_id)  # type: ignore[arg-type]
+        assert game.id is not None
+
+        # Two worker processes serving the same game
+        worker1, worker2 = GameStore(), GameStore()
+        state1, state2 = worker1.get(session, game.id), worker2.get(session, game.id)
+        assert state1 is not None and state2 is not None
+
+        worker1.record_move(session, state1, move_event(game, player1_id, 0, version=0))  # type: ignore[arg-type]
+        with pytest.raises(crud.GameVersionConflict):
+            worker2.record_move(session, state2, move_event(game, player1_id, 4, version=0))  # type: ignore[arg-type]
+
+        reloaded = worker2.get(session, game.id)
+        assert reloaded is not None and reloaded is not state2
+        assert reloaded.version == 2
+        assert reloaded.current_turn_player_id == player2_id
+
+
+@pytest.fixture(scope="function")
+def workers(tmp_path) -> Generator[Engine, None, None]:
+    """
+    A file database shared by two game stores, like two worker processes.
+    Requests alternate between the stores and each one gets its own session.
+    """
+    engine = create_sqlite_engine(f"sqlite:///{tmp_path / 'concurrency.db'}")
+    SQLModel.metadata.create_all(engine)
+    stores = [GameStore(), GameStore()]
+    requests = itertools.count()
+
+    def get_database_override() -> Generator[SyncDatabase, None, None]:
+        with Session(engine) as session:
+            yield SyncDatabase(session)
+
+    app.dependency_overrides[get_database] = get_database_override
+    app.dependency_overrides[get_game_store] = lambda: stores[next(requests) % len(stores)]
+    yield engine
+    app.dependency_overrides.clear()
+    engine.dispose()
+
+
+async def post_concurrently(requests: list[tuple[str, dict]]) -> list[int]:
+    """POST every (url, body) at once, returns the status codes"""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        responses = await asyncio.gather(*(client.post(url, json=body) for url, body in requests))
+    return [response.status_code for response in responses]
+
+
+class TestConcurrencyStress:
+    def test_parallel_joins_and_moves_on_one_game(self, workers: Engine):
+        with Session(workers) as session:
+            player_ids: list[int] = [crud.create_player(session).id for _ in range(10)]  # type: ignore[misc]
+            game_id = crud.create_game(session, player_ids[0]).id
+            assert game_id is not None
+
+        # Every other player tries to join at once, exactly one gets in
+        status_codes = asyncio.run(post_concurrently([
+            (f"/games/{game_id}/join", {"player_id": player_id}) for player_id in player_ids[1:]
+        ]))
+        assert status_codes.count(200) == 1
+        assert set(status_codes) == {200, 409}
+
+        with Session(workers) as session:
+            game = crud.get_game(session, game_id)
+            assert game is not None and len(game.game_players) == 2
+            players_by_order = {gp.player_order: gp.player_id for gp in game.game_players}
+
+        # Each turn, the player to move tries every free position at once
+        for _ in range(9):
+            with Session(workers) as session:
+                game = session.get(Game, game_id)
+                assert game is not None
+                if game.status == GameStatus.FINISHED:
+                    break
+                taken = {move.position for move in crud.get_moves_for_game(session, game_id)}
+                player_id = players_by_order[1 if game.current_turn_number % 2 == 1 else 2]
+
+            for _attempt in range(5):
+                status_codes = asyncio.run(post_concurrently([
+                    (f"/games/{game_id}/move", {"player_id": player_id, "position": position})
+                    for position in range(9) if position not in taken
+                ]))
+                # A rejected move is a conflict, a retry reads the current game
+                assert status_codes.count(200) <= 1
+                assert set(status_codes) <= {200, 409}
+                if 200 in status_codes:
+                    break
+            else:
+                pytest.fail("No move was accepted")
+
+        with Session(workers) as session:
+            game = session.get(Game, game_id)
+            moves = session.exec(select(Move).where(Move.game_id == game_id).order_by(Move.move_number)).all()
+            assert game is not None and game.status == GameStatus.FINISHED
+            assert [move.move_number for move in moves] == list(range(1, len(moves) + 1))
+            assert len({move.position for move in moves}) == len(moves)
+            # One version per join and move
+            assert game.version == 1 + len(moves)
+            assert game.current_turn_number == len(moves) + 1
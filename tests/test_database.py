@@ -0,0 +1,205 @@
+"""
+Tests for the SQLite engine profile and the async database path of the routers
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Generator
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool, QueuePool
+from sqlmodel import Session, SQLModel, create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.config import Settings
+from app.database import AsyncDatabase, create_sqlite_engine, get_database, get_database_factory, sqlite_pragmas
+from app.game_store import GameStore, get_game_store
+from app.main import app
+from app.models import Game, GameStatus, Move, Player
+from tests import utils
+
+
+@pytest.fixture(scope="function")
+def database_path(client: TestClient, tmp_path) -> Generator[str, None, None]:
+    """A file database served to the client through AsyncSession and aiosqlite"""
+    path = tmp_path / "async.db"
+    SQLModel.metadata.create_all(create_engine(f"sqlite:///{path}"))
+    # aiosqlite connections are bound to the event loop that opened them, so don't pool them across tests
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}", poolclass=NullPool)
+
+    async def get_async_database() -> AsyncGenerator[AsyncDatabase, None]:
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            yield AsyncDatabase(session)
+
+    app.dependency_overrides[get_database] = get_async_database
+    app.dependency_overrides[get_database_factory] = lambda: asynccontextmanager(get_async_database)
+    yield str(path)
+
+
+@pytest.fixture(scope="function")
+def async_write_behind_store(database_path: str, tmp_path) -> Generator[GameStore, None, None]:
+    """The default game store, write behind with an fsynced journal, on the async database"""
+    # Only the tests flush, the background thread would empty the queue under them
+    store = GameStore(write_behind=True, flush_interval=3600, journal_path=str(tmp_path / "game_store.journal"))
+    sync_engine = create_engine(f"sqlite:///{database_path}", connect_args={"check_same_thread": False})
+    store.start(lambda: Session(sync_engine))
+    app.dependency_overrides[get_game_store] = lambda: store
+    yield store
+    store.stop()
+
+
+def is_on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class TestAsyncDatabase:
+    def test_game_is_played_through_async_session(self, client: TestClient, database_path: str):
+        player1_id = utils.create_player(client).json()["id"]
+        player2_id = utils.create_player(client).json()["id"]
+        game_id = utils.create_game(client, player1_id).json()["id"]
+
+        available_games = utils.get_available_games(client).json()
+        assert [game["id"] for game in available_games] == [game_id]
+        assert available_games[0]["player1_id"] == player1_id
+
+        assert utils.join_game(client, game_id, player2_id).status_code == 200
+        for move_response in utils.play_first_player_win_game(client, game_id, player1_id, player2_id):
+            assert move_response.status_code == 200
+
+        assert utils.get_player(client, player1_id).json()["games_won"] == 1
+
+        with Session(create_engine(f"sqlite:///{database_path}")) as session:
+            game = session.get(Game, game_id)
+            assert game is not None
+            assert game.status == GameStatus.FINISHED
+            assert game.winner_id == player1_id
+            assert len(session.exec(select(Move).where(Move.game_id == game_id)).all()) == 5
+            player1 = session.get(Player, player1_id)
+            assert player1 is not None
+            assert (player1.games_played, player1.games_won, player1.total_moves) == (1, 1, 3)
+
+    def test_unfinished_game_check_through_async_session(self, client: TestClient, database_path: str):
+        player_id = utils.create_player(client).json()["id"]
+        game_id = utils.create_game(client, player_id).json()["id"]
+
+        response = utils.create_game(client, player_id)
+        assert response.status_code == 409
+        assert f"(ID: {game_id})" in response.json()["detail"]
+
+
+class TestAsyncWriteBehind:
+    """The production defaults: AsyncSession requests and a write behind game store"""
+
+    def test_game_is_played_with_write_behind(
+            self, client: TestClient, database_path: str, async_write_behind_store: GameStore, monkeypatch
+        ):
+        fsyncs_on_loop = []
+        fsync = os.fsync
+
+        def recording_fsync(fd: int) -> None:
+            fsyncs_on_loop.append(is_on_event_loop())
+            fsync(fd)
+
+        monkeypatch.setattr(os, "fsync", recording_fsync)
+        flushes_on_loop = []
+        flush = async_write_behind_store.flush
+
+        def recording_flush(session: Session) -> int:
+            flushes_on_loop.append(is_on_event_loop())
+            return flush(session)
+
+        monkeypatch.setattr(async_write_behind_store, "flush", recording_flush)
+        sync_engine = create_engine(f"sqlite:///{database_path}")
+
+        player1_id = utils.create_player(client).json()["id"]
+        player2_id = utils.create_player(client).json()["id"]
+        game_id = utils.create_game(client, player1_id).json()["id"]
+        assert utils.join_game(client, game_id, player2_id).status_code == 200
+        move_responses = utils.play_moves_sequence(client, game_id, [(player1_id, 0), (player2_id, 6), (player1_id, 1)])
+        for move_response in move_responses:
+            assert move_response.status_code == 200
+
+        # The moves are journaled and served from the store, not persisted yet
+        assert async_write_behind_store.pending_count == 3
+        assert fsyncs_on_loop == [False] * 3
+        assert async_write_behind_store.journal_path is not None
+        with open(async_write_behind_store.journal_path) as journal:
+            assert len(journal.readlines()) == 3
+        get_data = utils.get_game(client, game_id).json()
+        assert (get_data["current_turn_number"], get_data["grid"][0]) == (4, [1, 1, 0])
+        with Session(sync_engine) as session:
+            assert session.exec(select(Move).where(Move.game_id == game_id)).all() == []
+
+        # The winning move flushes the queued moves and is persisted before responding
+        assert utils.make_move(client, game_id, player2_id, 7).status_code == 200
+        assert utils.make_move(client, game_id, player1_id, 2).status_code == 200
+        assert async_write_behind_store.pending_count == 0
+        assert flushes_on_loop == [False]
+        # So are the fourth move's append and the journal rewrite after the flush
+        assert len(fsyncs_on_loop) > 3 and not any(fsyncs_on_loop)
+        with open(async_write_behind_store.journal_path) as journal:
+            assert journal.read() == ""
+        with Session(sync_engine) as session:
+            game = session.get(Game, game_id)
+            assert game is not None
+            assert (game.status, game.winner_id) == (GameStatus.FINISHED, player1_id)
+            assert len(session.exec(select(Move).where(Move.game_id == game_id)).all()) == 5
+
+        # The finished game is read from the database, and no longer blocks its players
+        get_data = utils.get_game(client, game_id).json()
+        assert (get_data["status"], get_data["winner_id"]) == ("finished", player1_id)
+        assert utils.get_player(client, player1_id).json()["games_won"] == 1
+        assert utils.create_game(client, player1_id).status_code == 201
+        assert utils.create_game(client, player2_id).status_code == 201
+
+    def test_long_poll_with_write_behind(self, client: TestClient, async_write_behind_store: GameStore):
+        player1_id = utils.create_player(client).json()["id"]
+        player2_id = utils.create_player(client).json()["id"]
+        game_id = utils.create_game(client, player1_id).json()["id"]
+        assert utils.join_game(client, game_id, player2_id).status_code == 200
+        assert utils.make_move(client, game_id, player1_id, 4).status_code == 200
+
+        # It is already player 2's turn, a queued move is enough
+        response = client.get(f"/games/{game_id}", params={"wait_for_turn": player2_id, "timeout": 1})
+        assert response.status_code == 200
+        assert response.json()["current_turn_number"] == 2
+        assert async_write_behind_store.pending_count == 1
+
+
+class TestSqliteProfile:
+    def test_pragmas_are_applied_to_every_connection(self, tmp_path):
+        engine = create_sqlite_engine(f"sqlite:///{tmp_path / 'profile.db'}")
+        with engine.connect() as first, engine.connect() as second:
+            for connection in (first, second):
+                assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+                # 1 is NORMAL
+                assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+                assert connection.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+                assert connection.exec_driver_sql("PRAGMA cache_size").scalar() == -64 * 1024
+        engine.dispose()
+
+    def test_profile_is_read_from_settings(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("SQLITE_SYNCHRONOUS", "full")
+        monkeypatch.setenv("SQLITE_BUSY_TIMEOUT", "250")
+        monkeypatch.setenv("DATABASE_POOL_SIZE", "2")
+        monkeypatch.setenv("DATABASE_POOL_MAX_OVERFLOW", "0")
+        config = Settings()
+
+        engine = create_sqlite_engine(f"sqlite:///{tmp_path / 'profile.db'}", config)
+        with engine.connect() as connection:
+            assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 2
+            assert connection.exec_driver_sql("PRAGMA busy_timeout").scalar() == 250
+        assert isinstance(engine.pool, QueuePool)
+        assert engine.pool.size() == 2
+        engine.dispose()
+
+    def test_unsupported_journal_mode(self, monkeypatch):
+        monkeypatch.setenv("SQLITE_JOURNAL_MODE", "WAL; DROP TABLE player")
+        with pytest.raises(ValueError):
+            sqlite_pragmas(Settings())
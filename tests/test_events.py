@@ -0,0 +1,102 @@
+"""
+Tests for the event feed and the GET /events stream
+"""
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from app.event_feed import EventFeed, EventType, get_event_feed
+from app.main import app
+from app.router.events import KEEPALIVE_COMMENT, RESET_EVENT, stream_events
+from tests import utils
+
+
+def event_types(feed: EventFeed) -> list[str]:
+    events, _ = feed.events_after(0)
+    return [event.type for event in events]
+
+
+async def read_stream(feed: EventFeed, last_id: int, count: int, keepalive_interval: float = 5) -> list[str]:
+    messages = []
+    stream = stream_events(feed, last_id, keepalive_interval)
+    async for message in stream:
+        messages.append(message)
+        if len(messages) == count:
+            break
+    await stream.aclose()
+    return messages
+
+
+class TestEventsPublished:
+    def test_game_events(self, client: TestClient):
+        """Test a game played through the API publishes its events in order"""
+        feed = app.dependency_overrides[get_event_feed]()
+        player1_id = utils.create_player(client).json()["id"]
+        player2_id = utils.create_player(client).json()["id"]
+        game_id = utils.create_game(client, player1_id).json()["id"]
+        utils.join_game(client, game_id, player2_id)
+        move_responses = utils.play_first_player_win_game(client, game_id, player1_id, player2_id)
+
+        assert event_types(feed) == [
+            EventType.GAME_CREATED, EventType.GAME_JOINED, EventType.GAME_FINISHED, EventType.LEADERBOARD_CHANGED,
+        ]
+        events, _ = feed.events_after(0)
+        assert [event.id for event in events] == [1, 2, 3, 4]
+        # The game as returned by the last move, without its message
+        assert events[2].data == {key: value for key, value in move_responses[-1].json().items() if key != "message"}
+        assert events[3].data == {"game_id": game_id, "player_ids": [player1_id, player2_id]}
+
+    def test_matchmaking_events(self, client: TestClient):
+        feed = app.dependency_overrides[get_event_feed]()
+        player1_id = utils.create_player(client).json()["id"]
+        player2_id = utils.create_player(client).json()["id"]
+        utils.find_match(client, player1_id)
+        utils.find_match(client, player2_id)
+
+        assert event_types(feed) == [EventType.GAME_CREATED, EventType.GAME_JOINED]
+
+    def test_invalid_last_event_id(self, client: TestClient):
+        assert client.get("/events", headers={"Last-Event-ID": "abc"}).status_code == 422
+
+
+class TestEventFeed:
+    def test_resume_after_last_event_id(self):
+        feed = EventFeed(size=3)
+        for game_id in range(1, 5):
+            feed.publish(EventType.GAME_CREATED, {"id": game_id})
+
+        events, lost = feed.events_after(2)
+        assert [event.id for event in events] == [3, 4]
+        assert not lost
+        assert feed.events_after(4) == ([], False)
+
+        # Event 1 was dropped from the buffer
+        events, lost = feed.events_after(0)
+        assert [event.id for event in events] == [2, 3, 4]
+        assert lost
+        # An id of a previous process
+        assert feed.events_after(10)[1]
+
+    def test_stream_resumes_and_waits_for_new_events(self):
+        feed = EventFeed()
+        feed.publish(EventType.GAME_CREATED, {"id": 1})
+        feed.publish(EventType.GAME_JOINED, {"id": 1})
+
+        async def run() -> list[str]:
+            reader = asyncio.create_task(read_stream(feed, 1, 2))
+            await asyncio.sleep(0.01)
+            feed.publish(EventType.GAME_FINISHED, {"id": 1})
+            return await reader
+
+        assert asyncio.run(run()) == [
+            'id: 2\nevent: game-joined\ndata: {"id":1}\n\n',
+            'id: 3\nevent: game-finished\ndata: {"id":1}\n\n',
+        ]
+
+    def test_stream_of_lost_events_starts_with_reset(self):
+        feed = EventFeed(size=1)
+        feed.publish(EventType.GAME_CREATED, {"id": 1})
+        feed.publish(EventType.GAME_CREATED, {"id": 2})
+
+        messages = asyncio.run(read_stream(feed, 0, 3, keepalive_interval=0.01))
+        assert messages == [RESET_EVENT, 'id: 2\nevent: game-created\ndata: {"id":2}\n\n', KEEPALIVE_COMMENT]
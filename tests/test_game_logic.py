@@ -2,7 +2,10 @@ from datetime import datetime, timezone
 
 from app.game_logic import (
     calculate_grid_from_moves, check_win_condition, check_draw_condition, validate_move,
-    validate_player_can_join_new_game, validate_game_status_for_join, validate_game_status_for_move
+    validate_player_can_join_new_game, validate_game_status_for_join, validate_game_status_for_move,
+    apply_move_to_bitboards, get_turn_number_from_bitboards, grid_from_bitboards,
+    validate_move_bitboards, encode_bitboards, decode_bitboards, check_win_from_last_move,
+    check_board_full, validate_complete_game, WIN_PATTERNS, EMPTY_BITBOARDS
 )
 from app.models import Move, GamePlayer, Game, GameStatus
 
@@ -305,4 +308,133 @@ class TestGameLogic:
         is_valid, status_code, message = validate_game_status_for_move(in_progress_game_valid, player_id=1)
         assert is_valid
         assert status_code == 200
-        assert message == "Valid game status"
\ No newline at end of file
+        assert message == "Valid game status"
+
+
+def grid_to_bitboards(grid: list[int]) -> tuple[int, int]:
+    """Convert a flat list grid into (player1, player2) bitboards"""
+    player1_board = sum(1 << pos for pos, cell in enumerate(grid) if cell == 1)
+    player2_board = sum(1 << pos for pos, cell in enumerate(grid) if cell == 2)
+    return player1_board, player2_board
+
+
+class TestBitboardGameLogic:
+    def test_apply_move_and_turn_number(self):
+        bitboards = EMPTY_BITBOARDS
+        assert get_turn_number_from_bitboards(bitboards) == 1
+
+        bitboards = apply_move_to_bitboards(bitboards, 4, 1)
+        assert bitboards == (1 << 4, 0)
+        assert get_turn_number_from_bitboards(bitboards) == 2
+
+        bitboards = apply_move_to_bitboards(bitboards, 0, 2)
+        assert bitboards == (1 << 4, 1 << 0)
+        assert get_turn_number_from_bitboards(bitboards) == 3
+
+    def test_grid_from_bitboards(self):
+        assert grid_from_bitboards(EMPTY_BITBOARDS) == [[0, 0, 0], [0, 0, 0], [0, 0, 0]]
+        assert grid_from_bitboards(grid_to_bitboards([1, 0, 0, 0, 2, 0, 0, 0, 1])) == [[1, 0, 0], [0, 2, 0], [0, 0, 1]]
+
+    def test_validate_move_bitboards(self):
+        for position in range(9):
+            assert validate_move_bitboards(EMPTY_BITBOARDS, position) == (True, 200, "Valid move")
+
+        occupied = grid_to_bitboards([1,2,0,1,0,2,0,1,2])
+        for position in (0, 1, 3, 5, 7, 8):
+            assert validate_move_bitboards(occupied, position) == (False, 409, "Position already occupied")
+        for position in (2, 4, 6):
+            assert validate_move_bitboards(occupied, position) == (True, 200, "Valid move")
+
+    def test_encode_decode_bitboards(self):
+        assert decode_bitboards(b"") == EMPTY_BITBOARDS
+        assert decode_bitboards(None) == EMPTY_BITBOARDS
+        assert decode_bitboards(encode_bitboards(EMPTY_BITBOARDS)) == EMPTY_BITBOARDS
+
+        bitboards = grid_to_bitboards([2,1,2,1,1,2,1,2,1])
+        encoded = encode_bitboards(bitboards)
+        assert len(encoded) == 4
+        assert decode_bitboards(encoded) == bitboards
+
+
+def bitboard_from_cells(cells: list[tuple[int, int]], board_cols: int) -> int:
+    """Build a bitboard from (row, col) cells"""
+    return sum(1 << (row * board_cols + col) for row, col in cells)
+
+
+class TestBoardSizeGameLogic:
+    def test_check_win_from_last_move_matches_3x3_patterns(self):
+        # For every 3x3 board and every occupied position as the last move, the last move
+        # check must agree with the full pattern scan whenever that move is part of the win
+        win_masks = [sum(1 << pos for pos in pattern) for pattern in WIN_PATTERNS]
+        for board in range(1 << 9):
+            for position in range(9):
+                if not board >> position & 1:
+                    continue
+                expected = any(board & mask == mask and mask >> position & 1 for mask in win_masks)
+                assert check_win_from_last_move(board, position, 3, 3, 3) == expected
+
+    def test_check_win_from_last_move_gomoku(self):
+        # Horizontal five on a 15x15 board, last move in the middle of the line
+        board = bitboard_from_cells([(7, 3), (7, 4), (7, 5), (7, 6), (7, 7)], 15)
+        assert check_win_from_last_move(board, 7 * 15 + 5, 15, 15, 5)
+
+        # Four in a row is not enough
+        board = bitboard_from_cells([(7, 3), (7, 4), (7, 5), (7, 6)], 15)
+        assert not check_win_from_last_move(board, 7 * 15 + 6, 15, 15, 5)
+
+        # Vertical, diagonal and anti diagonal lines
+        board = bitboard_from_cells([(r, 0) for r in range(10, 15)], 15)
+        assert check_win_from_last_move(board, 14 * 15, 15, 15, 5)
+        board = bitboard_from_cells([(i, i) for i in range(5)], 15)
+        assert check_win_from_last_move(board, 0, 15, 15, 5)
+        board = bitboard_from_cells([(i, 14 - i) for i in range(5)], 15)
+        assert check_win_from_last_move(board, 2 * 15 + 12, 15, 15, 5)
+
+        # A row must not wrap around into the next row
+        board = bitboard_from_cells([(0, 12), (0, 13), (0, 14), (1, 0), (1, 1)], 15)
+        assert not check_win_from_last_move(board, 14, 15, 15, 5)
+
+    def test_check_win_from_last_move_rectangular_board(self):
+        # 4 rows x 6 columns, four in a row
+        board = bitboard_from_cells([(0, 2), (1, 3), (2, 4), (3, 5)], 6)
+        assert check_win_from_last_move(board, 3 * 6 + 5, 4, 6, 4)
+        board = bitboard_from_cells([(0, 5), (1, 5), (2, 5)], 6)
+        assert not check_win_from_last_move(board, 2 * 6 + 5, 4, 6, 4)
+
+    def test_check_board_full(self):
+        assert not check_board_full(EMPTY_BITBOARDS, 3, 3)
+        assert check_board_full(grid_to_bitboards([2,1,2,1,1,2,1,2,1]), 3, 3)
+        assert not check_board_full(grid_to_bitboards([2,1,2,1,1,2,1,2,1]), 4, 4)
+        assert check_board_full(((1 << 16) - 1, 0), 4, 4)
+
+    def test_grid_and_validate_move_on_rectangular_board(self):
+        bitboards = (1 << 0, 1 << 7)
+        assert grid_from_bitboards(bitboards, 2, 4) == [[1, 0, 0, 0], [0, 0, 0, 2]]
+
+        assert validate_move_bitboards(bitboards, 6, 2, 4) == (True, 200, "Valid move")
+        assert validate_move_bitboards(bitboards, 7, 2, 4) == (False, 409, "Position already occupied")
+        assert validate_move_bitboards(bitboards, 8, 2, 4) == (False, 422, "Position must be between 0 and 7 on a 2x4 board")
+
+    def test_encode_decode_large_board(self):
+        bitboards = (1 << 224, (1 << 100) | 1)
+        assert decode_bitboards(encode_bitboards(bitboards)) == bitboards
+
+
+class TestValidateCompleteGame:
+    def test_win_and_draw(self):
+        is_valid, status_code, _, bitboards, winner_order = validate_complete_game([0, 6, 1, 7, 2])
+        assert (is_valid, status_code, winner_order) == (True, 200, 1)
+        assert bitboards == (0b111, (1 << 6) | (1 << 7))
+
+        is_valid, _, _, _, winner_order = validate_complete_game([1, 0, 3, 2, 4, 5, 6, 7, 8])
+        assert (is_valid, winner_order) == (True, 0)
+
+        # Player 2 wins a 4 in a row on 6x7
+        is_valid, _, _, _, winner_order = validate_complete_game([0, 7, 1, 8, 35, 9, 36, 10], 6, 7, 4)
+        assert (is_valid, winner_order) == (True, 2)
+
+    def test_invalid_games(self):
+        assert validate_complete_game([0, 6, 1])[:3] == (False, 422, "Game is not finished")
+        assert validate_complete_game([0, 6, 1, 7, 2, 8])[:3] == (False, 422, "Move 6 is played after the game was won")
+        assert validate_complete_game([0, 0])[:3] == (False, 409, "Move 2: Position already occupied")
+        assert validate_complete_game([9])[:3] == (False, 422, "Move 1: Position must be between 0 and 8 on a 3x3 board")
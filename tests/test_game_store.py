@@ -0,0 +1,561 @@
+"""
+Tests for the in memory game store, its write behind persistence and its game leases
+"""
+import threading
+import time
+from typing import Generator
+
+import anyio
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from app import crud, game_logic
+from app.game_store import GameStore, MoveEvent, get_game_store
+from app.main import app
+from app.models import Game, GameLease, GameStatus, Move, Player
+from tests import utils
+
+
+@pytest.fixture(scope="function")
+def write_behind_store(client: TestClient, tmp_path) -> Generator[GameStore, None, None]:
+    """A write behind game store with a journal, used by the client instead of the default store"""
+    store = GameStore(write_behind=True, journal_path=str(tmp_path / "game_store.journal"), journal_fsync=False)
+    app.dependency_overrides[get_game_store] = lambda: store
+    yield store
+    store.stop()
+
+
+def count_moves(session: Session, game_id: int) -> int:
+    return len(crud.get_moves_for_game(session, game_id))
+
+
+def start_game(client: TestClient) -> tuple[int, int, int]:
+    player1_id = utils.create_player(client).json()["id"]
+    player2_id = utils.create_player(client).json()["id"]
+    game_id = utils.create_game(client, player1_id).json()["id"]
+    assert utils.join_game(client, game_id, player2_id).status_code == 200
+    return game_id, player1_id, player2_id
+
+
+def play_until_win(client: TestClient, game_id: int, player1_id: int, player2_id: int) -> None:
+    """Plays the moves of utils.play_first_player_win_game but the winning one, player 1 at 2"""
+    moves = [(player1_id, 0), (player2_id, 6), (player1_id, 1), (player2_id, 7)]
+    for move_response in utils.play_moves_sequence(client, game_id, moves):
+        assert move_response.status_code == 200
+
+
+class TestWriteThrough:
+    def test_moves_are_persisted_before_response(self, client: TestClient, session: Session):
+        game_id, player1_id, player2_id = start_game(client)
+
+        assert utils.make_move(client, game_id, player1_id, 4).status_code == 200
+        assert count_moves(session, game_id) == 1
+
+        game = session.get(Game, game_id)
+        assert game is not None
+        assert game.current_turn_number == 2
+
+    def test_move_is_one_transaction(self, client: TestClient, session: Session):
+        game_id, player1_id, player2_id = start_game(client)
+        commits = []
+
+        def count_commit(session: Session) -> None:
+            commits.append(session)
+
+        event.listen(session, "after_commit", count_commit)
+        try:
+            with utils.count_statements(session) as statements:
+                assert utils.make_move(client, game_id, player1_id, 0).status_code == 200
+            # The game's UPDATE and the Move INSERT
+            assert len(statements) == 2
+            assert len(commits) == 1
+
+            for player_id, position in [(player2_id, 6), (player1_id, 1), (player2_id, 7)]:
+                assert utils.make_move(client, game_id, player_id, position).status_code == 200
+            commits.clear()
+            with utils.count_statements(session) as statements:
+                assert utils.make_move(client, game_id, player1_id, 2).status_code == 200
+            # The winning move also updates both players with one statement, without reading them
+            assert len(commits) == 1
+            assert not [statement for statement in statements if statement.lstrip().startswith("SELECT")]
+            assert len([statement for statement in statements if statement.lstrip().startswith("UPDATE player")]) == 1
+        finally:
+            event.remove(session, "after_commit", count_commit)
+
+        player1 = session.get(Player, player1_id)
+        assert player1 is not None
+        assert (player1.games_played, player1.games_won, player1.total_moves) == (1, 1, 3)
+
+    def test_game_is_read_from_store(self, client: TestClient, session: Session):
+        game_id, player1_id, _ = start_game(client)
+        assert utils.make_move(client, game_id, player1_id, 4).status_code == 200
+
+        # A change made behind the store's back is not seen while the game is cached
+        game = session.get(Game, game_id)
+        assert game is not None
+        game.current_turn_number = 99
+        session.commit()
+
+        assert utils.get_game(client, game_id).json()["current_turn_number"] == 2
+
+    def test_state_shows_moves_once_persisted(self, client: TestClient, session: Session, monkeypatch):
+        game_id, player1_id, _ = start_game(client)
+        state = app.dependency_overrides[get_game_store]().get(session, game_id)
+        assert state is not None
+        board = state.board
+        # What a GET, which doesn't take the game's lock, would return during the write
+        seen_turns = []
+
+        def conflicting_apply_move_events(*args, **kwargs):
+            seen_turns.append(state.current_turn_number)
+            raise crud.GameVersionConflict(game_id)
+
+        monkeypatch.setattr(crud, "apply_move_events", conflicting_apply_move_events)
+        assert utils.make_move(client, game_id, player1_id, 4).status_code == 409
+        assert seen_turns == [1]
+        assert (state.current_turn_number, state.board) == (1, board)
+
+
+class TestWriteBehind:
+    def test_moves_are_queued_until_flush(self, client: TestClient, session: Session, write_behind_store: GameStore):
+        game_id, player1_id, player2_id = start_game(client)
+
+        move_responses = utils.play_moves_sequence(client, game_id, [(player1_id, 0), (player2_id, 4), (player1_id, 8)])
+        for move_response in move_responses:
+            assert move_response.status_code == 200
+
+        # Responses and reads are served from memory, nothing is in the database yet
+        assert write_behind_store.pending_count == 3
+        assert count_moves(session, game_id) == 0
+        get_data = utils.get_game(client, game_id).json()
+        assert get_data["grid"] == [[1, 0, 0], [0, 2, 0], [0, 0, 1]]
+        assert get_data["current_turn_player_id"] == player2_id
+
+        assert write_behind_store.flush(session) == 3
+        assert write_behind_store.pending_count == 0
+        assert count_moves(session, game_id) == 3
+        game = session.get(Game, game_id)
+        assert game is not None
+        session.refresh(game)
+        assert game.current_turn_number == 4
+
+    def test_finished_game_is_persisted_and_evicted(self, client: TestClient, session: Session, write_behind_store: GameStore):
+        game_id, player1_id, player2_id = start_game(client)
+        play_until_win(client, game_id, player1_id, player2_id)
+        assert write_behind_store.pending_count == 4
+        assert count_moves(session, game_id) == 0
+
+        # The winning move is persisted before responding, after the moves queued before it
+        assert utils.make_move(client, game_id, player1_id, 2).status_code == 200
+        assert write_behind_store.pending_count == 0
+        assert count_moves(session, game_id) == 5
+        assert len(write_behind_store) == 0
+
+        game = session.get(Game, game_id)
+        assert game is not None
+        session.refresh(game)
+        assert game.status == GameStatus.FINISHED
+        assert game.winner_id == player1_id
+
+        player1 = session.get(Player, player1_id)
+        assert player1 is not None
+        session.refresh(player1)
+        assert (player1.games_played, player1.games_won, player1.total_moves) == (1, 1, 3)
+        assert utils.get_game(client, game_id).json()["status"] == "finished"
+
+    def test_finished_game_is_seen_by_other_processes(self, client: TestClient, session: Session, tmp_path):
+        # The gateway sends POST /games to the lobby worker, not to the game's owner
+        owner = GameStore(write_behind=True, journal_path=str(tmp_path / "owner.journal"), journal_fsync=False)
+        lobby = GameStore(write_behind=True, journal_path=str(tmp_path / "lobby.journal"), journal_fsync=False)
+        use_store(lobby)
+        game_id, player1_id, player2_id = start_game(client)
+
+        use_store(owner)
+        for move_response in utils.play_first_player_win_game(client, game_id, player1_id, player2_id):
+            assert move_response.status_code == 200
+
+        use_store(lobby)
+        assert utils.create_game(client, player1_id).status_code == 201
+
+    def test_state_shows_moves_once_journaled(self, client: TestClient, session: Session, write_behind_store: GameStore, monkeypatch):
+        game_id, player1_id, _ = start_game(client)
+        state = write_behind_store.get(session, game_id)
+        assert state is not None
+        seen_turns = []
+
+        def failing_append_to_journal(event: MoveEvent) -> None:
+            seen_turns.append(state.current_turn_number)
+            raise OSError("No space left on device")
+
+        monkeypatch.setattr(write_behind_store, "_append_to_journal", failing_append_to_journal)
+        with pytest.raises(OSError):
+            utils.make_move(client, game_id, player1_id, 4)
+        assert seen_turns == [1]
+        assert state.current_turn_number == 1
+        assert write_behind_store.pending_count == 0
+
+    def test_flush_updates_players_in_bulk(self, client: TestClient, session: Session, write_behind_store: GameStore):
+        games = [start_game(client) for _ in range(3)]
+        for game_id, player1_id, player2_id in games:
+            play_until_win(client, game_id, player1_id, player2_id)
+        # Winning moves are persisted right away, queue them like concurrent requests would
+        for game_id, player1_id, player2_id in games:
+            state = write_behind_store.get(session, game_id)
+            assert state is not None
+            write_behind_store._queue_move(state, MoveEvent(
+                game_id=game_id, player_id=player1_id, position=2, move_number=5,
+                status=GameStatus.FINISHED, winner_id=player1_id,
+                board=game_logic.encode_bitboards(game_logic.apply_move_to_bitboards(game_logic.decode_bitboards(state.board), 2, 1)),
+                player_results=[(player1_id, 3, True), (player2_id, 2, False)],
+            ))
+        assert write_behind_store.pending_count == 15
+
+        with utils.count_statements(session) as statements:
+            assert write_behind_store.flush(session) == 15
+        # Nothing is read, and the players of the 3 finished games are updated by one statement
+        assert not [statement for statement in statements if statement.lstrip().startswith("SELECT")]
+        assert len([statement for statement in statements if statement.lstrip().startswith("UPDATE player")]) == 1
+
+    def test_games_being_flushed_are_not_invalidated(self, client: TestClient, session: Session, write_behind_store: GameStore, monkeypatch):
+        game_id, player1_id, player2_id = start_game(client)
+        assert utils.make_move(client, game_id, player1_id, 0).status_code == 200
+        state = write_behind_store.get(session, game_id)
+
+        # Hold the flush after it took the pending move, before it is committed
+        flushing = threading.Event()
+        resume = threading.Event()
+        apply_move_events = crud.apply_move_events
+
+        def paused_apply_move_events(*args, **kwargs):
+            flushing.set()
+            assert resume.wait(5)
+            return apply_move_events(*args, **kwargs)
+
+        monkeypatch.setattr(crud, "apply_move_events", paused_apply_move_events)
+        flush = threading.Thread(target=write_behind_store.flush, args=(session,))
+        flush.start()
+        try:
+            assert flushing.wait(5)
+            assert write_behind_store.pending_count == 0
+            # Like a rejected move, the game is still ahead of the database and kept
+            write_behind_store.invalidate(game_id)
+            assert write_behind_store.get(session, game_id) is state
+        finally:
+            resume.set()
+            flush.join()
+
+        monkeypatch.setattr(crud, "apply_move_events", apply_move_events)
+        response = utils.make_move(client, game_id, player1_id, 1)
+        assert response.status_code == 409
+        assert response.json()["detail"] == "Not your turn"
+        assert utils.make_move(client, game_id, player2_id, 4).status_code == 200
+        assert write_behind_store.flush(session) == 1
+        assert count_moves(session, game_id) == 2
+
+    def test_release_persists_and_drops_games(self, client: TestClient, session: Session, write_behind_store: GameStore):
+        game_id, player1_id, player2_id = start_game(client)
+        utils.play_moves_sequence(client, game_id, [(player1_id, 0), (player2_id, 4)])
+        assert write_behind_store.pending_count == 2
+
+        # The gateway asks for it when the game may move to another worker
+        response = client.post("/internal/release")
+        assert response.status_code == 200
+        assert response.json() == {"released_games": 1}
+        assert len(write_behind_store) == 0
+        assert count_moves(session, game_id) == 2
+
+        # The game is loaded again from the database
+        assert utils.make_move(client, game_id, player1_id, 8).status_code == 200
+        assert utils.get_game(client, game_id).json()["grid"] == [[1, 0, 0], [0, 2, 0], [0, 0, 1]]
+
+    def test_journal_is_replayed_after_crash(self, client: TestClient, session: Session, write_behind_store: GameStore):
+        game_id, player1_id, player2_id = start_game(client)
+        play_until_win(client, game_id, player1_id, player2_id)
+        assert count_moves(session, game_id) == 0
+
+        # The process dies without flushing, a new store recovers from the journal
+        assert write_behind_store.journal_path is not None
+        with open(write_behind_store.journal_path) as journal:
+            journal_contents = journal.read()
+        recovered_store = GameStore(write_behind=True, journal_path=write_behind_store.journal_path, journal_fsync=False)
+        assert recovered_store.recover(session) == 4
+        assert count_moves(session, game_id) == 4
+
+        game = session.get(Game, game_id)
+        assert game is not None
+        session.refresh(game)
+        assert game.current_turn_number == 5
+        assert game.version == 5
+
+        # The journal is now empty
+        assert recovered_store.recover(session) == 0
+
+        # Dying after the replay committed but before the journal was cleared replays it again, which changes nothing
+        with open(write_behind_store.journal_path, "w") as journal:
+            journal.write(journal_contents)
+        assert recovered_store.recover(session) == 4
+        assert count_moves(session, game_id) == 4
+        session.refresh(game)
+        assert game.version == 5
+
+        # The game goes on from the recovered state
+        use_store(recovered_store)
+        assert utils.make_move(client, game_id, player1_id, 2).status_code == 200
+        player1 = session.get(Player, player1_id)
+        assert player1 is not None
+        session.refresh(player1)
+        assert (player1.games_played, player1.games_won) == (1, 1)
+
+    def test_torn_journal_line_is_skipped(self, session: Session, tmp_path):
+        player = crud.create_player(session)
+        assert player.id is not None
+        game = crud.create_game(session, player.id)
+        assert game.id is not None
+
+        event = MoveEvent(
+            game_id=game.id, player_id=player.id, position=0, move_number=1,
+            status=GameStatus.IN_PROGRESS, winner_id=None, board=b"\x01\x00",
+        )
+        journal_path = tmp_path / "game_store.journal"
+        journal_path.write_text(event.to_json() + "\n" + event.to_json()[:10])
+
+        store = GameStore(write_behind=True, journal_path=str(journal_path), journal_fsync=False)
+        assert store.recover(session) == 1
+        assert count_moves(session, game.id) == 1
+        assert journal_path.read_text() == ""
+
+    def test_requests_dont_block_the_event_loop(self, tmp_path, monkeypatch):
+        engine = create_engine(f"sqlite:///{tmp_path / 'store.db'}", connect_args={"check_same_thread": False})
+        SQLModel.metadata.create_all(engine)
+        with Session(engine) as session:
+            player1_id = crud.create_player(session).id
+            player2_id = crud.create_player(session).id
+            assert player1_id is not None and player2_id is not None
+            game_id = crud.create_game(session, player1_id).id
+            assert game_id is not None
+            crud.join_game(session, game_id, player2_id)
+
+        store = GameStore(write_behind=True, journal_path=str(tmp_path / "game_store.journal"), journal_fsync=False)
+        store.start(lambda: Session(engine))
+        with Session(engine) as session:
+            state = store.get(session, game_id)
+        assert state is not None
+
+        journal_threads = []
+        append_to_journal = store._append_to_journal
+
+        def record_thread(event: MoveEvent) -> None:
+            journal_threads.append(threading.current_thread())
+            append_to_journal(event)
+
+        monkeypatch.setattr(store, "_append_to_journal", record_thread)
+
+        # Like the flush thread committing a batch, until the event loop ran while a request waits for it
+        flush_lock_held = threading.Event()
+        loop_ran = threading.Event()
+        loop_was_free = []
+
+        def commit_batch() -> None:
+            with store._flush_lock:
+                flush_lock_held.set()
+                loop_was_free.append(loop_ran.wait(2))
+
+        async def requests() -> None:
+            # The database is only used without a flush thread
+            await store.record_move_async(None, state, MoveEvent(  # type: ignore[arg-type]
+                game_id=game_id, player_id=player1_id, position=0, move_number=1,
+                status=GameStatus.IN_PROGRESS, winner_id=None, board=b"",
+            ))
+            async with anyio.create_task_group() as task_group:
+                task_group.start_soon(store.flush_async, None)
+                await anyio.sleep(0.05)
+                loop_ran.set()
+
+        batch = threading.Thread(target=commit_batch)
+        batch.start()
+        try:
+            assert flush_lock_held.wait(5)
+            anyio.run(requests)
+        finally:
+            batch.join()
+            store.stop()
+        assert loop_was_free == [True]
+        assert journal_threads and threading.main_thread() not in journal_threads
+        with Session(engine) as session:
+            assert count_moves(session, game_id) == 1
+
+    def test_background_thread_flushes_in_batches(self, tmp_path):
+        engine = create_engine(f"sqlite:///{tmp_path / 'store.db'}", connect_args={"check_same_thread": False})
+        SQLModel.metadata.create_all(engine)
+        with Session(engine) as session:
+            player1_id = crud.create_player(session).id
+            player2_id = crud.create_player(session).id
+            assert player1_id is not None and player2_id is not None
+            game_id = crud.create_game(session, player1_id).id
+            assert game_id is not None
+            crud.join_game(session, game_id, player2_id)
+
+        store = GameStore(write_behind=True, flush_interval=0.01, journal_path=str(tmp_path / "game_store.journal"), journal_fsync=False)
+        store.start(lambda: Session(engine))
+        with Session(engine) as session:
+            state = store.get(session, game_id)
+            assert state is not None
+            for move_number, (player_id, position) in enumerate([(player1_id, 0), (player2_id, 4)], start=1):
+                store.record_move(session, state, MoveEvent(
+                    game_id=game_id, player_id=player_id, position=position, move_number=move_number,
+                    status=GameStatus.IN_PROGRESS, winner_id=None, board=b"",
+                ))
+
+        deadline = time.monotonic() + 5
+        while store.pending_count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        store.stop()
+
+        with Session(engine) as session:
+            moves = session.exec(select(Move).where(Move.game_id == game_id)).all()
+            assert [move.position for move in moves] == [0, 4]
+            stored_game = session.get(Game, game_id)
+            assert stored_game is not None
+            assert stored_game.current_turn_number == 3
+        assert (tmp_path / "game_store.journal").read_text() == ""
+
+
+class Clock:
+    """Settable time for the game stores' leases"""
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+LEASE_TTL = 10.0
+
+
+def node(name: str, clock: Clock, **kwargs) -> GameStore:
+    """The game store of one app process sharing the database"""
+    return GameStore(lease_owner=name, lease_ttl=LEASE_TTL, clock=clock, **kwargs)
+
+
+def use_store(store: GameStore) -> None:
+    app.dependency_overrides[get_game_store] = lambda: store
+
+
+class TestLeases:
+    def test_lease_holder_serves_from_memory(self, client: TestClient, session: Session):
+        game_id, _, _ = start_game(client)
+        clock = Clock()
+        node_a, node_b = node("node-a", clock), node("node-b", clock)
+
+        state = node_a.get(session, game_id)
+        assert state is not None and node_a.owns(state)
+        with utils.count_statements(session) as statements:
+            assert node_a.get(session, game_id) is state
+        assert statements == []
+
+        # Another process reads the database on every request and keeps nothing
+        state_b = node_b.get(session, game_id)
+        assert state_b is not None and not node_b.owns(state_b)
+        assert len(node_b) == 0
+        lease = session.get(GameLease, game_id)
+        assert lease is not None
+        assert (lease.owner, lease.epoch) == ("node-a", 1)
+
+    def test_lease_is_renewed(self, client: TestClient, session: Session):
+        game_id, _, _ = start_game(client)
+        clock = Clock()
+        node_a = node("node-a", clock)
+        state = node_a.get(session, game_id)
+
+        clock.now += LEASE_TTL * 0.6
+        assert node_a.get(session, game_id) is state
+        lease = session.get(GameLease, game_id)
+        assert lease is not None
+        session.refresh(lease)
+        assert (lease.expires_at, lease.epoch) == (clock.now + LEASE_TTL, 1)
+
+    def test_takeover_after_node_death(self, client: TestClient, session: Session):
+        game_id, player1_id, player2_id = start_game(client)
+        clock = Clock()
+        node_a, node_b = node("node-a", clock), node("node-b", clock)
+
+        use_store(node_a)
+        assert utils.make_move(client, game_id, player1_id, 0).status_code == 200
+        # node-a stops responding, its lease blocks node-b until it expires
+        use_store(node_b)
+        assert utils.make_move(client, game_id, player2_id, 4).status_code == 200
+        assert len(node_b) == 0
+
+        clock.now += LEASE_TTL + 1
+        assert utils.make_move(client, game_id, player1_id, 8).status_code == 200
+        assert len(node_b) == 1
+        lease = session.get(GameLease, game_id)
+        assert lease is not None
+        session.refresh(lease)
+        assert (lease.owner, lease.epoch) == ("node-b", 2)
+
+        # node-a comes back with its stale copy: it drops it and reads the database
+        use_store(node_a)
+        get_data = utils.get_game(client, game_id).json()
+        assert get_data["grid"] == [[1, 0, 0], [0, 2, 0], [0, 0, 1]]
+        assert len(node_a) == 0
+        response = utils.make_move(client, game_id, player2_id, 2)
+        assert response.status_code == 200
+        assert count_moves(session, game_id) == 4
+
+    def test_takeover_after_write_behind_node_death(self, client: TestClient, session: Session, tmp_path):
+        game_id, player1_id, player2_id = start_game(client)
+        clock = Clock()
+        node_a = node("node-a", clock, write_behind=True, journal_path=str(tmp_path / "a.journal"), journal_fsync=False)
+        node_b = node("node-b", clock, write_behind=True, journal_path=str(tmp_path / "b.journal"), journal_fsync=False)
+
+        # Leasing nodes write through, so node-a's acked moves don't die with its journal
+        use_store(node_a)
+        assert utils.make_move(client, game_id, player1_id, 0).status_code == 200
+        assert utils.make_move(client, game_id, player2_id, 4).status_code == 200
+        assert node_a.pending_count == 0
+        assert count_moves(session, game_id) == 2
+
+        # node-a dies, node-b takes the game over with every move
+        clock.now += LEASE_TTL + 1
+        use_store(node_b)
+        assert utils.get_game(client, game_id).json()["grid"] == [[1, 0, 0], [0, 2, 0], [0, 0, 0]]
+        assert utils.make_move(client, game_id, player1_id, 8).status_code == 200
+        assert len(node_b) == 1 and node_b.pending_count == 0
+
+        # node-a restarts: it has nothing to replay and its moves are all kept
+        restarted_a = node("node-a", clock, write_behind=True, journal_path=str(tmp_path / "a.journal"), journal_fsync=False)
+        assert restarted_a.recover(session) == 0
+        assert count_moves(session, game_id) == 3
+
+    def test_release_hands_leases_over(self, client: TestClient, session: Session):
+        game_id, player1_id, player2_id = start_game(client)
+        clock = Clock()
+        node_a, node_b = node("node-a", clock), node("node-b", clock)
+
+        use_store(node_a)
+        assert utils.make_move(client, game_id, player1_id, 0).status_code == 200
+        assert len(node_a) == 1
+
+        assert node_a.release(session) == 1
+        assert len(node_a) == 0
+        use_store(node_b)
+        assert utils.make_move(client, game_id, player2_id, 4).status_code == 200
+        assert len(node_b) == 1
+        lease = session.get(GameLease, game_id)
+        assert lease is not None
+        session.refresh(lease)
+        assert (lease.owner, lease.epoch) == ("node-b", 2)
+
+    def test_finished_game_lease_is_deleted(self, client: TestClient, session: Session):
+        game_id, player1_id, player2_id = start_game(client)
+        clock = Clock()
+        use_store(node("node-a", clock))
+
+        play_until_win(client, game_id, player1_id, player2_id)
+        assert session.get(GameLease, game_id) is not None
+        session.expunge_all()
+        assert utils.make_move(client, game_id, player1_id, 2).status_code == 200
+        assert session.get(GameLease, game_id) is None
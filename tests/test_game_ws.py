@@ -0,0 +1,107 @@
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+from app.game_hub import GameHub
+from app.schemas import GamePublic
+from tests import utils
+
+
+def start_game(client: TestClient) -> tuple[int, int, int]:
+    player1_id = utils.create_player(client).json()["id"]
+    player2_id = utils.create_player(client).json()["id"]
+    game_id = utils.create_game(client, player1_id).json()["id"]
+    return game_id, player1_id, player2_id
+
+
+class TestGameWebSocket:
+    """Test the /games/{game_id}/ws endpoint"""
+
+    def test_changes_are_pushed(self, client: TestClient):
+        """Test the current game is sent on connect, then the join and every move made over HTTP"""
+        game_id, player1_id, player2_id = start_game(client)
+
+        with utils.connect_game(client, game_id) as websocket:
+            initial = websocket.receive_json()
+            assert initial["status"] == "waiting"
+            assert initial["message"] is None
+
+            utils.join_game(client, game_id, player2_id)
+            joined = websocket.receive_json()
+            assert joined["status"] == "in_progress"
+            assert joined["player2_id"] == player2_id
+            assert joined["current_turn_player_id"] == player1_id
+
+            move_response = utils.make_move(client, game_id, player1_id, 4)
+            assert websocket.receive_json() == move_response.json()
+
+    def test_moves_are_made_over_the_socket(self, client: TestClient):
+        """Test a move sent on the socket is applied and pushed to every subscriber"""
+        game_id, player1_id, player2_id = start_game(client)
+        utils.join_game(client, game_id, player2_id)
+
+        with utils.connect_game(client, game_id) as websocket1, utils.connect_game(client, game_id) as websocket2:
+            websocket1.receive_json()
+            websocket2.receive_json()
+
+            websocket1.send_json({"player_id": player1_id, "position": 0})
+            update = websocket1.receive_json()
+            assert update["grid"][0][0] == 1
+            assert update["current_turn_player_id"] == player2_id
+            assert websocket2.receive_json() == update
+
+        assert utils.get_game(client, game_id).json()["current_turn_number"] == 2
+
+    def test_rejected_move_is_answered_with_an_error(self, client: TestClient):
+        """Test an invalid move is answered to its sender only, and the socket stays open"""
+        game_id, player1_id, player2_id = start_game(client)
+        utils.join_game(client, game_id, player2_id)
+
+        with utils.connect_game(client, game_id) as websocket:
+            websocket.receive_json()
+
+            websocket.send_json({"player_id": player2_id, "position": 0})
+            assert websocket.receive_json() == {"error": {"status_code": 409, "detail": "Not your turn"}}
+
+            websocket.send_text("not a move")
+            assert websocket.receive_json()["error"]["status_code"] == 422
+
+            websocket.send_json({"player_id": player1_id, "position": 0})
+            assert websocket.receive_json()["grid"][0][0] == 1
+
+    def test_socket_is_closed_when_game_finishes(self, client: TestClient):
+        """Test the last update is sent, then the socket is closed"""
+        game_id, player1_id, player2_id = start_game(client)
+        utils.join_game(client, game_id, player2_id)
+
+        with utils.connect_game(client, game_id) as websocket:
+            websocket.receive_json()
+            utils.play_first_player_win_game(client, game_id, player1_id, player2_id)
+            updates = [websocket.receive_json() for _ in range(5)]
+            assert updates[-1]["status"] == "finished"
+            assert updates[-1]["winner_id"] == player1_id
+            with pytest.raises(WebSocketDisconnect) as exc_info:
+                websocket.receive_json()
+            assert exc_info.value.code == 1000
+
+    def test_game_not_found(self, client: TestClient):
+        """Test the socket of an unknown game is closed"""
+        with pytest.raises(WebSocketDisconnect) as exc_info:
+            with utils.connect_game(client, 999) as websocket:
+                websocket.receive_json()
+        assert exc_info.value.code == 1008
+
+
+class TestGameHub:
+    def test_slow_subscriber_keeps_latest_updates(self):
+        hub = GameHub(queue_size=2)
+        updates = [
+            GamePublic(id=1, status="in_progress", player1_id=1, player2_id=2, current_turn_number=turn,
+                       current_turn_player_id=None, winner_id=None, board_rows=3, board_cols=3, win_length=3, grid=[])
+            for turn in range(1, 4)
+        ]
+        with hub.subscribe(1) as queue, hub.subscribe(2) as other_queue:
+            for update in updates:
+                hub.publish(update)
+            assert [queue.get_nowait().current_turn_number for _ in range(queue.qsize())] == [2, 3]
+            assert other_queue.empty()
+        assert hub.subscriber_count(1) == 0
@@ -1,4 +1,12 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
 from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+from app import batch_eval, crud
+from app.game_hub import get_game_hub
+from app.game_store import GameState, get_game_store
+from app.main import app
+from app.models import Game, Player
 from tests import utils
 
 class TestCreateGame:
@@ -25,6 +33,9 @@ class TestCreateGame:
         assert game_data["current_turn_number"] == 1
         assert game_data["current_turn_player_id"] is None  # No turn until game starts
         assert game_data["winner_id"] is None
+        assert game_data["board_rows"] == 3
+        assert game_data["board_cols"] == 3
+        assert game_data["win_length"] == 3
         
         assert game_data["grid"] == [[0, 0, 0], [0, 0, 0], [0, 0, 0]]
         
@@ -51,6 +62,27 @@ class TestCreateGame:
         expected_error = f"Player already has an unfinished game (ID: {first_game_id}) that is waiting for another player. Complete that game first."
         assert error_data["detail"] == expected_error
 
+    def test_create_game_with_board_size(self, client: TestClient):
+        """Test that a player can create a larger N x M, K in a row game"""
+        player_id = utils.create_player(client).json()["id"]
+
+        game_response = utils.create_game(client, player_id, board_rows=15, board_cols=10, win_length=5)
+        assert game_response.status_code == 201
+
+        game_data = game_response.json()
+        assert game_data["board_rows"] == 15
+        assert game_data["board_cols"] == 10
+        assert game_data["win_length"] == 5
+        assert game_data["grid"] == [[0] * 10 for _ in range(15)]
+
+    def test_create_game_with_invalid_board_size(self, client: TestClient):
+        """Test that board settings are validated"""
+        player_id = utils.create_player(client).json()["id"]
+
+        assert utils.create_game(client, player_id, board_rows=2).status_code == 422
+        assert utils.create_game(client, player_id, board_cols=20).status_code == 422
+        assert utils.create_game(client, player_id, board_rows=4, board_cols=4, win_length=5).status_code == 422
+
     def test_nonexistent_player_cannot_create_game(self, client: TestClient):
         """Test that a nonexistent player cannot create a game"""
         nonexistent_player_id = 99999
@@ -235,6 +267,26 @@ class TestGetGame:
         assert get_data["player2_id"] == create_data["player2_id"]
         assert get_data["grid"] == create_data["grid"]
 
+    def test_get_game_returns_current_grid(self, client: TestClient):
+        """Test that the grid returned after moves matches the moves made"""
+        player1_id = utils.create_player(client).json()["id"]
+        player2_id = utils.create_player(client).json()["id"]
+        game_id = utils.create_game(client, player1_id).json()["id"]
+        assert utils.join_game(client, game_id, player2_id).status_code == 200
+
+        move_responses = utils.play_moves_sequence(client, game_id, [(player1_id, 4), (player2_id, 0), (player1_id, 8)])
+        for move_response in move_responses:
+            assert move_response.status_code == 200
+
+        get_response = utils.get_game(client, game_id)
+        assert get_response.status_code == 200
+
+        get_data = get_response.json()
+        assert get_data["grid"] == [[2, 0, 0], [0, 1, 0], [0, 0, 1]]
+        assert get_data["grid"] == move_responses[-1].json()["grid"]
+        assert get_data["current_turn_number"] == 4
+        assert get_data["current_turn_player_id"] == player2_id
+
     def test_get_nonexistent_game(self, client: TestClient):
         """Test getting a game that doesn't exist"""
         nonexistent_game_id = 99999
@@ -245,6 +297,96 @@ class TestGetGame:
         error_data = response.json()
         assert error_data["detail"] == "Game not found"
 
+    def test_wait_for_turn_returns_after_opponent_moves(self, client: TestClient):
+        """Test a long poll is held until the opponent's move makes it the player's turn"""
+        player1_id = utils.create_player(client).json()["id"]
+        player2_id = utils.create_player(client).json()["id"]
+        game_id = utils.create_game(client, player1_id).json()["id"]
+        utils.join_game(client, game_id, player2_id)
+
+        hub = app.dependency_overrides[get_game_hub]()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            poll = executor.submit(utils.get_game, client, game_id, wait_for_turn=player2_id, since_turn=1, timeout=5)
+            deadline = time.monotonic() + 5
+            while hub.subscriber_count(game_id) == 0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert hub.subscriber_count(game_id) == 1
+            assert not poll.done()
+
+            move_response = utils.make_move(client, game_id, player1_id, 4)
+            response = poll.result(timeout=5)
+
+        assert response.status_code == 200
+        assert response.json() == move_response.json()
+        assert response.json()["current_turn_player_id"] == player2_id
+
+    def test_wait_sees_move_made_while_game_is_read(self, client: TestClient, monkeypatch):
+        """Test a long poll on a game read from the database sees a move made right after the read"""
+        player1_id = utils.create_player(client).json()["id"]
+        player2_id = utils.create_player(client).json()["id"]
+        game_id = utils.create_game(client, player1_id).json()["id"]
+        utils.join_game(client, game_id, player2_id)
+
+        # Like a game leased by another process, the store returns a snapshot it doesn't keep
+        polls = []
+
+        def get_snapshot_then_move(session: Session, game_id: int, *args) -> GameState:
+            game = crud.get_game(session, game_id)
+            assert game is not None
+            snapshot = GameState.from_game(game)
+            if not polls:
+                # Only after the long poll's read, the move reads the game too
+                polls.append(snapshot)
+                assert utils.make_move(client, game_id, player1_id, 4).status_code == 200
+            return snapshot
+
+        store = app.dependency_overrides[get_game_store]()
+        monkeypatch.setattr(store, "get", get_snapshot_then_move)
+        response = utils.get_game(client, game_id, wait_for_turn=player2_id, timeout=2)
+        assert polls[0].current_turn_number == 1
+        assert response.json()["current_turn_player_id"] == player2_id
+
+    def test_wait_returns_right_away_when_turn_reached(self, client: TestClient):
+        """Test a game already past since_turn, or finished, is returned without waiting"""
+        player1_id = utils.create_player(client).json()["id"]
+        player2_id = utils.create_player(client).json()["id"]
+        game_id = utils.create_game(client, player1_id).json()["id"]
+        utils.join_game(client, game_id, player2_id)
+
+        response = utils.get_game(client, game_id, wait_for_turn=player1_id, since_turn=0)
+        assert response.status_code == 200
+        assert response.json()["current_turn_number"] == 1
+
+        utils.play_first_player_win_game(client, game_id, player1_id, player2_id)
+        response = utils.get_game(client, game_id, wait_for_turn=player2_id, since_turn=100)
+        assert response.status_code == 200
+        assert response.json()["status"] == "finished"
+
+    def test_wait_times_out_with_current_game(self, client: TestClient):
+        """Test the current game is returned when the turn isn't reached in time"""
+        player1_id = utils.create_player(client).json()["id"]
+        player2_id = utils.create_player(client).json()["id"]
+        game_id = utils.create_game(client, player1_id).json()["id"]
+        utils.join_game(client, game_id, player2_id)
+
+        response = utils.get_game(client, game_id, wait_for_turn=player2_id, timeout=0.05)
+        assert response.status_code == 200
+        assert response.json()["current_turn_player_id"] == player1_id
+
+    def test_wait_for_turn_of_player_not_in_game(self, client: TestClient):
+        """Test waiting for the turn of a player who is not in the game"""
+        player1_id = utils.create_player(client).json()["id"]
+        player2_id = utils.create_player(client).json()["id"]
+        player3_id = utils.create_player(client).json()["id"]
+        game_id = utils.create_game(client, player1_id).json()["id"]
+        utils.join_game(client, game_id, player2_id)
+
+        response = utils.get_game(client, game_id, wait_for_turn=player3_id)
+        assert response.status_code == 403
+        assert response.json()["detail"] == "Player not in game"
+
+        assert utils.get_game(client, game_id, wait_for_turn=player1_id, timeout=61).status_code == 422
+
 class TestGetAvailableGames:
     """Test the GET /games/available endpoint"""
     
@@ -268,6 +410,68 @@ class TestGetAvailableGames:
         assert response.json()[0]["id"] == game1_id
         assert response.json()[1]["id"] == game2_id
 
+    def test_get_available_games_query_count(self, client: TestClient, session: Session):
+        """Test the listing loads game_players for all games at once, not per game"""
+        player_ids = [utils.create_player(client).json()["id"] for _ in range(6)]
+        utils.create_game(client, player_ids[0])
+
+        with utils.count_statements(session) as statements:
+            response = utils.get_available_games(client)
+        assert len(response.json()) == 1
+        statement_count = len(statements)
+
+        for player_id in player_ids[1:]:
+            utils.create_game(client, player_id)
+
+        with utils.count_statements(session) as statements:
+            response = utils.get_available_games(client)
+        assert len(response.json()) == 6
+        assert [game["player1_id"] for game in response.json()] == player_ids
+        assert len(statements) == statement_count == 2
+
+    def test_get_available_games_pages(self, client: TestClient):
+        """Test paging through the available games with the next cursor"""
+        player_ids = [utils.create_player(client).json()["id"] for _ in range(5)]
+        game_ids = [utils.create_game(client, player_id).json()["id"] for player_id in player_ids]
+
+        first_page = utils.get_available_games(client, limit=2)
+        assert first_page.status_code == 200
+        assert [game["id"] for game in first_page.json()] == game_ids[:2]
+        assert first_page.headers["X-Next-Cursor"] == str(game_ids[1])
+
+        second_page = utils.get_available_games(client, limit=2, after_id=first_page.headers["X-Next-Cursor"])
+        assert [game["id"] for game in second_page.json()] == game_ids[2:4]
+
+        last_page = utils.get_available_games(client, limit=2, after_id=second_page.headers["X-Next-Cursor"])
+        assert [game["id"] for game in last_page.json()] == game_ids[4:]
+        assert "X-Next-Cursor" not in last_page.headers
+
+        # A game that is joined meanwhile is left out of the pages that follow
+        joiner_id = utils.create_player(client).json()["id"]
+        assert utils.join_game(client, game_ids[3], joiner_id).status_code == 200
+        second_page = utils.get_available_games(client, limit=2, after_id=first_page.headers["X-Next-Cursor"])
+        assert [game["id"] for game in second_page.json()] == [game_ids[2], game_ids[4]]
+
+    def test_get_available_games_filters(self, client: TestClient):
+        """Test excluding the requesting player's games and filtering by creation time"""
+        player1_id = utils.create_player(client).json()["id"]
+        player2_id = utils.create_player(client).json()["id"]
+        game1_id = utils.create_game(client, player1_id).json()["id"]
+        game2_id = utils.create_game(client, player2_id).json()["id"]
+
+        response = utils.get_available_games(client, exclude_player_id=player1_id)
+        assert [game["id"] for game in response.json()] == [game2_id]
+
+        response = utils.get_available_games(client, created_after="2000-01-01T00:00:00+02:00")
+        assert [game["id"] for game in response.json()] == [game1_id, game2_id]
+        response = utils.get_available_games(client, created_after="2999-01-01T00:00:00")
+        assert response.json() == []
+
+    def test_get_available_games_invalid_limit(self, client: TestClient):
+        """Test the page size is bounded"""
+        assert utils.get_available_games(client, limit=0).status_code == 422
+        assert utils.get_available_games(client, limit=1000).status_code == 422
+
 class TestMakeMove:
     """Test the POST /games/{game_id}/move endpoint"""
     
@@ -321,6 +525,40 @@ class TestMakeMove:
         assert "detail" in error_data
         assert error_data["detail"] == "Position already occupied"
 
+    def test_make_move_position_out_of_range(self, client: TestClient):
+        """Test making a move outside of the board"""
+        player1_id = utils.create_player(client).json()["id"]
+        player2_id = utils.create_player(client).json()["id"]
+        game_id = utils.create_game(client, player1_id).json()["id"]
+        assert utils.join_game(client, game_id, player2_id).status_code == 200
+
+        move_response = utils.make_move(client, game_id, player1_id, 9)
+        assert move_response.status_code == 422
+        assert move_response.json()["detail"] == "Position must be between 0 and 8 on a 3x3 board"
+
+    def test_make_move_win_gomoku_game(self, client: TestClient):
+        """Test winning a 15x15 five in a row game"""
+        player1_id = utils.create_player(client).json()["id"]
+        player2_id = utils.create_player(client).json()["id"]
+        game_id = utils.create_game(client, player1_id, board_rows=15, board_cols=15, win_length=5).json()["id"]
+        assert utils.join_game(client, game_id, player2_id).status_code == 200
+
+        # Player 1 plays row 7 columns 3-7, player 2 plays row 8
+        moves = []
+        for col in range(3, 8):
+            moves.append((player1_id, 7 * 15 + col))
+            moves.append((player2_id, 8 * 15 + col))
+        move_responses = utils.play_moves_sequence(client, game_id, moves[:-1])
+        for move_response in move_responses:
+            assert move_response.status_code == 200
+
+        assert move_responses[-2].json()["status"] == "in_progress"
+        move_data = move_responses[-1].json()
+        assert move_data["status"] == "finished"
+        assert move_data["winner_id"] == player1_id
+        assert move_data["grid"][7][3:8] == [1, 1, 1, 1, 1]
+        assert move_data["grid"][8][3:7] == [2, 2, 2, 2]
+
     def test_make_move_player_wrong_turn(self, client: TestClient):
         """Test making a move in a game with an wrong turn"""
         player1_response = utils.create_player(client)
@@ -410,3 +648,67 @@ class TestMakeMove:
         assert move_data9["status"] == "finished"
         assert move_data9["winner_id"] is None
         assert move_data9["message"] == f"Player {player1_id} made a move at position 8 and it's a draw! Game is now finished"
+
+
+class TestImportGames:
+    """Test the POST /games/import endpoint"""
+
+    def test_import_games(self, client: TestClient, session: Session):
+        """Test complete games are stored as finished and counted in the player statistics"""
+        player1_id = utils.create_player(client).json()["id"]
+        player2_id = utils.create_player(client).json()["id"]
+
+        response = utils.import_games(client, [
+            {"player1_id": player1_id, "player2_id": player2_id, "positions": [0, 6, 1, 7, 2]},
+            {"player1_id": player2_id, "player2_id": player1_id, "positions": [1, 0, 3, 2, 4, 5, 6, 7, 8]},
+            {"player1_id": player1_id, "player2_id": player2_id, "board_rows": 6, "board_cols": 7, "win_length": 4,
+             "positions": [0, 7, 1, 8, 35, 9, 36, 10]},
+        ])
+        assert response.status_code == 201
+        game_ids = response.json()["game_ids"]
+        assert len(game_ids) == 3
+
+        won_game = utils.get_game(client, game_ids[0]).json()
+        assert won_game["status"] == "finished"
+        assert won_game["winner_id"] == player1_id
+        assert won_game["grid"] == [[1, 1, 1], [0, 0, 0], [2, 2, 0]]
+        assert utils.get_game(client, game_ids[1]).json()["winner_id"] is None
+        assert utils.get_game(client, game_ids[2]).json()["winner_id"] == player2_id
+        assert [move.position for move in crud.get_moves_for_game(session, game_ids[2])] == [0, 7, 1, 8, 35, 9, 36, 10]
+
+        player1 = session.get(Player, player1_id)
+        assert player1 is not None
+        assert (player1.games_played, player1.games_won, player1.total_moves) == (3, 1, 3 + 4 + 4)
+        assert [player["player_id"] for player in utils.get_leaderboard_by_wins(client).json()] == [player1_id, player2_id]
+
+        # The stored games agree with their moves
+        report = batch_eval.audit_games(session)
+        assert report.game_mismatches == [] and report.player_mismatches == []
+
+        # Imported players can start a new game
+        assert utils.create_game(client, player1_id).status_code == 201
+
+    def test_invalid_games_import_nothing(self, client: TestClient, session: Session):
+        """Test an import with an invalid game is rejected as a whole"""
+        player1_id = utils.create_player(client).json()["id"]
+        player2_id = utils.create_player(client).json()["id"]
+
+        response = utils.import_games(client, [
+            {"player1_id": player1_id, "player2_id": player2_id, "positions": [0, 6, 1, 7, 2]},
+            {"player1_id": player1_id, "player2_id": player2_id, "positions": [0, 6, 1]},
+            {"player1_id": player1_id, "player2_id": 999, "positions": [0, 6, 1, 7, 2]},
+        ])
+        assert response.status_code == 422
+        assert response.json()["detail"] == [
+            {"index": 1, "detail": "Game is not finished"},
+            {"index": 2, "detail": "Player not found"},
+        ]
+        assert utils.get_player(client, player1_id).json()["games_played"] == 0
+        assert session.exec(select(Game)).all() == []
+
+    def test_invalid_import_request(self, client: TestClient):
+        """Test the request schema is validated"""
+        player_id = utils.create_player(client).json()["id"]
+        assert utils.import_games(client, []).status_code == 422
+        assert utils.import_games(client, [{"player1_id": player_id, "player2_id": player_id, "positions": [0]}]).status_code == 422
+        assert utils.import_games(client, [{"player1_id": player_id, "player2_id": 2, "positions": []}]).status_code == 422
@@ -0,0 +1,209 @@
+"""
+Tests for the gateway routing requests to workers by game, see app/gateway.py
+"""
+from typing import Generator
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from sqlmodel import Session
+
+from app.gateway import LOBBY_KEY, Gateway, HashRing, create_gateway_app
+from app.game_store import GameStore, get_game_store
+from app.main import app
+from app.matchmaking import get_gateway_client
+from app.models import GameLease
+from tests import utils
+
+WORKER_URLS = ["http://worker1", "http://worker2", "http://worker3"]
+LOBBY_URL = "http://lobby"
+OWNER_URL = "http://owner"
+
+
+def fake_worker(name: str, calls: list) -> FastAPI:
+    """A worker answering every request with its name, recording its releases"""
+    worker = FastAPI()
+
+    @worker.get("/internal/health")
+    async def health():
+        return {"status": "ok"}
+
+    @worker.post("/internal/release")
+    async def release():
+        calls.append(name)
+        return {"released_games": 0}
+
+    @worker.api_route("/{path:path}", methods=["GET", "POST"])
+    async def echo(request: Request, path: str):
+        return {"worker": name, "path": f"/{path}", "query": str(request.query_params), "body": (await request.body()).decode()}
+
+    return worker
+
+
+def app_worker(store: GameStore):
+    """The app as one worker process, with its own game store and the test database"""
+    async def worker(scope, receive, send):
+        previous = app.dependency_overrides[get_game_store]
+        app.dependency_overrides[get_game_store] = lambda: store
+        try:
+            await app(scope, receive, send)
+        finally:
+            app.dependency_overrides[get_game_store] = previous
+
+    return worker
+
+
+@pytest.fixture(scope="function")
+def releases() -> list:
+    return []
+
+
+@pytest.fixture(scope="function")
+def gateway(releases: list) -> Gateway:
+    mounts = {url: httpx.ASGITransport(app=fake_worker(url, releases)) for url in [*WORKER_URLS, "http://worker4"]}
+    return Gateway(WORKER_URLS, client=httpx.AsyncClient(mounts=mounts))
+
+
+@pytest.fixture(scope="function")
+def gateway_client(gateway: Gateway) -> Generator[TestClient, None, None]:
+    with TestClient(create_gateway_app(gateway, health_interval=0)) as test_client:
+        yield test_client
+
+
+class TestHashRing:
+    """Test the consistent hash ring"""
+
+    def test_keys_are_spread(self):
+        """Test every node gets a share of the keys"""
+        ring = HashRing(WORKER_URLS)
+        owners = [ring.node_for(f"game:{game_id}") for game_id in range(3000)]
+        for url in WORKER_URLS:
+            assert 500 < owners.count(url) < 1500
+
+    def test_adding_a_node_moves_only_its_keys(self):
+        """Test the keys that move all go to the new node, about 1/N of them"""
+        ring = HashRing(WORKER_URLS)
+        keys = [f"game:{game_id}" for game_id in range(3000)]
+        before = {key: ring.node_for(key) for key in keys}
+
+        ring.add("http://worker4")
+        moved = [key for key in keys if ring.node_for(key) != before[key]]
+        assert all(ring.node_for(key) == "http://worker4" for key in moved)
+        assert 400 < len(moved) < 1200
+
+        ring.remove("http://worker4")
+        assert {key: ring.node_for(key) for key in keys} == before
+
+    def test_empty_ring(self):
+        """Test a ring without nodes has no owner"""
+        with pytest.raises(LookupError):
+            HashRing().node_for("game:1")
+
+
+class TestGateway:
+    """Test the gateway app"""
+
+    def test_game_requests_go_to_the_owner(self, gateway_client: TestClient, gateway: Gateway):
+        """Test every request of a game goes to the same worker, with its query and body"""
+        owner = gateway.ring.node_for("game:7")
+
+        response = gateway_client.get("/games/7", params={"since_turn": 2})
+        assert response.status_code == 200
+        assert response.json() == {"worker": owner, "path": "/games/7", "query": "since_turn=2", "body": ""}
+
+        response = gateway_client.post("/games/7/move", json={"player_id": 1, "position": 4})
+        assert response.json()["worker"] == owner
+        assert response.json()["body"] == '{"player_id":1,"position":4}'
+
+    def test_lobby_and_other_routes(self, gateway_client: TestClient, gateway: Gateway):
+        """Test game creation and matchmaking go to the lobby worker, other routes to every worker in turn"""
+        lobby = gateway.ring.node_for("lobby")
+        assert gateway_client.post("/games", json={"player_id": 1}).json()["worker"] == lobby
+        assert gateway_client.post("/matchmaking", json={"player_id": 1}).json()["worker"] == lobby
+
+        workers = {gateway_client.get("/leaderboard/wins").json()["worker"] for _ in range(len(WORKER_URLS))}
+        assert workers == set(WORKER_URLS)
+
+        # Repeated query parameters are all forwarded
+        response = gateway_client.get("/leaderboard", params=[("include", "wins"), ("include", "efficiency")])
+        assert response.json()["query"] == "include=wins&include=efficiency"
+
+    def test_workers_joining_and_leaving(self, gateway_client: TestClient, gateway: Gateway, releases: list):
+        """Test the games are released by every worker when one joins or leaves, and moved games follow"""
+        response = gateway_client.post("/gateway/workers", json={"url": "http://worker4"})
+        assert response.status_code == 204
+        assert sorted(releases) == sorted([*WORKER_URLS, "http://worker4"])
+        game_id = next(game_id for game_id in range(1000) if gateway.ring.node_for(f"game:{game_id}") == "http://worker4")
+        assert gateway_client.get(f"/games/{game_id}").json()["worker"] == "http://worker4"
+
+        releases.clear()
+        response = gateway_client.delete("/gateway/workers", params={"url": "http://worker4"})
+        assert response.status_code == 204
+        assert sorted(releases) == sorted([*WORKER_URLS, "http://worker4"])
+        assert gateway_client.get(f"/games/{game_id}").json()["worker"] in WORKER_URLS
+        assert gateway_client.get("/gateway/workers").json() == {"workers": WORKER_URLS, "healthy": WORKER_URLS}
+
+    def test_unhealthy_worker_is_taken_off(self, gateway_client: TestClient, gateway: Gateway, releases: list):
+        """Test a worker failing its health check loses its games until it is back"""
+        gateway.workers.add("http://down")
+        gateway.ring.add("http://down")
+        game_id = next(game_id for game_id in range(1000) if gateway.ring.node_for(f"game:{game_id}") == "http://down")
+        assert gateway_client.get(f"/games/{game_id}").status_code == 502
+
+        gateway_client.portal.call(gateway.check_workers)
+        assert gateway_client.get("/gateway/workers").json()["healthy"] == WORKER_URLS
+        assert sorted(releases) == WORKER_URLS
+        assert gateway_client.get(f"/games/{game_id}").json()["worker"] in WORKER_URLS
+
+
+class TestGatewayWithWorkers:
+    """Test the app workers behind the gateway, the lobby and the game's owner being different workers"""
+
+    @pytest.fixture(scope="function")
+    def stores(self) -> dict[str, GameStore]:
+        return {url: GameStore(lease_owner=url) for url in (LOBBY_URL, OWNER_URL)}
+
+    @pytest.fixture(scope="function")
+    def routed_client(self, client: TestClient, stores: dict[str, GameStore]) -> Generator[TestClient, None, None]:
+        mounts = {url: httpx.ASGITransport(app=app_worker(store)) for url, store in stores.items()}
+        gateway = Gateway(stores, client=httpx.AsyncClient(mounts=mounts))
+        gateway.ring.node_for = lambda key: LOBBY_URL if key == LOBBY_KEY else OWNER_URL
+        gateway_app = create_gateway_app(gateway, health_interval=0)
+        # The workers' GATEWAY_URL
+        gateway_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=gateway_app), base_url="http://gateway")
+        app.dependency_overrides[get_gateway_client] = lambda: gateway_client
+        with TestClient(gateway_app) as test_client:
+            yield test_client
+
+    def test_owner_leases_the_game(self, routed_client: TestClient, session: Session, stores: dict[str, GameStore]):
+        """Test the game created by the lobby is leased and served by its owner"""
+        player1_id = utils.create_player(routed_client).json()["id"]
+        player2_id = utils.create_player(routed_client).json()["id"]
+        game_id = utils.create_game(routed_client, player1_id).json()["id"]
+        assert utils.join_game(routed_client, game_id, player2_id).status_code == 200
+        assert utils.make_move(routed_client, game_id, player1_id, 0).status_code == 200
+
+        lease = session.get(GameLease, game_id)
+        assert lease is not None and lease.owner == OWNER_URL
+        assert len(stores[LOBBY_URL]) == 0
+        assert len(stores[OWNER_URL]) == 1
+
+    def test_matchmaking_joins_through_the_owner(self, routed_client: TestClient, stores: dict[str, GameStore]):
+        """Test a game matched by the lobby is joined by its owner, whose cached game stays current"""
+        player1_id = utils.create_player(routed_client).json()["id"]
+        player2_id = utils.create_player(routed_client).json()["id"]
+        response = utils.find_match(routed_client, player1_id)
+        assert response.status_code == 201
+        game_id = response.json()["id"]
+        # The owner caches the waiting game
+        assert utils.get_game(routed_client, game_id).json()["status"] == "waiting"
+        assert len(stores[OWNER_URL]) == 1
+
+        response = utils.find_match(routed_client, player2_id)
+        assert response.status_code == 200
+        assert response.json()["id"] == game_id
+        assert response.json()["status"] == "in_progress"
+        assert utils.make_move(routed_client, game_id, player1_id, 0).status_code == 200
+        assert len(stores[LOBBY_URL]) == 0
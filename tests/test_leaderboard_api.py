@@ -1,4 +1,5 @@
 from fastapi.testclient import TestClient
+from sqlmodel import Session
 from tests import utils
 
 
@@ -173,4 +174,104 @@ class TestLeaderboard:
 
         assert efficiency_data[2]["player_id"] == player2_id
         assert efficiency_data[2]["efficiency"] == 15
-        assert efficiency_data[2]["rank"] == 3
\ No newline at end of file
+        assert efficiency_data[2]["rank"] == 3
+
+    def test_get_leaderboard_page(self, client: TestClient):
+        """Test paging through a leaderboard with limit and offset"""
+        player_ids = [utils.create_player(client).json()["id"] for _ in range(4)]
+        loser_id = player_ids[-1]
+        for winner_id in player_ids[:3]:
+            game_id = utils.create_game(client, winner_id).json()["id"]
+            assert utils.join_game(client, game_id, loser_id).status_code == 200
+            for move_response in utils.play_first_player_win_game(client, game_id, winner_id, loser_id):
+                assert move_response.status_code == 200
+
+        first_page = utils.get_leaderboard_by_wins(client, limit=2).json()
+        assert [(player["player_id"], player["rank"]) for player in first_page] == [(player_ids[0], 1), (player_ids[1], 1)]
+
+        second_page = utils.get_leaderboard_by_wins(client, limit=2, offset=2).json()
+        assert [(player["player_id"], player["rank"]) for player in second_page] == [(player_ids[2], 1)]
+
+    def test_get_leaderboard_invalid_page(self, client: TestClient):
+        """Test limit and offset are validated"""
+        assert utils.get_leaderboard_by_wins(client, limit=0).status_code == 422
+        assert utils.get_leaderboard_by_win_rate(client, limit=101).status_code == 422
+        assert utils.get_leaderboard_by_efficiency(client, offset=-1).status_code == 422
+
+    def test_get_combined_leaderboard(self, client: TestClient):
+        """Test getting every leaderboard at once matches the single leaderboards"""
+        player_ids = [utils.create_player(client).json()["id"] for _ in range(3)]
+        for winner_id, loser_id in [(player_ids[0], player_ids[1]), (player_ids[1], player_ids[2]), (player_ids[0], player_ids[2])]:
+            game_id = utils.create_game(client, winner_id).json()["id"]
+            assert utils.join_game(client, game_id, loser_id).status_code == 200
+            for move_response in utils.play_first_player_win_game(client, game_id, winner_id, loser_id):
+                assert move_response.status_code == 200
+
+        response = utils.get_leaderboard(client)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["top_players_by_wins"] == utils.get_leaderboard_by_wins(client).json()
+        assert data["top_players_by_win_rate"] == utils.get_leaderboard_by_win_rate(client).json()
+        assert data["top_players_by_efficiency"] == utils.get_leaderboard_by_efficiency(client).json()
+
+        response = utils.get_leaderboard(client, include=["wins", "efficiency"], limit=1)
+        assert response.status_code == 200
+        data = response.json()
+        assert set(data) == {"top_players_by_wins", "top_players_by_efficiency"}
+        assert [player["player_id"] for player in data["top_players_by_wins"]] == [player_ids[0]]
+
+    def test_get_combined_leaderboard_invalid_board(self, client: TestClient):
+        """Test unknown leaderboards are rejected"""
+        assert utils.get_leaderboard(client, include=["losses"]).status_code == 422
+
+
+class TestLeaderboardCache:
+    """Test the cached leaderboard responses and their ETags"""
+
+    def play_game(self, client: TestClient, winner_id: int, loser_id: int) -> None:
+        game_id = utils.create_game(client, winner_id).json()["id"]
+        assert utils.join_game(client, game_id, loser_id).status_code == 200
+        for move_response in utils.play_first_player_win_game(client, game_id, winner_id, loser_id):
+            assert move_response.status_code == 200
+
+    def test_not_modified_until_a_game_finishes(self, client: TestClient, session: Session):
+        """Test a conditional request returns 304 until the leaderboards change"""
+        player1_id = utils.create_player(client).json()["id"]
+        player2_id = utils.create_player(client).json()["id"]
+        self.play_game(client, player1_id, player2_id)
+
+        response = utils.get_leaderboard_by_wins(client)
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+
+        with utils.count_statements(session) as statements:
+            not_modified = client.get("/leaderboard/wins", headers={"If-None-Match": etag})
+        assert not_modified.status_code == 304
+        assert not_modified.headers["ETag"] == etag
+        assert not_modified.content == b""
+        # Only the leaderboard version is read
+        assert len(statements) == 1
+
+        self.play_game(client, player2_id, player1_id)
+        response = client.get("/leaderboard/wins", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+        assert [player["games_won"] for player in response.json()] == [1, 1]
+
+    def test_cached_response_is_served_for_the_same_version(self, client: TestClient, session: Session):
+        """Test a repeated request is served from the cache"""
+        player1_id = utils.create_player(client).json()["id"]
+        player2_id = utils.create_player(client).json()["id"]
+        self.play_game(client, player1_id, player2_id)
+
+        first = utils.get_leaderboard(client, include=["wins"])
+        with utils.count_statements(session) as statements:
+            second = utils.get_leaderboard(client, include=["wins"])
+        assert second.content == first.content
+        assert second.headers["ETag"] == first.headers["ETag"]
+        assert len(statements) == 1
+
+        # Another page is cached separately
+        assert utils.get_leaderboard(client, include=["win_rate"]).json() == {
+            "top_players_by_win_rate": utils.get_leaderboard_by_win_rate(client).json()
+        }
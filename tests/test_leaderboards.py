@@ -0,0 +1,219 @@
+"""
+Tests for the incrementally maintained leaderboards
+"""
+from typing import Generator
+
+import pytest
+from sqlmodel import Session, SQLModel, create_engine
+
+from app import crud
+from app.leaderboards import LeaderboardCache, Leaderboards, PlayerEntry
+from app.models import LeaderboardMetric
+from tests import utils
+
+
+@pytest.fixture(scope="function")
+def boards(session: Session) -> Generator[Leaderboards, None, None]:
+    boards = Leaderboards()
+    boards.rebuild(session)
+    boards.attach()
+    yield boards
+    boards.detach()
+
+
+def create_players(session: Session, count: int) -> list[int]:
+    player_ids = [crud.create_player(session).id for _ in range(count)]
+    assert all(player_id is not None for player_id in player_ids)
+    return player_ids  # type: ignore[return-value]
+
+
+def finish_game(session: Session, winner_id: int, loser_id: int, winner_moves: int = 3) -> None:
+    crud.update_player_stats_on_game_finish(session, [(winner_id, winner_moves, True), (loser_id, winner_moves - 1, False)])
+    session.commit()
+
+
+def top_ids(boards: Leaderboards, session: Session, metric: LeaderboardMetric, limit: int = 3) -> list[int]:
+    return [stats.player_id for stats in boards.top(session, metric, limit)]
+
+
+class TestLeaderboards:
+    def test_committed_changes_are_applied(self, session: Session, boards: Leaderboards):
+        player1_id, player2_id, player3_id, player4_id = create_players(session, 4)
+        finish_game(session, player1_id, player2_id, winner_moves=4)
+        finish_game(session, player2_id, player3_id)
+        finish_game(session, player1_id, player3_id)
+        finish_game(session, player4_id, player3_id, winner_moves=5)
+
+        assert boards.synced_version == 4
+        assert len(boards) == 3
+
+        top_by_wins = boards.top(session, LeaderboardMetric.WINS)
+        assert [(stats.player_id, stats.games_won, stats.rank) for stats in top_by_wins] == [
+            (player1_id, 2, 1), (player2_id, 1, 2), (player4_id, 1, 2),
+        ]
+        # player1 and player4 win every game, ties are broken by player id
+        assert top_ids(boards, session, LeaderboardMetric.WIN_RATE) == [player1_id, player4_id, player2_id]
+        # 3.5, 5.0 and 6.0 moves per win, moves of lost games count too
+        assert top_ids(boards, session, LeaderboardMetric.EFFICIENCY) == [player1_id, player4_id, player2_id]
+
+    def test_read_is_one_version_query_when_synced(self, session: Session, boards: Leaderboards):
+        player1_id, player2_id = create_players(session, 2)
+        finish_game(session, player1_id, player2_id)
+
+        with utils.count_statements(session) as statements:
+            assert top_ids(boards, session, LeaderboardMetric.WINS) == [player1_id]
+        assert len(statements) == 1
+
+    def test_rolled_back_changes_are_not_applied(self, boards: Leaderboards, tmp_path):
+        # Its own database, the test session's transaction must not be rolled back
+        engine = create_engine(f"sqlite:///{tmp_path / 'leaderboards.db'}")
+        SQLModel.metadata.create_all(engine)
+        with Session(engine) as session:
+            player1_id, player2_id = create_players(session, 2)
+            crud.update_player_stats_on_game_finish(session, [(player1_id, 3, True), (player2_id, 2, False)])
+            session.flush()
+            session.rollback()
+
+            assert len(boards) == 0
+            assert boards.top(session, LeaderboardMetric.WINS) == []
+
+    def test_changes_committed_by_another_process_are_read(self, session: Session, boards: Leaderboards):
+        player1_id, player2_id, player3_id = create_players(session, 3)
+        finish_game(session, player1_id, player2_id)
+
+        # A worker that doesn't see this process's commits catches up from the version row on read
+        other_worker_boards = Leaderboards()
+        assert top_ids(other_worker_boards, session, LeaderboardMetric.WINS) == [player1_id]
+        assert other_worker_boards.synced_version == 1
+
+        finish_game(session, player3_id, player2_id)
+        finish_game(session, player3_id, player1_id)
+        with utils.count_statements(session) as statements:
+            assert top_ids(other_worker_boards, session, LeaderboardMetric.WINS) == [player3_id, player1_id]
+        # The version and the players changed since version 1
+        assert len(statements) == 2
+        assert other_worker_boards.synced_version == 3
+
+    def test_stale_changes_are_ignored(self, session: Session, boards: Leaderboards):
+        player1_id, player2_id = create_players(session, 2)
+        finish_game(session, player1_id, player2_id)
+        finish_game(session, player1_id, player2_id)
+
+        # The changes of version 1 arrive after version 2 was read
+        boards.apply_committed([PlayerEntry(player1_id, 1, 1, 3, 1)])
+        assert [stats.games_won for stats in boards.top(session, LeaderboardMetric.WINS)] == [2]
+
+    def test_rebuild_loads_players_from_database(self, session: Session, boards: Leaderboards):
+        player1_id, player2_id = create_players(session, 2)
+        # Aggregates from before stats_version existed
+        player1 = crud.get_player(session, player1_id)
+        assert player1 is not None
+        player1.games_played, player1.games_won, player1.total_moves = 2, 1, 4
+        session.add(player1)
+        session.commit()
+
+        restarted_boards = Leaderboards()
+        restarted_boards.rebuild(session)
+        assert top_ids(restarted_boards, session, LeaderboardMetric.WINS) == [player1_id]
+        assert restarted_boards.top(session, LeaderboardMetric.WIN_RATE)[0].win_rate == 0.5
+
+    def test_top_many_syncs_once(self, session: Session, boards: Leaderboards):
+        player1_id, player2_id = create_players(session, 2)
+        finish_game(session, player1_id, player2_id)
+
+        with utils.count_statements(session) as statements:
+            pages = boards.top_many(session, list(LeaderboardMetric))
+        # One version query for every leaderboard
+        assert len(statements) == 1
+        assert {metric: [stats.player_id for stats in page] for metric, page in pages.items()} == {
+            metric: [player1_id] for metric in LeaderboardMetric
+        }
+
+    def test_pages_beyond_the_board_are_ranked_in_sql(self, session: Session, boards: Leaderboards):
+        player_ids = create_players(session, 6)
+        loser_id = player_ids[-1]
+        # Wins: 3, 2, 2, 1, 1
+        for player_id, wins in zip(player_ids, [3, 2, 2, 1, 1]):
+            for _ in range(wins):
+                finish_game(session, player_id, loser_id)
+
+        small_boards = Leaderboards(capacity=2)
+        small_boards.rebuild(session)
+        assert len(small_boards) == 2
+
+        def page(limit: int, offset: int) -> list[tuple[int, int]]:
+            return [(stats.player_id, stats.rank) for stats in small_boards.top(session, LeaderboardMetric.WINS, limit, offset)]  # type: ignore[misc]
+
+        # The loser has no win and is not ranked
+        expected = [(player_ids[0], 1), (player_ids[1], 2), (player_ids[2], 2), (player_ids[3], 4), (player_ids[4], 4)]
+        assert page(2, 0) == expected[:2]
+        with utils.count_statements(session) as statements:
+            assert page(3, 2) == expected[2:5]
+        # The version, one SQL page and the count of the players ahead of it
+        assert len(statements) == 3
+        assert page(10, 0) == expected
+        assert page(10, 5) == []
+
+    def test_sql_pages_of_ties_are_in_id_order(self, session: Session):
+        player_ids = create_players(session, 8)
+        loser_id = player_ids[-1]
+        # Wins: 2, 1, 2, 1, 1, 2, 1, every win in 3 moves
+        for player_id, wins in zip(player_ids, [2, 1, 2, 1, 1, 2, 1]):
+            for _ in range(wins):
+                finish_game(session, player_id, loser_id)
+        two_wins = [player_ids[index] for index in (0, 2, 5)]
+        one_win = [player_ids[index] for index in (1, 3, 4, 6)]
+
+        # Pages of 3 split both ties
+        pages = [crud.get_leaderboard(session, LeaderboardMetric.WINS, 3, offset) for offset in range(0, 9, 3)]
+        rows = [(player.id, rank) for page in pages for player, rank in page]
+        assert rows == [(player_id, 1) for player_id in two_wins] + [(player_id, 4) for player_id in one_win]
+        # Every win took 3 moves, the efficiency leaderboard is one tie
+        pages = [crud.get_leaderboard(session, LeaderboardMetric.EFFICIENCY, 2, offset) for offset in range(0, 8, 2)]
+        assert [(player.id, rank) for page in pages for player, rank in page] == [(player_id, 1) for player_id in player_ids[:7]]
+
+    def test_player_falling_behind_the_board_leaves_it(self, session: Session, boards: Leaderboards):
+        player1_id, player2_id, player3_id, loser_id = create_players(session, 4)
+        finish_game(session, player1_id, loser_id)
+        finish_game(session, player2_id, loser_id)
+        finish_game(session, player3_id, loser_id)
+
+        small_boards = Leaderboards(capacity=2)
+        small_boards.rebuild(session)
+        small_boards.attach()
+        try:
+            assert top_ids(small_boards, session, LeaderboardMetric.WIN_RATE, limit=2) == [player1_id, player2_id]
+
+            # player1 loses twice and falls to a win rate of 1/3, behind player3 who is not on the board
+            finish_game(session, loser_id, player1_id)
+            finish_game(session, loser_id, player1_id)
+            with utils.count_statements(session) as statements:
+                assert top_ids(small_boards, session, LeaderboardMetric.WIN_RATE, limit=2) == [player2_id, player3_id]
+            # The board only holds player2, it is refilled with the version and one SQL page
+            assert len(statements) == 2
+        finally:
+            small_boards.detach()
+
+
+class TestLeaderboardCache:
+    def test_entries_of_another_version_are_missed(self):
+        cache = LeaderboardCache()
+        cache.put(("wins",), 1, b"[]")
+        assert cache.get(("wins",), 1) == b"[]"
+        assert cache.get(("wins",), 2) is None
+
+        # A response built at an older version doesn't replace a newer one
+        cache.put(("wins",), 3, b"[3]")
+        cache.put(("wins",), 2, b"[2]")
+        assert cache.get(("wins",), 3) == b"[3]"
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = LeaderboardCache(max_entries=2)
+        cache.put(("wins",), 1, b"wins")
+        cache.put(("win_rate",), 1, b"win_rate")
+        assert cache.get(("wins",), 1) == b"wins"
+        cache.put(("efficiency",), 1, b"efficiency")
+
+        assert len(cache) == 2
+        assert cache.get(("win_rate",), 1) is None
+        assert cache.get(("wins",), 1) == b"wins"
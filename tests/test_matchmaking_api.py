@@ -0,0 +1,95 @@
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+from app import crud
+from app.matchmaking import MatchmakingQueue
+from tests import utils
+
+
+class TestMatchmaking:
+    """Test the POST /matchmaking endpoint"""
+
+    def test_players_are_paired(self, client: TestClient):
+        """Test the first player creates a game and the second one joins it"""
+        player1_id = utils.create_player(client).json()["id"]
+        player2_id = utils.create_player(client).json()["id"]
+
+        created_response = utils.find_match(client, player1_id)
+        assert created_response.status_code == 201
+        created_game = created_response.json()
+        assert created_game["status"] == "waiting"
+        assert created_game["player1_id"] == player1_id
+
+        joined_response = utils.find_match(client, player2_id)
+        assert joined_response.status_code == 200
+        joined_game = joined_response.json()
+        assert joined_game["id"] == created_game["id"]
+        assert joined_game["status"] == "in_progress"
+        assert joined_game["player2_id"] == player2_id
+        assert joined_game["message"] == f"Player {player2_id} joined game with ID: {joined_game['id']}, game is now in progress, waiting for player {player1_id} to make a move"
+
+        assert utils.make_move(client, joined_game["id"], player1_id, 0).status_code == 200
+
+    def test_games_are_paired_in_creation_order(self, client: TestClient):
+        """Test the oldest waiting game is joined first"""
+        player_ids = [utils.create_player(client).json()["id"] for _ in range(4)]
+        first_game_id = utils.find_match(client, player_ids[0]).json()["id"]
+        # Games created with POST /games are queued too
+        second_game_id = utils.create_game(client, player_ids[1]).json()["id"]
+
+        assert utils.find_match(client, player_ids[2]).json()["id"] == first_game_id
+        assert utils.find_match(client, player_ids[3]).json()["id"] == second_game_id
+
+    def test_only_games_with_the_same_board_settings_are_paired(self, client: TestClient):
+        """Test players asking for different boards are not paired"""
+        player1_id = utils.create_player(client).json()["id"]
+        player2_id = utils.create_player(client).json()["id"]
+        player3_id = utils.create_player(client).json()["id"]
+
+        game_id = utils.find_match(client, player1_id, board_rows=6, board_cols=7, win_length=4).json()["id"]
+        assert utils.find_match(client, player2_id).status_code == 201
+
+        response = utils.find_match(client, player3_id, board_rows=6, board_cols=7, win_length=4)
+        assert response.status_code == 200
+        assert response.json()["id"] == game_id
+
+    def test_game_joined_directly_is_skipped(self, client: TestClient):
+        """Test a queued game joined through POST /games/{id}/join is not paired again"""
+        player1_id = utils.create_player(client).json()["id"]
+        player2_id = utils.create_player(client).json()["id"]
+        player3_id = utils.create_player(client).json()["id"]
+
+        game_id = utils.find_match(client, player1_id).json()["id"]
+        assert utils.join_game(client, game_id, player2_id).status_code == 200
+
+        response = utils.find_match(client, player3_id)
+        assert response.status_code == 201
+        assert response.json()["id"] != game_id
+
+    def test_player_with_unfinished_game_is_not_paired(self, client: TestClient):
+        """Test a player waiting in a game cannot ask for another one"""
+        player_id = utils.create_player(client).json()["id"]
+        game_id = utils.find_match(client, player_id).json()["id"]
+
+        response = utils.find_match(client, player_id)
+        assert response.status_code == 409
+        assert response.json()["detail"] == f"Player already has an unfinished game (ID: {game_id}) that is waiting for another player. Complete that game first."
+
+    def test_unknown_player(self, client: TestClient):
+        """Test matchmaking for a player that does not exist"""
+        response = utils.find_match(client, 999)
+        assert response.status_code == 404
+        assert response.json()["detail"] == "Player not found"
+
+
+class TestMatchmakingQueue:
+    def test_load_queues_waiting_games(self, session: Session):
+        player_ids = [crud.create_player(session).id for _ in range(3)]
+        first_game = crud.create_game(session, player_ids[0])
+        second_game = crud.create_game(session, player_ids[1], 5, 5, 4)
+        crud.join_game(session, crud.create_game(session, player_ids[2]).id, player_ids[0])  # type: ignore[arg-type]
+
+        queue = MatchmakingQueue()
+        assert queue.load(session) == 2
+        assert queue.pop((5, 5, 4)) == second_game.id
+        assert queue.pop((3, 3, 3)) == first_game.id
+        assert queue.pop((3, 3, 3)) is None
@@ -0,0 +1,116 @@
+"""
+Tests for the versioned schema migrations
+"""
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel, create_engine
+
+from app import game_logic
+from app.migrations import MIGRATIONS, get_schema_version, run_migrations
+
+
+def create_test_engine():
+    return create_engine(
+        "sqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+
+
+HOT_PATH_INDEXES = ["ix_game_waiting", "ix_gameplayer_player_id", "ix_move_game_id_move_number"]
+
+
+def drop_hot_path_indexes(connection):
+    for index in HOT_PATH_INDEXES:
+        connection.exec_driver_sql(f"DROP INDEX {index}")
+
+
+def get_index_names(connection) -> list[str]:
+    rows = connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'ix_%' ORDER BY name").all()
+    return [row[0] for row in rows]
+
+
+class TestMigrations:
+    def test_fresh_database_is_migrated_to_latest_version(self):
+        engine = create_test_engine()
+        SQLModel.metadata.create_all(engine)
+
+        assert run_migrations(engine) == MIGRATIONS[-1][0]
+        with engine.connect() as connection:
+            assert get_schema_version(connection) == MIGRATIONS[-1][0]
+
+        # Running again is a no-op
+        assert run_migrations(engine) == MIGRATIONS[-1][0]
+
+    def test_add_game_board_backfills_from_moves(self):
+        engine = create_test_engine()
+        SQLModel.metadata.create_all(engine)
+
+        # Recreate the schema from before Game.board and the board size columns existed
+        with engine.begin() as connection:
+            drop_hot_path_indexes(connection)
+            for column in ("board", "board_rows", "board_cols", "win_length", "version"):
+                connection.exec_driver_sql(f"ALTER TABLE game DROP COLUMN {column}")
+            connection.exec_driver_sql("DROP INDEX ix_player_stats_version")
+            connection.exec_driver_sql("ALTER TABLE player DROP COLUMN stats_version")
+            connection.exec_driver_sql("INSERT INTO player (id, games_played, games_won, total_moves, created_at) VALUES (1, 0, 0, 0, '2025-01-01'), (2, 0, 0, 0, '2025-01-01')")
+            connection.exec_driver_sql("INSERT INTO game (id, current_turn_number, status, created_at) VALUES (1, 4, 'IN_PROGRESS', '2025-01-01'), (2, 1, 'WAITING', '2025-01-01')")
+            connection.exec_driver_sql("INSERT INTO gameplayer (game_id, player_id, joined_at, player_order) VALUES (1, 1, '2025-01-01', 1), (1, 2, '2025-01-01', 2), (2, 1, '2025-01-01', 1)")
+            connection.exec_driver_sql("INSERT INTO move (game_id, player_id, position, move_number, created_at) VALUES (1, 1, 4, 1, '2025-01-01'), (1, 2, 0, 2, '2025-01-01'), (1, 1, 8, 3, '2025-01-01')")
+
+        run_migrations(engine)
+
+        with engine.connect() as connection:
+            boards = dict(connection.exec_driver_sql("SELECT id, board FROM game").all())
+            board_sizes = connection.exec_driver_sql("SELECT board_rows, board_cols, win_length FROM game").all()
+
+        assert game_logic.decode_bitboards(boards[1]) == ((1 << 4) | (1 << 8), 1 << 0)
+        assert game_logic.decode_bitboards(boards[2]) == game_logic.EMPTY_BITBOARDS
+        assert board_sizes == [(3, 3, 3), (3, 3, 3)]
+
+    def test_add_hot_path_indexes(self):
+        engine = create_test_engine()
+        SQLModel.metadata.create_all(engine)
+
+        # A database at version 2 has none of the indexes
+        with engine.begin() as connection:
+            drop_hot_path_indexes(connection)
+            connection.exec_driver_sql("PRAGMA user_version = 2")
+            assert not set(HOT_PATH_INDEXES) & set(get_index_names(connection))
+
+        assert run_migrations(engine) == MIGRATIONS[-1][0]
+        with engine.connect() as connection:
+            assert set(HOT_PATH_INDEXES) <= set(get_index_names(connection))
+            index_sql = connection.exec_driver_sql("SELECT sql FROM sqlite_master WHERE name = 'ix_game_waiting'").scalar()
+        assert index_sql is not None and "WHERE status = 'WAITING'" in index_sql
+
+    def test_add_leaderboard_version(self):
+        engine = create_test_engine()
+        SQLModel.metadata.create_all(engine)
+
+        # A database at version 3 has no stats_version and no version row
+        with engine.begin() as connection:
+            connection.exec_driver_sql("DROP INDEX ix_player_stats_version")
+            connection.exec_driver_sql("ALTER TABLE player DROP COLUMN stats_version")
+            connection.exec_driver_sql("DROP TABLE leaderboardversion")
+            connection.exec_driver_sql("INSERT INTO player (id, games_played, games_won, total_moves, created_at) VALUES (1, 2, 1, 3, '2025-01-01')")
+            connection.exec_driver_sql("PRAGMA user_version = 3")
+
+        run_migrations(engine)
+
+        with engine.connect() as connection:
+            assert connection.exec_driver_sql("SELECT stats_version FROM player").all() == [(0,)]
+            assert connection.exec_driver_sql("SELECT id, version FROM leaderboardversion").all() == [(1, 0)]
+            assert "ix_player_stats_version" in get_index_names(connection)
+
+    def test_add_game_version(self):
+        engine = create_test_engine()
+        SQLModel.metadata.create_all(engine)
+
+        # A database at version 5 has no game version
+        with engine.begin() as connection:
+            connection.exec_driver_sql("ALTER TABLE game DROP COLUMN version")
+            connection.exec_driver_sql("INSERT INTO game (id, current_turn_number, status, board, board_rows, board_cols, win_length, created_at) VALUES (1, 3, 'IN_PROGRESS', x'', 3, 3, 3, '2025-01-01')")
+            connection.exec_driver_sql("PRAGMA user_version = 5")
+
+        run_migrations(engine)
+
+        with engine.connect() as connection:
+            assert connection.exec_driver_sql("SELECT id, version FROM game").all() == [(1, 0)]
@@ -2,6 +2,8 @@
 API tests for players endpoints
 """
 from fastapi.testclient import TestClient
+from sqlmodel import Session
+from app.models import Player
 from tests import utils
 
 
@@ -40,6 +42,40 @@ class TestCreatePlayer:
         assert player2_id == player1_id + 1  # Sequential IDs
 
 
+class TestCreatePlayersBulk:
+    """Test the POST /players/bulk endpoint"""
+
+    def test_create_players_bulk(self, client: TestClient, session: Session):
+        """Test players created in bulk are usable like players created one at a time"""
+        first_id = utils.create_player(client).json()["id"]
+
+        response = utils.create_players(client, 1000)
+        assert response.status_code == 201
+        player_ids = response.json()["player_ids"]
+        assert player_ids == list(range(first_id + 1, first_id + 1001))
+
+        player = utils.get_player(client, player_ids[-1]).json()
+        assert (player["games_played"], player["games_won"]) == (0, 0)
+        stored = session.get(Player, player_ids[0])
+        assert stored is not None and stored.created_at is not None and stored.stats_version == 0
+
+        assert utils.create_player(client).json()["id"] == player_ids[-1] + 1
+        game_id = utils.create_game(client, player_ids[0]).json()["id"]
+        assert utils.join_game(client, game_id, player_ids[1]).status_code == 200
+
+    def test_create_players_bulk_is_one_statement(self, client: TestClient, session: Session):
+        """Test the players are inserted by a single statement"""
+        with utils.count_statements(session) as statements:
+            assert utils.create_players(client, 500).status_code == 201
+        assert len(statements) == 1
+
+    def test_invalid_count(self, client: TestClient):
+        """Test count is validated"""
+        assert utils.create_players(client, 0).status_code == 422
+        assert utils.create_players(client, 100_001).status_code == 422
+        assert client.post("/players/bulk").status_code == 422
+
+
 class TestGetPlayer:
     """Test the GET /players/{player_id} endpoint"""
     
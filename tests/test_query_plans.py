@@ -0,0 +1,81 @@
+"""
+Tests that the hot path crud queries are served by their indexes, using EXPLAIN QUERY PLAN
+"""
+from typing import Callable
+
+import pytest
+from sqlalchemy import event
+from sqlmodel import Session
+
+from app import crud
+from app.models import LeaderboardMetric, Player
+
+
+def explain_query_plans(session: Session, fn: Callable, *args) -> list[str]:
+    """Run a crud function and return the query plan details of every SELECT it executed"""
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    connection = session.connection()
+    event.listen(connection, "before_cursor_execute", capture)
+    try:
+        fn(session, *args)
+    finally:
+        event.remove(connection, "before_cursor_execute", capture)
+
+    assert statements
+    details = []
+    for statement, parameters in statements:
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+        details.extend(row[3] for row in rows)
+    return details
+
+
+class TestQueryPlans:
+    def test_get_moves_for_game(self, session: Session):
+        details = explain_query_plans(session, crud.get_moves_for_game, 1)
+        assert any("USING INDEX ix_move_game_id_move_number (game_id=?)" in detail for detail in details)
+        # Moves are read in index order, no sort step
+        assert not any("TEMP B-TREE" in detail for detail in details)
+
+    def test_get_available_games(self, session: Session):
+        details = explain_query_plans(session, crud.get_available_games)
+        assert any("USING INDEX ix_game_waiting" in detail for detail in details)
+        assert "SCAN game" not in details
+
+    def test_get_available_games_page(self, session: Session):
+        details = explain_query_plans(session, crud.get_available_games, 100, 50, None, 1)
+        # The page starts at after_id in the partial index, read in id order
+        assert "SEARCH game USING INDEX ix_game_waiting (id>?)" in details
+        assert not any("TEMP B-TREE" in detail for detail in details)
+        # Excluding a player's games looks up the game_player primary key
+        assert "SEARCH gameplayer USING INDEX sqlite_autoindex_gameplayer_1 (game_id=? AND player_id=?)" in details
+
+    def test_get_player_unfinished_game(self, session: Session):
+        details = explain_query_plans(session, crud.get_player_unfinished_game, 1)
+        assert any("SEARCH gameplayer USING COVERING INDEX ix_gameplayer_player_id (player_id=?)" in detail for detail in details)
+        assert any("SEARCH game USING INTEGER PRIMARY KEY" in detail for detail in details)
+
+    def test_get_players_with_wins(self, session: Session):
+        details = explain_query_plans(session, crud.get_players_with_wins)
+        assert any("USING INDEX ix_player_rank_wins (games_won>?)" in detail for detail in details)
+
+    @pytest.mark.parametrize("metric, index", [
+        (LeaderboardMetric.WINS, "ix_player_rank_wins"),
+        (LeaderboardMetric.WIN_RATE, "ix_player_rank_win_rate"),
+        (LeaderboardMetric.EFFICIENCY, "ix_player_rank_efficiency"),
+    ])
+    def test_get_leaderboard(self, session: Session, metric: LeaderboardMetric, index: str):
+        for _ in range(30):
+            session.add(Player(games_played=2, games_won=1, total_moves=3))
+        session.flush()
+        details = explain_query_plans(session, crud.get_leaderboard, metric, 10, 20)
+        # Read in order from the rank index, the limit stops the scan
+        assert any(f"player USING INDEX {index}" in detail for detail in details)
+        # The players ahead of the page are counted on the rank index too
+        assert len(details) == 2
+        assert all(index in detail for detail in details)
+        assert not any("TEMP B-TREE" in detail for detail in details)
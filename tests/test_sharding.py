@@ -0,0 +1,137 @@
+"""
+Tests for the hash sharded game storage, see app/sharding.py
+"""
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Generator
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import Engine, event
+from sqlmodel import Session, SQLModel, select
+
+from app import crud
+from app.database import SyncDatabase, create_sqlite_engine, get_database, get_database_factory
+from app.main import app
+from app.models import Game, GamePlayer, Move, Player
+from app.schemas import GameImport
+from app.sharding import GLOBAL_SHARD, ShardedSession, shard_of
+from tests import utils
+
+SHARD_COUNT = 2
+
+
+@pytest.fixture(scope="function")
+def shards(tmp_path) -> Generator[dict, None, None]:
+    """A global database and SHARD_COUNT shard databases"""
+    engines: dict = {GLOBAL_SHARD: create_sqlite_engine(f"sqlite:///{tmp_path / 'global.db'}")}
+    for shard in range(SHARD_COUNT):
+        engines[shard] = create_sqlite_engine(f"sqlite:///{tmp_path / f'shard{shard}.db'}")
+    for engine in engines.values():
+        SQLModel.metadata.create_all(engine)
+    yield engines
+    for engine in engines.values():
+        engine.dispose()
+
+
+@pytest.fixture(scope="function")
+def sharded_session(shards: dict) -> Generator[ShardedSession, None, None]:
+    with ShardedSession(shards=shards) as session:
+        yield session
+
+
+@pytest.fixture(scope="function")
+def sharded_client(client: TestClient, shards: dict) -> TestClient:
+    """The test client with a sharded session per request"""
+    async def get_database_override() -> AsyncGenerator[SyncDatabase, None]:
+        with ShardedSession(shards=shards) as session:
+            yield SyncDatabase(session)
+
+    app.dependency_overrides[get_database] = get_database_override
+    app.dependency_overrides[get_database_factory] = lambda: asynccontextmanager(get_database_override)
+    return client
+
+
+def rows_of(engine: Engine, model) -> list:
+    with Session(engine) as session:
+        return list(session.exec(select(model)).all())
+
+
+def count_statements(engine: Engine) -> list[str]:
+    statements: list[str] = []
+    event.listen(engine, "before_cursor_execute", lambda conn, cursor, statement, *args: statements.append(statement))
+    return statements
+
+
+class TestShardedSession:
+    def test_games_are_spread_across_shards(self, shards: dict, sharded_session: ShardedSession):
+        player1_id, player2_id = crud.create_player(sharded_session).id, crud.create_player(sharded_session).id
+        games = [crud.create_game(sharded_session, player1_id) for _ in range(4)]  # type: ignore[arg-type]
+        crud.join_game(sharded_session, games[0].id, player2_id)  # type: ignore[arg-type]
+
+        # Players stay in the global database
+        assert [player.id for player in rows_of(shards[GLOBAL_SHARD], Player)] == [player1_id, player2_id]
+        assert rows_of(shards[GLOBAL_SHARD], Game) == []
+        for shard in range(SHARD_COUNT):
+            shard_games = rows_of(shards[shard], Game)
+            assert len(shard_games) == 2
+            # The game id encodes its shard, and its game players are stored with it
+            assert all(shard_of(game.id, SHARD_COUNT) == shard for game in shard_games)
+            assert {gp.game_id for gp in rows_of(shards[shard], GamePlayer)} == {game.id for game in shard_games}
+        assert len({game.id for game in games}) == 4
+
+        game = crud.get_game(sharded_session, games[0].id)  # type: ignore[arg-type]
+        assert game is not None
+        assert [gp.player_id for gp in game.game_players] == [player1_id, player2_id]
+
+    def test_statements_on_a_game_run_on_its_shard(self, shards: dict, sharded_session: ShardedSession):
+        player_id = crud.create_player(sharded_session).id
+        game = crud.create_game(sharded_session, player_id)  # type: ignore[arg-type]
+        other_shard = 1 - shard_of(game.id, SHARD_COUNT)  # type: ignore[arg-type]
+        sharded_session.expunge_all()
+
+        statements = count_statements(shards[other_shard])
+        assert crud.get_game(sharded_session, game.id) is not None  # type: ignore[arg-type]
+        crud.get_moves_for_game(sharded_session, game.id)  # type: ignore[arg-type]
+        assert statements == []
+
+    def test_fan_out_queries_merge_the_shards(self, sharded_session: ShardedSession):
+        player_ids = [crud.create_player(sharded_session).id for _ in range(5)]
+        game_ids = [crud.create_game(sharded_session, player_id).id for player_id in player_ids]  # type: ignore[arg-type]
+
+        assert [game.id for game in crud.get_available_games(sharded_session, limit=3)] == sorted(game_ids)[:3]  # type: ignore[type-var]
+        unfinished_game = crud.get_player_unfinished_game(sharded_session, player_ids[3])  # type: ignore[arg-type]
+        assert unfinished_game is not None and unfinished_game.id == game_ids[3]
+
+    def test_import_stores_games_on_one_shard(self, shards: dict, sharded_session: ShardedSession):
+        player1_id, player2_id = crud.create_player(sharded_session).id, crud.create_player(sharded_session).id
+        crud.create_game(sharded_session, player1_id)  # type: ignore[arg-type]
+        # Player 1 wins in the top row
+        game_import = GameImport(player1_id=player1_id, player2_id=player2_id, positions=[0, 3, 1, 4, 2])  # type: ignore[arg-type]
+
+        game_ids = crud.import_games(sharded_session, [(game_import, 1, b""), (game_import, 1, b"")])
+        assert game_ids[1] == game_ids[0] + SHARD_COUNT
+        shard = shard_of(game_ids[0], SHARD_COUNT)
+        assert {move.game_id for move in rows_of(shards[shard], Move)} == set(game_ids)
+        assert crud.get_player(sharded_session, player1_id).games_won == 2  # type: ignore[arg-type, union-attr]
+
+
+class TestShardedApi:
+    def test_games_are_played_on_sharded_storage(self, sharded_client: TestClient):
+        player_ids = [utils.create_player(sharded_client).json()["id"] for _ in range(4)]
+        game_ids = [utils.create_game(sharded_client, player_id).json()["id"] for player_id in player_ids[:2]]
+        assert {shard_of(game_id, SHARD_COUNT) for game_id in game_ids} == {0, 1}
+
+        available = utils.get_available_games(sharded_client).json()
+        assert [game["id"] for game in available] == sorted(game_ids)
+        # The unfinished game of player 2 is found on its shard
+        assert utils.create_game(sharded_client, player_ids[1]).status_code == 409
+
+        for game_id, player1_id, player2_id in zip(game_ids, player_ids[:2], player_ids[2:]):
+            assert utils.join_game(sharded_client, game_id, player2_id).status_code == 200
+            for response in utils.play_first_player_win_game(sharded_client, game_id, player1_id, player2_id):
+                assert response.status_code == 200
+            assert utils.get_game(sharded_client, game_id).json()["winner_id"] == player1_id
+
+        assert utils.get_player(sharded_client, player_ids[0]).json()["games_won"] == 1
+        top_players = utils.get_leaderboard_by_wins(sharded_client).json()
+        assert sorted(stats["player_id"] for stats in top_players) == player_ids[:2]
@@ -1,20 +1,35 @@
 """
 Utility functions for test helpers
 """
+from contextlib import contextmanager
+from typing import Iterator
+
 from fastapi.testclient import TestClient
 from httpx import Response
+from sqlalchemy import event
+from sqlmodel import Session
 
 
 def create_player(client: TestClient) -> Response:
     response = client.post("/players")
     return response
 
+def create_players(client: TestClient, count: int) -> Response:
+    response = client.post("/players/bulk", params={"count": count})
+    return response
+
 def get_player(client: TestClient, player_id: int) -> Response:
     response = client.get(f"/players/{player_id}")
     return response
 
-def create_game(client: TestClient, player_id: int) -> Response:
-    response = client.post("/games", json={"player_id": player_id})
+def create_game(client: TestClient, player_id: int, **board_settings: int) -> Response:
+    """board_settings are the optional board_rows, board_cols and win_length"""
+    response = client.post("/games", json={"player_id": player_id, **board_settings})
+    return response
+
+
+def import_games(client: TestClient, games: list[dict]) -> Response:
+    response = client.post("/games/import", json={"games": games})
     return response
 
 
@@ -22,12 +37,18 @@ def join_game(client: TestClient, game_id: int, player_id: int) -> Response:
     response = client.post(f"/games/{game_id}/join", json={"player_id": player_id})
     return response
 
-def get_game(client: TestClient, game_id: int) -> Response:
-    response = client.get(f"/games/{game_id}")
+def get_game(client: TestClient, game_id: int, **params) -> Response:
+    """params are the optional long polling wait_for_turn, since_turn and timeout"""
+    response = client.get(f"/games/{game_id}", params=params)
     return response
 
-def get_available_games(client: TestClient) -> Response:
-    response = client.get("/games/available")
+def get_available_games(client: TestClient, **params) -> Response:
+    response = client.get("/games/available", params=params)
+    return response
+
+def find_match(client: TestClient, player_id: int, **board_settings: int) -> Response:
+    """board_settings are the optional board_rows, board_cols and win_length"""
+    response = client.post("/matchmaking", json={"player_id": player_id, **board_settings})
     return response
 
 def make_move(client: TestClient, game_id: int, player_id: int, position: int) -> Response:
@@ -38,6 +59,11 @@ def make_move(client: TestClient, game_id: int, player_id: int, position: int) -
     return response
 
 
+def connect_game(client: TestClient, game_id: int):
+    """WebSocket of a game's live state, used as a context manager"""
+    return client.websocket_connect(f"/games/{game_id}/ws")
+
+
 def play_moves_sequence(client: TestClient, game_id: int, moves: list[tuple[int, int]]) -> list[Response]:
     """
     Play a sequence of moves in a game.
@@ -61,14 +87,41 @@ def play_draw_game(client: TestClient, game_id: int, player1_id: int, player2_id
     moves = [(player1_id, 1), (player2_id, 0), (player1_id, 3), (player2_id, 2), (player1_id, 4), (player2_id, 5), (player1_id, 6), (player2_id, 7), (player1_id, 8)]
     return play_moves_sequence(client, game_id, moves)
 
-def get_leaderboard_by_wins(client: TestClient) -> Response:
-    response = client.get("/leaderboard/wins")
+def get_leaderboard(client: TestClient, **params) -> Response:
+    response = client.get("/leaderboard", params=params)
     return response
 
-def get_leaderboard_by_win_rate(client: TestClient) -> Response:
-    response = client.get("/leaderboard/win_rate")
+def get_leaderboard_by_wins(client: TestClient, **params) -> Response:
+    response = client.get("/leaderboard/wins", params=params)
     return response
 
-def get_leaderboard_by_efficiency(client: TestClient) -> Response:
-    response = client.get("/leaderboard/efficiency")
-    return response
\ No newline at end of file
+def get_leaderboard_by_win_rate(client: TestClient, **params) -> Response:
+    response = client.get("/leaderboard/win_rate", params=params)
+    return response
+
+def get_leaderboard_by_efficiency(client: TestClient, **params) -> Response:
+    response = client.get("/leaderboard/efficiency", params=params)
+    return response
+
+
+@contextmanager
+def count_statements(session: Session) -> Iterator[list[str]]:
+    """
+    Collect the SQL statements executed on the session's connection.
+
+    Example:
+        with count_statements(session) as statements:
+            get_available_games(client)
+        assert len(statements) == 2
+    """
+    statements: list[str] = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    connection = session.connection()
+    event.listen(connection, "before_cursor_execute", capture)
+    try:
+        yield statements
+    finally:
+        event.remove(connection, "before_cursor_execute", capture)